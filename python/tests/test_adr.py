@@ -0,0 +1,70 @@
+import time
+
+import ulora
+from ulora_adr import Adr, KIND_ADR, _PROPOSE
+
+from conftest import wait_for
+
+
+def _heard(sender, receiver, count):
+    receiver.set_mode_rx()
+    for i in range(count):
+        sender.send(b"m%d" % i, receiver._this_address)
+        sender.wait_packet_sent()
+
+
+def test_select_follows_the_link(channel, make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    adr = Adr(b)
+
+    channel.set_link(a._transport, b._transport, snr=9.0, rssi=-60.0)
+    _heard(a, b, 4)
+    assert wait_for(lambda: adr.links.get(1) and adr.links[1].samples == 4)
+    # a strong link keeps the fastest preset
+    assert adr.select() == ulora.ModemConfig.Bw500Cr45Sf128
+
+    adr.links[1].clear()
+    channel.set_link(a._transport, b._transport, snr=-4.0, rssi=-120.0)
+    _heard(a, b, 4)
+    assert wait_for(lambda: adr.links[1].samples == 4)
+    preset = adr.select()
+    assert preset != ulora.ModemConfig.Bw500Cr45Sf128
+    assert adr.margin_at(1, preset) >= adr.margin
+    # and it is the fastest that does
+    faster = adr.presets[:adr.presets.index(preset)]
+    assert all(adr.margin_at(1, other) < adr.margin for other in faster)
+
+
+def test_negotiate(make_lora):
+    a = make_lora(1, acks=True)
+    b = make_lora(2, acks=True)
+    adr_a = Adr(a)
+    adr_b = Adr(b)
+    b.set_mode_rx()
+
+    assert adr_a.negotiate(2, ulora.ModemConfig.Bw125Cr45Sf128)
+    assert a.modem_config == ulora.ModemConfig.Bw125Cr45Sf128
+    assert wait_for(lambda: adr_b.switches == 1)
+    assert b.modem_config == ulora.ModemConfig.Bw125Cr45Sf128
+    assert adr_a.switches == 1
+
+    # and they still hear each other
+    assert a.send_to_wait(b"after", 2)
+
+
+def test_fallback_without_confirm(make_lora):
+    b = make_lora(2, acks=True)
+    adr = Adr(b, fallback=0.05)
+    b.set_mode_rx()
+
+    proposal = bytes((_PROPOSE,)) + bytes(ulora.ModemConfig.Bw125Cr45Sf128)
+    b._receive(bytes((2, 1, 9, KIND_ADR)) + proposal, 0, 0)
+    assert wait_for(lambda: b.modem_config == ulora.ModemConfig.Bw125Cr45Sf128)
+    assert not adr.poll()
+
+    # no CONFIRM in time: back to where it was
+    time.sleep(0.1)
+    assert adr.poll()
+    assert b.modem_config == ulora.ModemConfig.Bw500Cr45Sf128
+    assert adr.failed == 1
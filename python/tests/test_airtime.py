@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+import ulora
+
+
+def test_time_on_air():
+    # SX127x datasheet / Semtech calculator: SF7, 125 kHz, 4/5, CRC on, 8 symbol preamble
+    assert ulora.time_on_air(ulora.ModemConfig.Bw125Cr45Sf128, 14) == pytest.approx(0.046336)
+    # low data rate optimisation at SF12
+    assert ulora.time_on_air(ulora.ModemConfig.Bw125Cr48Sf4096, 14) == pytest.approx(1.449984)
+    # whole symbols: bytes that fit in the last one cost nothing
+    config = ulora.ModemConfig.Bw500Cr45Sf128
+    assert ulora.time_on_air(config, 10) == ulora.time_on_air(config, 12)
+    assert ulora.time_on_air(config, 12) < ulora.time_on_air(config, 13)
+
+
+def test_timeouts_follow_the_settings(make_lora):
+    a = make_lora(1)
+    b = make_lora(2, modem_config=ulora.ModemConfig.Bw125Cr45Sf2048)
+    a.ack_turnaround = b.ack_turnaround = 0
+    assert b._ack_timeout() > 10 * a._ack_timeout()
+
+    a.retry_timeout = 0.5
+    assert a._ack_timeout() == 0.5
+
+
+def test_wait_packet_sent_covers_a_long_frame(make_lora):
+    a = make_lora(1, modem_config=ulora.ModemConfig.Bw125Cr45Sf128)
+    start = time.time()
+    a.send(bytes(200), 2)
+    assert a.wait_packet_sent()
+    assert time.time() - start >= a.time_on_air(200)
+
+    # an override that is too short gives up while the frame is still on the air
+    a.wait_packet_sent_timeout = 0.01
+    a.send(bytes(200), 2)
+    assert not a.wait_packet_sent()
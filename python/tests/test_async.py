@@ -0,0 +1,41 @@
+import asyncio
+
+from ulora_async import AsyncLoRa
+
+
+async def _take(lora, count):
+    got = []
+    async for payload in lora.packets():
+        got.append(payload)
+        if len(got) == count:
+            return got
+
+
+def test_send_to_wait_and_packets(make_lora):
+    a = make_lora(1, cls=AsyncLoRa, acks=True)
+    b = make_lora(2, cls=AsyncLoRa, acks=True)
+
+    async def main():
+        b.set_mode_rx()
+        b.start()
+        acked = [await a.send_to_wait(b"m%d" % i, 2) for i in range(3)]
+        got = await asyncio.wait_for(_take(b, 3), 5)
+        a.close()
+        b.close()
+        return acked, got
+
+    acked, got = asyncio.run(main())
+    assert acked == [True, True, True]
+    assert [payload.message for payload in got] == [b"m0", b"m1", b"m2"]
+
+
+def test_send_to_wait_unanswered(make_lora):
+    a = make_lora(1, cls=AsyncLoRa, acks=True)
+
+    async def main():
+        acked = await a.send_to_wait(b"anyone?", 2, retries=1)
+        a.close()
+        return acked
+
+    assert not asyncio.run(main())
+
@@ -0,0 +1,49 @@
+import time
+
+import ulora
+
+
+def test_retry_deduplicated(make_lora):
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+
+    b._receive(b"\x02\x01\x07\x00hello", 0, 0)
+    # the sender missed our ack and tries again under the same header_id
+    b._receive(b"\x02\x01\x07" + bytes((ulora.FLAGS_RETRY,)) + b"hello", 0, 0)
+    assert [payload.message for payload in got] == [b"hello"]
+    assert b.rx_duplicates == 1
+
+    # a new header_id is new data, retry flag or not
+    b._receive(b"\x02\x01\x08" + bytes((ulora.FLAGS_RETRY,)) + b"again", 0, 0)
+    assert [payload.message for payload in got] == [b"hello", b"again"]
+
+
+def test_senders_kept_apart(make_lora):
+    b = make_lora(2, dedupe=2)
+    got = []
+    b.on_recv = got.append
+
+    for sender in (1, 3, 1):
+        b._receive(bytes((2, sender, 7, ulora.FLAGS_RETRY)) + b"m", 0, 0)
+    assert len(got) == 2
+    # a third sender pushes out the one heard least recently (3)
+    b._receive(b"\x02\x04\x07\x00m", 0, 0)
+    for sender in (4, 1, 3):
+        b._receive(bytes((2, sender, 7, ulora.FLAGS_RETRY)) + b"m", 0, 0)
+    assert [payload.header_from for payload in got] == [1, 3, 4, 3]
+    assert b.rx_duplicates == 3
+
+
+def test_send_to_wait_over_lossy_acks(channel, make_lora):
+    a = make_lora(1, acks=True)
+    b = make_lora(2, acks=True)
+    channel.set_link(b._transport, a._transport, loss=0.5, symmetric=False)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    acked = sum(a.send_to_wait(b"m%d" % i, 2, retries=5) for i in range(10))
+    time.sleep(0.05)
+    assert acked == 10
+    assert [payload.message for payload in got] == [b"m%d" % i for i in range(10)]
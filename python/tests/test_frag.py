@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import ulora
+from ulora_async import AsyncLoRa
+from ulora_frag import Fragmenter
+
+
+def _fragment(header_id, index, count, total, data):
+    # raw fragment frame from node 1 to node 2
+    return bytes((2, 1, header_id, ulora.KIND_FRAGMENT, index, count - 1, total >> 8, total & 0xff)) + data
+
+
+def test_fragments_reassembled(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    Fragmenter(b, max_size=4096)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    message = bytes(i & 0xff for i in range(1000))
+    assert Fragmenter(a).send(message, 2)
+    time.sleep(0.1)
+    assert [payload.message for payload in got] == [message]
+    assert got[0].header_flags & ulora.FLAGS_KIND_MASK == 0
+
+
+def test_fragments_out_of_order(make_lora):
+    b = make_lora(2)
+    frag = Fragmenter(b)
+    got = []
+    b.on_recv = got.append
+
+    b._receive(_fragment(5, 1, 2, 20, b"klmnopqrst"), 0, 0)
+    b._receive(_fragment(5, 0, 2, 20, b"abcdefghij"), 0, 0)
+    assert [payload.message for payload in got] == [b"abcdefghijklmnopqrst"]
+    assert frag.completed == 1
+
+
+def test_fragment_slot_expires(make_lora):
+    b = make_lora(2)
+    frag = Fragmenter(b, slots=1, timeout=0.02)
+    got = []
+    b.on_recv = got.append
+
+    b._receive(_fragment(5, 0, 2, 20, b"abcdefghij"), 0, 0)
+    # the only slot is busy: another transfer is dropped
+    b._receive(_fragment(6, 0, 1, 3, b"xyz"), 0, 0)
+    assert frag.dropped == 1
+
+    time.sleep(0.05)
+    frag.expire()
+    assert frag.expired == 1
+    # the slot is free again, and the late half of the expired transfer starts over on its own
+    b._receive(_fragment(6, 0, 1, 3, b"xyz"), 0, 0)
+    b._receive(_fragment(5, 1, 2, 20, b"klmnopqrst"), 0, 0)
+    assert [payload.message for payload in got] == [b"xyz"]
+
+
+def test_async_receiver(make_lora):
+    a = make_lora(1, acks=True)
+    b = make_lora(2, cls=AsyncLoRa, acks=True)
+    Fragmenter(b)
+    message = bytes(i & 0xff for i in range(768))
+
+    async def take(count):
+        got = []
+        async for payload in b.packets():
+            got.append(payload)
+            if len(got) == count:
+                return got
+
+    async def main():
+        b.set_mode_rx()
+        b.start()
+        loop = asyncio.get_running_loop()
+        sent = await loop.run_in_executor(None, Fragmenter(a).send, message, 2)
+        acked = await loop.run_in_executor(None, a.send_to_wait, b"plain", 2)
+        got = await asyncio.wait_for(take(2), 10)
+        b.close()
+        return sent, acked, got
+
+    sent, acked, got = asyncio.run(main())
+    assert sent and acked
+    # the fragments came out of packets() as one message, not one by one
+    assert [payload.message for payload in got] == [message, b"plain"]
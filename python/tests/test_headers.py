@@ -0,0 +1,56 @@
+import pytest
+
+import ulora
+
+from conftest import wait_for
+
+
+def test_implicit_header_round_trip(make_lora):
+    a = make_lora(1, fixed_length=16)
+    b = make_lora(2, fixed_length=16)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"reading", 2)
+    a.wait_packet_sent()
+    assert wait_for(lambda: got)
+    # zero padded up to the fixed length
+    assert [payload.message for payload in got] == [b"reading" + bytes(5)]
+    assert a.max_payload == 12
+    # the implicit header saves a symbol here
+    assert a.time_on_air(12) < make_lora(3).time_on_air(12)
+
+
+def test_compact_header_round_trip(make_lora):
+    a = make_lora(1, compact=True, acks=True)
+    b = make_lora(2, compact=True, acks=True)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    for i in range(20):
+        assert a.send_to_wait(b"m%d" % i, 2)
+    assert wait_for(lambda: len(got) == 20)
+    assert [payload.message for payload in got] == [b"m%d" % i for i in range(20)]
+    # 4 bit header_ids wrap
+    assert {payload.header_id for payload in got} == set(range(16))
+    assert got[0].header_from == 1
+
+
+def test_compact_broadcast(make_lora):
+    a = make_lora(1, compact=True)
+    b = make_lora(2, compact=True, receive_all=True)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"all", ulora.BROADCAST_ADDRESS)
+    a.wait_packet_sent()
+    assert wait_for(lambda: got)
+    assert got[0].header_to == ulora.BROADCAST_ADDRESS
+
+
+def test_compact_addresses(make_lora):
+    with pytest.raises(ValueError):
+        make_lora(15, compact=True)
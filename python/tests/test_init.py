@@ -0,0 +1,42 @@
+from conftest import wait_for
+
+
+def test_warm_start(channel, make_lora):
+    transport = channel.radio("warm")
+    make_lora(1, transport=transport)
+
+    again = make_lora(1, transport=transport, warm_start=True)
+    assert again.warm_started
+
+    moved = make_lora(1, transport=transport, warm_start=True, freq=915.0)
+    assert not moved.warm_started
+
+    cold = make_lora(1, transport=channel.radio("cold"), warm_start=True)
+    assert not cold.warm_started
+
+
+def test_warm_start_skips_the_writes(channel, make_lora):
+    transport = channel.radio("warm")
+    make_lora(1, transport=transport)
+    before = transport.spi_transactions
+    make_lora(1, transport=transport)
+    cold = transport.spi_transactions - before
+
+    before = transport.spi_transactions
+    make_lora(1, transport=transport, warm_start=True)
+    assert transport.spi_transactions - before < cold / 2
+
+
+def test_warm_started_radio_works(channel, make_lora):
+    a = make_lora(1)
+    transport = channel.radio("warm")
+    make_lora(2, transport=transport)
+    b = make_lora(2, transport=transport, warm_start=True)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"awake", 2)
+    a.wait_packet_sent()
+    assert wait_for(lambda: got)
+    assert [payload.message for payload in got] == [b"awake"]
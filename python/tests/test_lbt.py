@@ -0,0 +1,49 @@
+import ulora
+
+from conftest import wait_for
+
+
+def test_clear_channel(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    # shorter than any backoff: the first CAD still happens
+    a.cad_timeout = 0.0001
+    assert a.send(b"clear", 2)
+    assert a.cad_idle == 1 and a.cad_busy == 0
+    a.wait_packet_sent()
+    assert wait_for(lambda: got)
+
+
+def test_busy_channel(make_lora):
+    a = make_lora(1)
+    c = make_lora(3)
+    length = c.time_on_air(200)
+
+    c.send(bytes(200), 2)
+    # gives up while the other frame is on the air
+    a.cad_timeout = length / 4
+    assert not a.wait_cad()
+    assert a.cad_busy >= 1 and a.cad_failures == 1
+    c.wait_packet_sent()
+
+    c.send(bytes(200), 2)
+    # waits it out
+    a.cad_timeout = 20 * length
+    assert a.wait_cad()
+    assert a.cad_idle == 1
+    assert c._mode != ulora.MODE_TX
+
+
+def test_backoff_window(make_lora):
+    a = make_lora(1)
+    slot = a.backoff_slot * ulora.symbol_time(a.modem_config)
+    for attempt in (0, 3, 10):
+        exponent = min(a.backoff_min + attempt, a.backoff_max)
+        delays = [a._backoff_time(attempt) for _ in range(200)]
+        assert max(delays) <= ((1 << exponent) - 1) * slot
+        # and spread over most of it
+        assert max(delays) > ((1 << exponent) - 1) * slot / 2
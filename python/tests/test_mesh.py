@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from ulora_mesh import Mesh
+
+from conftest import wait_for
+
+
+@pytest.fixture
+def chain(channel, make_lora):
+    # nodes 1 - 2 - 3, each in range of its neighbours only, their meshes serviced from a thread
+    nodes = [make_lora(i + 1, acks=True, receive_all=True) for i in range(3)]
+    channel.set_link(nodes[0]._transport, nodes[2]._transport, loss=1.0)
+    meshes = [Mesh(node) for node in nodes]
+    for node in nodes:
+        node.set_mode_rx()
+    running = [True]
+
+    def run():
+        while running[0]:
+            if not sum(mesh.service() for mesh in meshes):
+                time.sleep(0.001)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    yield nodes, meshes
+    running[0] = False
+    thread.join()
+
+
+def test_route_discovery(chain):
+    nodes, meshes = chain
+    got = []
+    nodes[2].on_recv = got.append
+
+    assert meshes[0].send(b"first", 3)
+    assert wait_for(lambda: got)
+    assert meshes[0].discoveries == 1
+    # the request found 3 through 2, and the reply set up the way there
+    assert meshes[0].routes[3][:2] == [2, 2]
+    assert meshes[2].routes[1][:2] == [2, 2]
+    assert meshes[1].forwarded >= 1
+
+    assert meshes[0].send(b"second", 3)
+    assert wait_for(lambda: len(got) == 2)
+    assert meshes[0].discoveries == 1 and meshes[0].route_hits >= 1
+    # header_from is where the message started, not the last hop
+    assert [(payload.message, payload.header_from) for payload in got] == [(b"first", 1), (b"second", 1)]
+
+
+def test_unreachable(chain):
+    nodes, meshes = chain
+    meshes[0].timeout = 0.1
+    # 4 doesn't exist: the request floods, nobody answers
+    assert meshes[0].send(b"lost", 4)
+    assert wait_for(lambda: meshes[0].dropped == 1)
+    assert 4 not in meshes[0].routes
+
+
+def test_deferred_refused(make_lora):
+    with pytest.raises(ValueError):
+        Mesh(make_lora(1, deferred=True))
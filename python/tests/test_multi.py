@@ -0,0 +1,65 @@
+import ulora
+from ulora_multi import MultiRadio
+
+from conftest import wait_for
+
+
+def _gateway(make_lora, tx_queue=4, queue_size=16, **kwargs):
+    # two radios of node 9 on different channels, and a peer on each; kwargs for the peers
+    radios = [make_lora(9, freq=902.3, tx_queue=tx_queue), make_lora(9, freq=903.1, tx_queue=tx_queue)]
+    return MultiRadio(radios, queue_size), make_lora(1, freq=902.3, **kwargs), make_lora(2, freq=903.1, **kwargs)
+
+
+def test_routes_follow_the_sender(make_lora):
+    multi, p1, p2 = _gateway(make_lora)
+    multi.listen()
+
+    p2.send(b"from 2", 9)
+    p2.wait_packet_sent()
+    p1.send(b"from 1", 9)
+    p1.wait_packet_sent()
+    assert wait_for(lambda: multi.pending == 2)
+    received = [multi.receive(), multi.receive()]
+    assert [(index, payload.message) for index, payload in received] == [(1, b"from 2"), (0, b"from 1")]
+    assert multi.receive() is None
+    assert multi.pick(1) == 0 and multi.pick(2) == 1
+
+    got = []
+    p1.on_recv = got.append
+    p2.on_recv = got.append
+    p1.set_mode_rx()
+    p2.set_mode_rx()
+    assert multi.send(b"to 2", 2)
+    assert multi.send(b"to 1", 1)
+    assert wait_for(lambda: len(got) == 2)
+    assert sorted(payload.message for payload in got) == [b"to 1", b"to 2"]
+    assert multi.sent == [1, 1]
+
+
+def test_broadcast_on_every_radio(make_lora):
+    multi, p1, p2 = _gateway(make_lora, receive_all=True)
+    got = []
+    p1.on_recv = got.append
+    p2.on_recv = got.append
+    p1.set_mode_rx()
+    p2.set_mode_rx()
+
+    assert multi.send(b"all", ulora.BROADCAST_ADDRESS)
+    assert wait_for(lambda: len(got) == 2)
+    assert multi.sent == [1, 1]
+
+
+def test_unknown_peers_spread(make_lora):
+    multi, _, _ = _gateway(make_lora)
+    # round robin over idle radios
+    assert [multi.pick(5) for _ in range(4)] == [0, 1, 0, 1]
+
+
+def test_shared_queue_overflow(make_lora):
+    multi, p1, _ = _gateway(make_lora, tx_queue=0, queue_size=2)
+    multi.listen()
+    for i in range(3):
+        p1.send(b"m%d" % i, 9)
+        p1.wait_packet_sent()
+    assert wait_for(lambda: multi.packets_dropped == 1)
+    assert [payload.message for _, payload in (multi.receive(), multi.receive())] == [b"m1", b"m2"]
@@ -0,0 +1,63 @@
+import pytest
+
+import ulora
+
+from conftest import wait_for
+
+
+def test_enqueue_needs_tx_queue(make_lora):
+    a = make_lora(1)
+    with pytest.raises(ValueError):
+        a.enqueue(b"x", 2)
+
+
+def test_priority_order(make_lora):
+    a = make_lora(1, tx_queue=4)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    # queued behind a frame on the air
+    a.send(b"first" * 20, 2)
+    assert a.enqueue(b"low", 2, ulora.PRIORITY_LOW)
+    assert a.enqueue(b"normal 1", 2)
+    assert a.enqueue(b"high", 2, ulora.PRIORITY_HIGH)
+    assert a.enqueue(b"normal 2", 2)
+    assert a.tx_pending == 4
+    assert wait_for(lambda: len(got) == 5)
+    assert [payload.message for payload in got] == [b"first" * 20, b"high", b"normal 1", b"normal 2", b"low"]
+    assert wait_for(lambda: a.tx_pending == 0 and a._mode != ulora.MODE_TX)
+
+
+def test_full_queue(make_lora):
+    a = make_lora(1, tx_queue=2)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"first" * 20, 2)
+    assert a.enqueue(b"low 1", 2, ulora.PRIORITY_LOW)
+    assert a.enqueue(b"low 2", 2, ulora.PRIORITY_LOW)
+    # the newest low priority frame makes room
+    assert a.enqueue(b"high", 2, ulora.PRIORITY_HIGH)
+    # nothing below this one left to drop
+    assert not a.enqueue(b"low 3", 2, ulora.PRIORITY_LOW)
+    assert a.tx_dropped == 2
+    assert wait_for(lambda: len(got) == 3)
+    assert [payload.message for payload in got] == [b"first" * 20, b"high", b"low 1"]
+
+
+def test_queue_drained_after_cad(make_lora):
+    a = make_lora(1, tx_queue=4)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    # enqueue leaves a running CAD alone, CadDone has to start the frame
+    a.set_mode_cad()
+    a.enqueue(b"queued", 2)
+    assert wait_for(lambda: got, 1)
+    assert [payload.message for payload in got] == [b"queued"]
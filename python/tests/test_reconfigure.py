@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import ulora
+from ulora_async import AsyncLoRa
+
+from conftest import wait_for
+
+
+def test_only_changes_written(make_lora):
+    a = make_lora(1)
+    transport = a._transport
+    assert a.reconfigure() == 0
+    assert a.reconfigure(freq=902.3, tx_power=14) == 0
+
+    # Frf is three adjacent registers: one burst
+    before = transport.spi_transactions
+    assert a.reconfigure(freq=915.0) == 3
+    assert transport.spi_transactions == before + 1
+    frf = int(915.0 * 1000000.0 / ulora.FSTEP)
+    assert transport.read(0x06, 3) == bytes(((frf >> 16) & 0xff, (frf >> 8) & 0xff, frf & 0xff))
+
+    # only the bandwidth differs between these two
+    assert a.reconfigure(modem_config=ulora.ModemConfig.Bw125Cr45Sf128) == 1
+    assert transport.read_reg(0x1d) == ulora.ModemConfig.Bw125Cr45Sf128[0]
+    assert a.modem_config == ulora.ModemConfig.Bw125Cr45Sf128
+
+
+def test_out_of_range_rejected(make_lora):
+    a = make_lora(1)
+    for kwargs in (dict(freq=100.0), dict(tx_power=30), dict(preamble=2), dict(modem_config=(0xa2, 0x74, 0x04))):
+        with pytest.raises(ValueError):
+            a.reconfigure(**kwargs)
+    # nothing half applied
+    assert a.reconfigure(freq=902.3, tx_power=14, preamble=8, modem_config=ulora.ModemConfig.Bw500Cr45Sf128) == 0
+
+
+def test_listening_resumed(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    b.reconfigure(freq=915.0)
+    a.reconfigure(freq=915.0)
+    a.send(b"moved", 2)
+    a.wait_packet_sent()
+    assert wait_for(lambda: got)
+    assert [payload.message for payload in got] == [b"moved"]
+
+
+def test_after_async_send(make_lora):
+    a = make_lora(1, cls=AsyncLoRa)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    async def main():
+        await a.send(b"x" * 200, 2)
+        # synchronous, and not to cut the frame on the air short
+        a.reconfigure(tx_power=20)
+        await asyncio.sleep(0.05)
+        a.close()
+
+    asyncio.run(main())
+    assert [payload.message for payload in got] == [b"x" * 200]
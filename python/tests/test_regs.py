@@ -0,0 +1,39 @@
+import pytest
+
+import ulora
+from ulora_regs import Snapshot, diff
+
+
+def test_decode(make_lora):
+    a = make_lora(1)
+    decoded = a.snapshot().decode()
+    assert decoded["RegOpMode"]["LongRangeMode"] == 1
+    assert decoded["RegModemConfig1"]["Bw"] == 9
+    assert decoded["RegModemConfig2"]["SpreadingFactor"] == 7
+    assert decoded["PreambleLength"] == 8
+    assert decoded["CarrierMHz"] == pytest.approx(902.3, abs=1e-4)
+
+
+def test_one_burst(make_lora):
+    a = make_lora(1)
+    before = a._transport.spi_transactions
+    snap = Snapshot.read(a._transport)
+    assert a._transport.spi_transactions == before + 1
+    assert snap[0x42] == a._transport.read_reg(0x42)
+
+
+def test_diff(make_lora):
+    a = make_lora(1)
+    before = a.snapshot()
+    a.reconfigure(modem_config=ulora.ModemConfig.Bw125Cr45Sf128, preamble=12)
+    a.set_mode_rx()
+    after = a.snapshot()
+
+    changes = diff(before, after)
+    assert changes == {
+        "RegModemConfig1": {"value": (0x92, 0x72), "Bw": (9, 7)},
+        "RegPreambleLsb": {"value": (8, 12)},
+    }
+    # the op mode is the chip's to change
+    assert "RegOpMode" in before.diff(after, volatile=True)
+    assert diff(after, after) == {}
@@ -0,0 +1,59 @@
+import time
+
+import ulora
+
+from conftest import wait_for
+
+
+def _received(sender, receiver, data, header_to):
+    # SPI transactions the receiver spent on one frame
+    receiver.set_mode_rx()
+    before = receiver._transport.spi_transactions
+    sender.send(data, header_to)
+    sender.wait_packet_sent()
+    assert wait_for(lambda: receiver._transport.spi_transactions != before)
+    # and nothing more after it
+    time.sleep(0.02)
+    return receiver._transport.spi_transactions - before
+
+
+def test_three_transactions_per_frame(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+
+    # status burst, FIFO pointer and flags in one write, the payload
+    assert _received(a, b, bytes(range(100)), 2) == 3
+    assert [payload.message for payload in got] == [bytes(range(100))]
+
+
+def test_three_transactions_deferred(make_lora):
+    a = make_lora(1)
+    b = make_lora(2, deferred=True)
+    b.schedule = None
+    got = []
+    b.on_recv = got.append
+
+    assert _received(a, b, b"deferred", 2) == 3
+    b.service()
+    assert [payload.message for payload in got] == [b"deferred"]
+
+
+def test_crc_errors_dropped(make_lora):
+    # slow enough that the second send starts well within the first frame
+    config = ulora.ModemConfig.Bw125Cr45Sf128
+    a = make_lora(1, modem_config=config)
+    c = make_lora(3, modem_config=config)
+    b = make_lora(2, modem_config=config)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    # two frames on the air at once, the one the receiver locked on to fails its payload CRC
+    a.send(bytes(200), 2)
+    c.send(bytes(200), 2)
+    a.wait_packet_sent()
+    c.wait_packet_sent()
+    assert wait_for(lambda: b.crc_errors == 1)
+    assert got == []
@@ -0,0 +1,55 @@
+from conftest import wait_for
+
+_REG_09_PA_CONFIG = 0x09
+_REG_12_IRQ_FLAGS = 0x12
+_REG_1D_MODEM_CONFIG1 = 0x1d
+
+
+def test_unchanged_writes_skipped(make_lora):
+    a = make_lora(1, shadow=True)
+    transport = a._transport
+    value = a._spi_read(_REG_09_PA_CONFIG)
+    hits, before = a.shadow_hits, transport.spi_transactions
+
+    a._spi_write(_REG_09_PA_CONFIG, value)
+    assert a._spi_read(_REG_1D_MODEM_CONFIG1) == transport.read_reg(_REG_1D_MODEM_CONFIG1)
+    # both served from the shadow, the read_reg above is the only transaction
+    assert a.shadow_hits == hits + 2
+    assert transport.spi_transactions == before + 1
+
+    a._spi_write(_REG_09_PA_CONFIG, value ^ 0x01)
+    assert transport.read_reg(_REG_09_PA_CONFIG) == value ^ 0x01
+
+
+def test_volatile_registers_go_to_the_chip(make_lora):
+    a = make_lora(1, shadow=True)
+    before = a.shadow_hits
+    a._spi_read(_REG_12_IRQ_FLAGS)
+    a._spi_read(_REG_12_IRQ_FLAGS)
+    assert a.shadow_hits == before
+
+
+def test_invalidate(make_lora):
+    a = make_lora(1, shadow=True)
+    transport = a._transport
+    # the chip changed behind the driver's back, e.g. a reset
+    transport.write_reg(_REG_09_PA_CONFIG, 0x4f)
+    assert a._spi_read(_REG_09_PA_CONFIG) != 0x4f
+
+    a.invalidate()
+    assert a._spi_read(_REG_09_PA_CONFIG) == 0x4f
+
+
+def test_shadowed_radios_talk(make_lora):
+    a = make_lora(1, shadow=True)
+    b = make_lora(2, shadow=True)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    for i in range(3):
+        a.send(b"m%d" % i, 2)
+        a.wait_packet_sent()
+    assert wait_for(lambda: len(got) == 3)
+    # the sender rewrites the same DIO mapping for every frame
+    assert a.shadow_hits >= 2
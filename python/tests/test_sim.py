@@ -0,0 +1,48 @@
+import ulora
+
+from conftest import wait_for
+
+
+def test_frame_delivered(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"hello", 2, header_id=7)
+    assert a.wait_packet_sent()
+    assert wait_for(lambda: got)
+    payload = got[0]
+    assert (payload.message, payload.header_to, payload.header_from, payload.header_id) == (b"hello", 2, 1, 7)
+
+
+def test_address_filter(make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    c = make_lora(3, receive_all=True)
+    got_b, got_c = [], []
+    b.on_recv = got_b.append
+    c.on_recv = got_c.append
+    b.set_mode_rx()
+    c.set_mode_rx()
+
+    a.send(b"for c", 3)
+    a.send(b"for all", ulora.BROADCAST_ADDRESS)
+    a.wait_packet_sent()
+    assert wait_for(lambda: len(got_c) == 2)
+    # broadcasts too only reach receive_all nodes
+    assert got_b == []
+
+
+def test_lost_link(channel, make_lora):
+    a = make_lora(1)
+    b = make_lora(2)
+    channel.set_link(a._transport, b._transport, loss=1.0)
+    got = []
+    b.on_recv = got.append
+    b.set_mode_rx()
+
+    a.send(b"hello", 2)
+    assert a.wait_packet_sent()
+    assert not wait_for(lambda: got, 0.1)
@@ -0,0 +1,43 @@
+import ulora
+
+from conftest import wait_for
+
+
+def test_histogram():
+    hist = ulora.Histogram(8)
+    for value in (0, 1, 2, 3, 4, 1000, -5):
+        hist.add(value)
+    # zero (and below), 1, 2-3, 4-7, ..., everything from 64 up in the last bucket
+    assert hist.snapshot() == {"count": 7, "max": 1000, "buckets": [2, 1, 2, 1, 0, 0, 0, 1]}
+
+    linear = ulora.Histogram(4, linear=True)
+    for value in (0, 1, 1, 7):
+        linear.add(value)
+    assert linear.buckets == [1, 2, 0, 1]
+
+
+def test_stats(make_lora):
+    a = make_lora(1, acks=True)
+    b = make_lora(2, acks=True)
+    c = make_lora(3)
+    b.set_mode_rx()
+    c.set_mode_rx()
+
+    for i in range(4):
+        assert a.send_to_wait(b"m%d" % i, 2)
+    assert not a.send_to_wait(b"lost", 4, retries=1)
+    # c heard the 4 frames for b, b's 4 acks and the 2 tries for nobody
+    assert wait_for(lambda: c.stats()["rx_filtered"] == 10)
+
+    stats = a.stats()
+    assert stats["tx_packets"] == 6 and stats["tx_retries"] == 1
+    assert stats["ack_timeouts"] == 2
+    assert stats["ack_rtt_us"]["count"] == 4
+    assert stats["retries"]["buckets"][:3] == [4, 0, 1]
+    assert stats["spi_transactions"] > 0 and stats["spi_bytes"] > stats["spi_transactions"]
+    assert b.stats()["rx_packets"] == 4
+
+    a.stats(reset=True)
+    stats = a.stats()
+    assert stats["tx_packets"] == 0 and stats["spi_transactions"] == 0
+    assert stats["ack_rtt_us"]["count"] == 0
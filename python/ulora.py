@@ -1,306 +1,223 @@
 import time
 import math
-from ucollections import namedtuple
-from urandom import getrandbits
-from machine import SPI
-from machine import Pin
+try:
+    from ucollections import namedtuple
+    from urandom import getrandbits
+except ImportError:
+    # CPython, e.g. when running against ulora_sim
+    from collections import namedtuple
+    from random import getrandbits
+try:
+    from micropython import const, schedule
+except ImportError:
+    # CPython: constants stay plain globals and there is no soft interrupt queue, see LoRa.schedule
+    def const(value):
+        return value
+    schedule = None
+try:
+    from time import ticks_ms, ticks_us, ticks_add, ticks_diff
+except ImportError:
+    # CPython, same wrapping arithmetic as MicroPython's 30 bit ticks
+    def ticks_ms():
+        return int(time.perf_counter() * 1000) & 0x3fffffff
+
+    def ticks_us():
+        return int(time.perf_counter() * 1000000) & 0x3fffffff
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & 0x3fffffff
+
+    def ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3fffffff) - 0x20000000
 
 #Constants
-FLAGS_ACK = 0x80
-BROADCAST_ADDRESS = 255
-
-REG_00_FIFO = 0x00
-REG_01_OP_MODE = 0x01
-REG_06_FRF_MSB = 0x06
-REG_07_FRF_MID = 0x07
-REG_08_FRF_LSB = 0x08
-REG_0E_FIFO_TX_BASE_ADDR = 0x0e
-REG_0F_FIFO_RX_BASE_ADDR = 0x0f
-REG_10_FIFO_RX_CURRENT_ADDR = 0x10
-REG_12_IRQ_FLAGS = 0x12
-REG_13_RX_NB_BYTES = 0x13
-REG_1D_MODEM_CONFIG1 = 0x1d
-REG_1E_MODEM_CONFIG2 = 0x1e
-REG_19_PKT_SNR_VALUE = 0x19
-REG_1A_PKT_RSSI_VALUE = 0x1a
-REG_20_PREAMBLE_MSB = 0x20
-REG_21_PREAMBLE_LSB = 0x21
-REG_22_PAYLOAD_LENGTH = 0x22
-REG_26_MODEM_CONFIG3 = 0x26
-
-REG_4D_PA_DAC = 0x4d
-REG_40_DIO_MAPPING1 = 0x40
-REG_0D_FIFO_ADDR_PTR = 0x0d
-
-PA_DAC_ENABLE = 0x07
-PA_DAC_DISABLE = 0x04
-PA_SELECT = 0xc0
-
-CAD_DETECTED_MASK = 0x01
-RX_DONE = 0x40
-TX_DONE = 0x08
-CAD_DONE = 0x04
-CAD_DETECTED = 0x01
-
-LONG_RANGE_MODE = 0x88
-MODE_SLEEP = 0x00
-MODE_STDBY = (LONG_RANGE_MODE | 0x01)
-MODE_TX = 0x03
-MODE_RXCONTINUOUS = (LONG_RANGE_MODE | 0x05)
-MODE_CAD = 0x07
-
-REG_09_PA_CONFIG = 0x09
+# hot path instrumentation, see LoRa.stats(); set to 0 in a frozen build and the compiler drops it
+METRICS = const(1)
+HIST_BUCKETS = const(24)  # log2 buckets of the microsecond histograms, the last one up to ~8 s and beyond
+FLAGS_ACK = const(0x80)
+FLAGS_RETRY = const(0x40)  # set on send_to_wait retransmissions, as RadioHead does
+FLAGS_CRYPTO = const(0x20)  # data encrypted in counter mode, see LoRa(crypto=)
+# RadioHead leaves the low nibble of header_flags to the application, here it names the frame kind
+# and LoRa.handlers routes kinds to the layers below; 0 is a plain frame for on_recv
+FLAGS_KIND_MASK = const(0x0f)
+KIND_STREAM = const(1)  # ulora_stream
+KIND_STREAM_POLL = const(2)  # ulora_stream, asks for a SACK
+KIND_FRAGMENT = const(3)  # ulora_frag
+KIND_ADR = const(4)  # ulora_adr
+KIND_MESH = const(5)  # ulora_mesh
+# direction of a frame handed to LoRa.capture, see ulora_capture
+CAPTURE_RX = const(0)
+CAPTURE_TX = const(1)
+BROADCAST_ADDRESS = const(255)
+# compact header (LoRa(compact=True)): to and from share a byte, so addresses are 0-14 and 15 is broadcast;
+# id and flags share the other, keeping the low nibble of header_id and the high nibble of header_flags
+COMPACT_BROADCAST = const(0x0f)
+_IMPLICIT_HEADER = const(0x01)  # ImplicitHeaderModeOn, RegModemConfig1
+MAX_PACKET_LEN = const(255)  # header included, RegPayloadLength / RegRxNbBytes are one byte
+
+_REG_00_FIFO = const(0x00)
+_REG_01_OP_MODE = const(0x01)
+_REG_06_FRF_MSB = const(0x06)
+_REG_07_FRF_MID = const(0x07)
+_REG_08_FRF_LSB = const(0x08)
+_REG_0E_FIFO_TX_BASE_ADDR = const(0x0e)
+_REG_0F_FIFO_RX_BASE_ADDR = const(0x0f)
+_REG_10_FIFO_RX_CURRENT_ADDR = const(0x10)
+_REG_12_IRQ_FLAGS = const(0x12)
+_REG_13_RX_NB_BYTES = const(0x13)
+_REG_1C_HOP_CHANNEL = const(0x1c)
+_REG_1D_MODEM_CONFIG1 = const(0x1d)
+_REG_1E_MODEM_CONFIG2 = const(0x1e)
+_REG_19_PKT_SNR_VALUE = const(0x19)
+_REG_1A_PKT_RSSI_VALUE = const(0x1a)
+_REG_20_PREAMBLE_MSB = const(0x20)
+_REG_21_PREAMBLE_LSB = const(0x21)
+_REG_22_PAYLOAD_LENGTH = const(0x22)
+_REG_24_HOP_PERIOD = const(0x24)
+_REG_26_MODEM_CONFIG3 = const(0x26)
+
+_REG_4D_PA_DAC = const(0x4d)
+_REG_40_DIO_MAPPING1 = const(0x40)
+_REG_0D_FIFO_ADDR_PTR = const(0x0d)
+
+_PA_DAC_ENABLE = const(0x07)
+_PA_DAC_DISABLE = const(0x04)
+_PA_SELECT = const(0xc0)
+
+_CAD_DETECTED_MASK = const(0x01)
+_RX_DONE = const(0x40)
+_PAYLOAD_CRC_ERROR = const(0x20)
+_TX_DONE = const(0x08)
+_CAD_DONE = const(0x04)
+_FHSS_CHANGE_CHANNEL = const(0x02)
+_CAD_DETECTED = const(0x01)
+_FHSS_PRESENT_CHANNEL = const(0x3f)
+
+# first byte of the cipher blocks built by LoRa._seal / _open, keeping counter blocks and CBC-MAC blocks apart
+_CTR_BLOCK = const(0x01)
+_MAC_BLOCK = const(0x02)
+_FRAME_COUNTER_LEN = const(4)  # little endian, after the header of an encrypted frame
+
+_LONG_RANGE_MODE = const(0x88)
+MODE_SLEEP = const(0x00)
+MODE_STDBY = const(_LONG_RANGE_MODE | 0x01)
+MODE_TX = const(0x03)
+MODE_RXCONTINUOUS = const(_LONG_RANGE_MODE | 0x05)
+MODE_CAD = const(0x07)
+
+_REG_09_PA_CONFIG = const(0x09)
+_REG_42_VERSION = const(0x42)
+
+# enqueue() priorities, higher goes first
+PRIORITY_LOW = const(0)
+PRIORITY_NORMAL = const(1)
+PRIORITY_HIGH = const(2)
+PRIORITY_ACK = const(3)
+_TXQ_RESERVED = const(0xff)  # slot taken by an enqueue() still assembling its frame
+DEDUPE_IDS = const(4)  # recent header_ids remembered per sender
+
+# written by LoRa.reconfigure(), in this order
+CONFIG_REGISTERS = (_REG_06_FRF_MSB, _REG_07_FRF_MID, _REG_08_FRF_LSB, _REG_09_PA_CONFIG, _REG_1D_MODEM_CONFIG1,
+                    _REG_1E_MODEM_CONFIG2, _REG_20_PREAMBLE_MSB, _REG_21_PREAMBLE_LSB, _REG_26_MODEM_CONFIG3, _REG_4D_PA_DAC)
+# fixed values written once after reset: FIFO tx / rx base at 0, RegInvertIQ and the sync word as RadioHead
+INIT_REGISTERS = (_REG_0E_FIFO_TX_BASE_ADDR, _REG_0F_FIFO_RX_BASE_ADDR, 0x33, 0x39)
+INIT_VALUES = bytes((0x00, 0x00, 0x67, 0x34))
+FREQ_MIN = 137.0
+FREQ_MAX = 1020.0
+TX_POWER_MIN = const(5)
+TX_POWER_MAX = const(23)
+
+# registers the chip changes by itself (or that have side effects), never served from the shadow:
+# FIFO, RegOpMode (TX / CAD / RXSINGLE drop back to standby), the FIFO pointer, status and irq
+# flags (0x10-0x1c, the irq mask too as the rx burst rewrites it), RegFifoRxByteAddr, wideband RSSI
+SHADOW_VOLATILE = (0x00, 0x01, 0x0d, 0x10, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b, 0x1c,
+                   0x25, 0x2c)
+
 FXOSC = 32000000.0
 FSTEP = (FXOSC / 524288)
 
-maxRegLen = 23
-maxFieldLen = maxRegLen
-
-def dumpCfg(lora):
-    print("-----------------------------------------------")
-    OP_MODE = lora._spi_read(REG_01_OP_MODE)
-    regName = f"OPMODE(0x{REG_01_OP_MODE})"
-    print(f"{regName:>{maxRegLen}}: 0x{OP_MODE:02x}")
-    print(f"\t{'LongRangeMode':>{maxFieldLen}}: 0x{(OP_MODE & 0x80) >> 7}")
-    print(f"\t{'AccessSharedReg':>{maxFieldLen}}: 0x{(OP_MODE & 0x40) >> 6}")
-    print(f"\t{'LowFrequencyModeOn':>{maxFieldLen}}: 0x{(OP_MODE & 0x08) >> 3}")
-    print(f"\t{'Mode':>{maxFieldLen}}: {OP_MODE & 0x07:03b}")
-
-    print("-----------------------------------------------")
-    REGFRMSB = lora._spi_read(REG_06_FRF_MSB)
-    regName = f"REGFRMSB(0x{REG_06_FRF_MSB})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFRMSB:02x}")
-
-    REGFRMID = lora._spi_read(REG_07_FRF_MID)
-    regName = f"REGFRMID(0x{REG_07_FRF_MID})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFRMID:02x}")
-
-    REGFRLSB = lora._spi_read(REG_08_FRF_LSB)
-    regName = f"REGFRLSB(0x{REG_08_FRF_LSB})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFRLSB:02x}")
-
-    frequency = (REGFRMSB*256*256 + REGFRMID*256 + REGFRLSB )*32e6/((1<<19))
-    print(f"{'CarrierRF':>{maxRegLen}}: {frequency/1e6} MHz")
-
-    print("-----------------------------------------------")
-    REGPACONFIG = lora._spi_read(REG_09_PA_CONFIG)
-    regName = f"REGPACONFIG(0x{REG_09_PA_CONFIG})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPACONFIG:02x}")
-    print(f"\t{'PaSelect':>{maxFieldLen}}: 0x{(REGPACONFIG & 0x80) >> 7}")
-    print(f"\t{'MaxPower':>{maxFieldLen}}: 0x{(REGPACONFIG & 0x70) >> 4}")
-    print(f"\t{'OutputPower':>{maxFieldLen}}: 0x{REGPACONFIG & 0xf:02x}")
-
-    print("-----------------------------------------------")
-    REGPARAMP = lora._spi_read(0x0a)
-    regName = f"REGPARAMP(0x{0xa:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPARAMP:02x}")
-    print(f"\t{'PaRamp':>{maxFieldLen}}: {REGPARAMP & 0xf:04b}")
-
-    print("-----------------------------------------------")
-    REGOCP = lora._spi_read(0x0b)
-    regName = f"REGOCP(0x{0xb:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGOCP:02x}")
-    print(f"\t{'OcpOn':>{maxFieldLen}}: 0x{(REGOCP & 0x20) >> 5}")
-    print(f"\t{'OcpTrim':>{maxFieldLen}}: 0x{REGOCP & 0x1f:02x}")
-
-    print("-----------------------------------------------")
-    REGLNA = lora._spi_read(0x0c)
-    regName = f"REGLNA(0x{0xc:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGLNA:02x}")
-    print(f"\t{'LnaGain':>{maxFieldLen}}: {(REGLNA & 0xe0) >> 5:03b}")
-    print(f"\t{'LnaBoostLf':>{maxFieldLen}}: {(REGLNA & 0x18) >> 3:02b}")
-    print(f"\t{'LnaBoostHf':>{maxFieldLen}}: {REGLNA & 0x03:02b}")
-
-    print("-----------------------------------------------")
-    REGFIFOADDRPTR = lora._spi_read(0x0d)
-    regName = f"REGFIFOADDRPTR(0x{0xd:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFIFOADDRPTR:02x}")
-
-    print("-----------------------------------------------")
-    REGFIFOTXBASEADDR = lora._spi_read(REG_0E_FIFO_TX_BASE_ADDR)
-    regName = f"REGFIFOTXBASEADDR(0x{REG_0E_FIFO_TX_BASE_ADDR:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFIFOTXBASEADDR:02x}")
-
-    print("-----------------------------------------------")
-    REGFIFORXBASEADDR = lora._spi_read(REG_0F_FIFO_RX_BASE_ADDR)
-    regName = f"REGFIFORXBASEADDR(0x{REG_0F_FIFO_RX_BASE_ADDR:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFIFORXBASEADDR:02x}")
-
-    print("-----------------------------------------------")
-    REGFIFORXBCURADDR = lora._spi_read(REG_10_FIFO_RX_CURRENT_ADDR)
-    regName = f"REGFIFORXBASEADDR(0x{REG_10_FIFO_RX_CURRENT_ADDR:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFIFORXBCURADDR:02x}")
-
-    print("-----------------------------------------------")
-    REGIRQFLAGSMSK = lora._spi_read(0x11)
-    regName = f"REGIRQFLAGSMSK(0x{0x11:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGIRQFLAGSMSK:02x}")
-    print(f"\t{'RxTimeoutMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x80) >> 7}")
-    print(f"\t{'RxDoneMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x40) >> 6}")
-    print(f"\t{'PayloadCrcErrorMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x20) >> 5}")
-    print(f"\t{'ValidHeaderMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x10) >> 4}")
-    print(f"\t{'TxDoneMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x8) >> 3}")
-    print(f"\t{'CADDoneMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x4) >> 2}")
-    print(f"\t{'FhssChangeChannelMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x2) >> 1}")
-    print(f"\t{'CadDetectedMask':>{maxFieldLen}}: {(REGIRQFLAGSMSK & 0x1)}")
-
-    print("-----------------------------------------------")
-    REGIRQFLAGS = lora._spi_read(0x12)
-    regName = f"REGIRQFLAGS(0x{0x12:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGIRQFLAGS:02x}")
-    print(f"\t{'RxTimeout':>{maxFieldLen}}: {(REGIRQFLAGS & 0x80) >> 7}")
-    print(f"\t{'RxDone':>{maxFieldLen}}: {(REGIRQFLAGS & 0x40) >> 6}")
-    print(f"\t{'PayloadCrcError':>{maxFieldLen}}: {(REGIRQFLAGS & 0x20) >> 5}")
-    print(f"\t{'ValidHeader':>{maxFieldLen}}: {(REGIRQFLAGS & 0x10) >> 4}")
-    print(f"\t{'TxDone':>{maxFieldLen}}: {(REGIRQFLAGS & 0x8) >> 3}")
-    print(f"\t{'CADDone':>{maxFieldLen}}: {(REGIRQFLAGS & 0x4) >> 2}")
-    print(f"\t{'FhssChangeChannel':>{maxFieldLen}}: {(REGIRQFLAGS & 0x2) >> 1}")
-    print(f"\t{'CadDetected':>{maxFieldLen}}: {(REGIRQFLAGS & 0x1)}")
-
-    print("-----------------------------------------------")
-    REGRXNBBYTES = lora._spi_read(REG_13_RX_NB_BYTES)
-    regName = f"REGRXNBBYTES(0x{REG_13_RX_NB_BYTES:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRXNBBYTES:02x}")
-
-    print("-----------------------------------------------")
-    REGRXHDRCNTMSB = lora._spi_read(0x14)
-    regName = f"REGRXHDRCNTMSB(0x{0x14:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRXHDRCNTMSB:02x}")
-
-    REGRXHDRCNTLSB = lora._spi_read(0x15)
-    regName = f"REGRXHDRCNTLSB(0x{0x15:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRXHDRCNTLSB:02x}")
-    print(f"{'RegRxHeaderCnt':>{maxRegLen}}: {REGRXHDRCNTMSB*256 + REGRXHDRCNTLSB}")
-
-    print("-----------------------------------------------")
-    REGRXCNTMSB = lora._spi_read(0x16)
-    regName = f"REGRXCNTMSB(0x{0x16:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRXCNTMSB:02x}")
-
-    REGRXCNTLSB = lora._spi_read(0x17)
-    regName = f"REGRXCNTLSB(0x{0x17:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRXCNTLSB:02x}")
-    print(f"{'RegRxCnt':>{maxRegLen}}: {REGRXCNTMSB*256 + REGRXCNTLSB}")
-
-    print("-----------------------------------------------")
-    REGMODEMSTAT = lora._spi_read(0x18)
-    regName = f"REGMODEMSTAT(0x{0x18:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGMODEMSTAT:02x}")
-    print(f"\t{'RxCodingRate':>{maxFieldLen}}: 0x{(REGMODEMSTAT & 0xe) >> 5:02x}")
-    print(f"\t{'Clear':>{maxFieldLen}}: {(REGMODEMSTAT & 0x10) >> 4}")
-    print(f"\t{'HdrValid':>{maxFieldLen}}: {(REGMODEMSTAT & 0x8) >> 3}")
-    print(f"\t{'RX on':>{maxFieldLen}}: {(REGMODEMSTAT & 0x4) >> 2}")
-    print(f"\t{'Signal sync':>{maxFieldLen}}: {(REGMODEMSTAT & 0x2) >> 1}")
-    print(f"\t{'Signal detect':>{maxFieldLen}}: {(REGMODEMSTAT & 0x1)}")
-
-    print("-----------------------------------------------")
-    REGPKTSNR = lora._spi_read(REG_19_PKT_SNR_VALUE)
-    regName = f"REGPKTSNR(0x{REG_19_PKT_SNR_VALUE:02x})"
-    if REGPKTSNR > 128:
-        val = 127 - REGPKTSNR
-    else:
-        val = REGPKTSNR
-    print(f"{regName:>{maxRegLen}}: {val/4.0}")
-
-    print("-----------------------------------------------")
-    REGPKTRSSI = lora._spi_read(REG_1A_PKT_RSSI_VALUE)
-    regName = f"REGPKTRSSI(0x{REG_1A_PKT_RSSI_VALUE:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPKTRSSI:02x}")
-
-    print("-----------------------------------------------")
-    REGRSSI = lora._spi_read(0x1b)
-    regName = f"REGRSSI(0x{0x1b:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGRSSI:02x}")
-
-    print("-----------------------------------------------")
-    REGHOPCHAN = lora._spi_read(0x1c)
-    regName = f"REGHOPCHANNEL(0x{0x1c:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGHOPCHAN:02x}")
-    print(f"\t{'PllTimeout':>{maxFieldLen}}: {(REGHOPCHAN & 0x80) >> 7}")
-    print(f"\t{'CrcOnPayload':>{maxFieldLen}}: {(REGHOPCHAN & 0x40) >> 6}")
-    print(f"\t{'FhssPresentChannel':>{maxFieldLen}}: {(REGHOPCHAN & 0x3f)}")
-
-    print("-----------------------------------------------")
-    REGMODEMCFG1 = lora._spi_read(REG_1D_MODEM_CONFIG1)
-    regName = f"REGMODEMCFG1(0x{REG_1D_MODEM_CONFIG1:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGMODEMCFG1:02x}")
-    print(f"\t{'Bw':>{maxFieldLen}}: {(REGMODEMCFG1 & 0xf0) >> 4:04b}")
-    print(f"\t{'CodingRate':>{maxFieldLen}}: {(REGMODEMCFG1 & 0xe) >> 1:03b}")
-    print(f"\t{'ImplicitHeaderModeOn':>{maxFieldLen}}: {REGMODEMCFG1 & 0x1}")
-
-
-    print("-----------------------------------------------")
-    REGMODEMCFG2 = lora._spi_read(REG_1E_MODEM_CONFIG2)
-    regName = f"REGMODEMCFG2(0x{REG_1E_MODEM_CONFIG2:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGMODEMCFG2:02x}")
-    print(f"\t{'SF':>{maxFieldLen}}: {(REGMODEMCFG2 & 0xf0) >> 4}")
-    print(f"\t{'TxContinuousMode':>{maxFieldLen}}: {(REGMODEMCFG2 & 0x8) >> 3}")
-    print(f"\t{'RxPayloadCrcOn':>{maxFieldLen}}: {(REGMODEMCFG2 & 0x4) >> 2}")
-    print(f"\t{'SymTimeoutMsb':>{maxFieldLen}}: 0x{(REGMODEMCFG2 & 0x3):02x}")
-
-    print("-----------------------------------------------")
-    REGSYMBTIMELSB = lora._spi_read(0x1f)
-    regName = f"REGSYMBTIMELSB(0x{0x1f:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGSYMBTIMELSB:02x}")
-
-    print("-----------------------------------------------")
-    REGPREMSB = lora._spi_read(0x20)
-    regName = f"REGPREMSB(0x{0x20:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPREMSB:02x}")
-
-    REGPRELSB = lora._spi_read(0x21)
-    regName = f"REGPRELSB(0x{0x21:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPRELSB:02x}")
-    print(f"{'PreambleLen':>{maxRegLen}}: {REGPREMSB*256 + REGPRELSB}")
-
-    print("-----------------------------------------------")
-    REGPAYLEN = lora._spi_read(0x22)
-    regName = f"REGPAYLEN(0x{0x22:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPAYLEN:02x}")
-
-    print("-----------------------------------------------")
-    REGHOPPERIOD = lora._spi_read(0x24)
-    regName = f"REGHOPPERIOD(0x{0x24:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGHOPPERIOD:02x}")
-
-    print("-----------------------------------------------")
-    REGFIFORXBYTEADDR = lora._spi_read(0x25)
-    regName = f"REGFIFORXBYTEADDR(0x{0x25:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGFIFORXBYTEADDR:02x}")
-
-    print("-----------------------------------------------")
-    REGMODEMCFG3 = lora._spi_read(REG_26_MODEM_CONFIG3)
-    regName = f"REGMODEMCFG3(0x{REG_26_MODEM_CONFIG3:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGMODEMCFG3:02x}")
-    print(f"\t{'LowDataRateOpt':>{maxFieldLen}}: {(REGMODEMCFG3 & 0x8) >> 3}")
-    print(f"\t{'AgcAutoOn':>{maxFieldLen}}: {(REGMODEMCFG3 & 0x4) >> 2}")
-
-    print("-----------------------------------------------")
-    REGPPMCORRECTION= lora._spi_read(0x27)
-    regName = f"REGPPMCORRECTION(0x{0x27:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGPPMCORRECTION:02x}")
-
-    print("-----------------------------------------------")
-    REGDETECTOPT = lora._spi_read(0x31)
-    regName = f"REGDETECTOPT(0x{0x31:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGDETECTOPT:02x}")
-    print(f"\t{'DetectionOptimize':>{maxFieldLen}}: 0x{(REGDETECTOPT & 0x7):02x}")
-
-    print("-----------------------------------------------")
-    REGINVERTIQ = lora._spi_read(0x33)
-    regName = f"REGINVERTIQ(0x{0x33:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGINVERTIQ:02x}")
-    print(f"\t{'InvertIQ':>{maxFieldLen}}: {(REGINVERTIQ & 0x40) >> 6}")
-
-    print("-----------------------------------------------")
-    REGDETECTTHRESH= lora._spi_read(0x37)
-    regName = f"REGDETECTTHRESH(0x{0x37:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGDETECTTHRESH:02x}")
-
-    print("-----------------------------------------------")
-    REGSYNCWORD = lora._spi_read(0x39)
-    regName = f"REGSYNCWORD(0x{0x39:02x})"
-    print(f"{regName:>{maxRegLen}}: 0x{REGSYNCWORD:02x}")
+Payload = namedtuple(
+    "Payload",
+    ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
+)
+
+def __getattr__(name):
+    # board tables and diagnostics are only imported when asked for, so `import ulora` stays small
+    if name == "SPIConfig":
+        from ulora_hal import SPIConfig
+        return SPIConfig
+    if name == "dumpCfg":
+        from ulora_regs import dumpCfg
+        return dumpCfg
+    raise AttributeError(name)
+
+
+# RegModemConfig1 Bw field -> Hz
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+
+def frf(freq):
+    # RegFrfMsb, RegFrfMid, RegFrfLsb for a frequency in MHz
+    value = int((freq * 1000000.0) / FSTEP)
+    return bytes(((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff))
+
+
+def symbol_time(modem_config):
+    # seconds per LoRa symbol for a ModemConfig tuple
+    return (1 << (modem_config[1] >> 4)) / BANDWIDTHS[modem_config[0] >> 4]
+
+
+def time_on_air(modem_config, payload_len, preamble=8):
+    """
+    time_on_air(modem_config, payload_len, preamble=8)
+    Seconds a frame of payload_len bytes (our 4 byte header included) spends on air, per the SX127x datasheet.
+    modem_config: ModemConfig tuple (RegModemConfig1, RegModemConfig2, RegModemConfig3)
+    preamble: programmed preamble length in symbols
+    """
+    sf = modem_config[1] >> 4
+    cr = (modem_config[0] >> 1) & 0x07
+    implicit = modem_config[0] & 0x01
+    crc = (modem_config[1] >> 2) & 0x01
+    low_data_rate = (modem_config[2] >> 3) & 0x01
+
+    bits = 8 * payload_len - 4 * sf + 28 + 16 * crc - 20 * implicit
+    payload_symbols = 8 + max(math.ceil(bits / (4 * (sf - 2 * low_data_rate))) * (cr + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * symbol_time(modem_config)
+
+
+class Histogram(object):
+    # fixed size counts that a hard interrupt handler can update: bucket i holds values from 2**(i-1) up to
+    # 2**i - 1 (bucket 0 zero, the last one everything larger), or the value i itself if linear
+    def __init__(self, buckets=HIST_BUCKETS, linear=False):
+        self.buckets = [0] * buckets
+        self.linear = linear
+        self.count = 0
+        self.max = 0
+
+    def add(self, value):
+        if value < 0:
+            value = 0
+        if value > self.max:
+            self.max = value
+        self.count = (self.count + 1) & 0x3fffffff
+        last = len(self.buckets) - 1
+        if self.linear:
+            i = value if value < last else last
+        else:
+            i = 0
+            while value and i < last:
+                value >>= 1
+                i += 1
+        self.buckets[i] += 1
+
+    def reset(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.max = 0
+
+    def snapshot(self):
+        return {"count": self.count, "max": self.max, "buckets": list(self.buckets)}
 
 
 class ModemConfig():
@@ -312,20 +229,22 @@ class ModemConfig():
     Lorawan = (0x72, 0xa4, 0x04)
 
 
-class SPIConfig():
-    # spi pin defs for various boards (channel, sck, mosi, miso)
-    rp2_0 = (0, 6, 7, 4)
-    rp2_1 = (1, 10, 11, 8)
-    esp8286_1 = (1, 14, 13, 12)
-    esp32_1 = (1, 14, 13, 12)
-    esp32_2 = (2, 18, 23, 19)
-
 class LoRa(object):
+    # reported and zeroed by stats(), the second lot only exists with METRICS
+    stats_counters = ("crc_errors", "rx_duplicates", "rx_overflows", "tx_dropped", "ack_timeouts", "cad_idle",
+                      "cad_busy", "cad_failures", "shadow_hits", "crypto_errors")
+    metrics_counters = ("rx_packets", "rx_filtered", "tx_packets", "tx_retries")
+    metrics_histograms = ("isr_us", "tx_us", "ack_rtt_us", "retries")
+
     def __init__(self, spi_channel, interrupt, this_address, cs_pin, reset_pin=None, freq=868.0, tx_power=14,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None):
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, transport=None,
+                 deferred=False, rx_slots=4, shadow=False, warm_start=False, tx_queue=0, dedupe=8, fixed_length=0,
+                 compact=False, mac=0):
         """
         Lora(channel, interrupt, this_address, cs_pin, reset_pin=None, freq=868.0, tx_power=14,
-                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None)
+                 modem_config=ModemConfig.Bw125Cr45Sf128, receive_all=False, acks=False, crypto=None, transport=None,
+                 deferred=False, rx_slots=4, shadow=False, warm_start=False, tx_queue=0, dedupe=8, fixed_length=0,
+                 compact=False, mac=0)
         channel: SPI channel, check SPIConfig for preconfigured names
         interrupt: GPIO interrupt pin
         this_address: set address for this device [0-254]
@@ -336,7 +255,41 @@ class LoRa(object):
         modem_config: Check ModemConfig. Default is compatible with the Radiohead library
         receive_all: if True, don't filter packets on address
         acks: if True, request acknowledgments
-        crypto: if desired, an instance of ucrypto AES (https://docs.pycom.io/firmwareapi/micropython/ucrypto/) - not tested
+        crypto: if desired, an AES block cipher in ECB mode with the key set, e.g. cryptolib.aes(key, 1) or ucrypto AES
+                (https://docs.pycom.io/firmwareapi/micropython/ucrypto/). Data is encrypted in counter mode, so it goes
+                out at its own length plus a 4 byte frame counter, and the frame carries FLAGS_CRYPTO. The nonce is
+                the header and the counter, crypto_counter, which goes up with every frame sent and is never reused
+                under one key; a receiver drops frames whose counter isn't above the last one it took from their
+                sender (counted in crypto_errors). It starts at 0, so save it and set it back after a restart
+                (e.g. to what was saved plus the frames sent between saves), or change the key. Queued frames
+                (tx_queue) are numbered and encrypted as they go out, so with deferred=True crypto.encrypt runs
+                in the hard interrupt handler and has to take an output buffer, as cryptolib's does
+        mac: bytes (0-16) of CBC-MAC over header, counter and encrypted data added to every frame with crypto;
+             frames whose MAC doesn't match, or that arrive unencrypted, are dropped (counted in crypto_errors).
+             Both ends must agree
+        transport: if given, used instead of building a MachineTransport from channel/interrupt/cs_pin/reset_pin,
+                   see ulora_hal.py (hardware) and ulora_sim.py (simulated radio)
+        deferred: if True, the (hard) interrupt handler only copies received packets into a ring of rx_slots
+                  preallocated buffers; parsing, acks and on_recv run later from service(), which is handed to
+                  `schedule` (micropython.schedule by default). Where there is no scheduler, call service()
+                  from the main loop or assign one, e.g. ulora_sim.Scheduler().schedule
+        rx_slots: number of packets the deferred ring holds before counting rx_overflows
+        shadow: if True, keep a copy of the configuration registers: writes of an unchanged value are
+                skipped and reads are served from the copy (counted in shadow_hits). Call invalidate()
+                or resync() if the chip is reset behind the driver's back
+        warm_start: if True, read the configuration back first (one burst) and skip the reset and register
+                    writes when the radio is already set up as asked, e.g. after a deep sleep of the
+                    microcontroller alone. warm_started tells which path was taken
+        tx_queue: number of frames enqueue() can hold (each a preallocated 256 byte buffer), 0 disables it
+        dedupe: number of senders whose recent header_ids are remembered, so a retransmission whose ack got
+                lost is acked again but not passed to on_recv twice (counted in rx_duplicates); the least
+                recently heard sender is forgotten first, 0 disables it
+        fixed_length: if set, every frame is this many bytes (header included) and goes out with the implicit
+                      LoRa header, which saves its air time; both ends must use the same length, shorter
+                      frames are zero padded and the receiver gets the padding too. 0 keeps the explicit header
+        compact: if True, use a 2 byte header instead of RadioHead's 4 (see COMPACT_BROADCAST): addresses
+                 0-14, 4 bit header_ids and no frame kinds, so not for ulora_stream, ulora_frag or ulora_adr.
+                 Both ends must agree
         """
         
         self._spi_channel = spi_channel
@@ -351,288 +304,1353 @@ class LoRa(object):
         self._receive_all = receive_all
         self._acks = acks
 
+        if compact and not 0 <= this_address < COMPACT_BROADCAST:
+            raise ValueError("compact header addresses are 0-14")
         self._this_address = this_address
         self._last_header_id = 0
+        self._compact = compact
+        self._header_len = 2 if compact else 4
+        self._id_mask = 0x0f if compact else 0xff
+        # the explicit / implicit header choice, see reconfigure(); _air_config is modem_config as
+        # programmed, with ImplicitHeaderModeOn when fixed_length is set
+        self._fixed_length = 0
+        self._air_config = modem_config
 
         self._last_payload = None
+        # the ack that ended the last successful send_to_wait
+        self.last_ack = None
+        if not 0 <= mac <= 16:
+            raise ValueError("mac is 0-16 bytes")
         self.crypto = crypto
-
+        self.crypto_counter = 0
+        self._mac = mac
+        self.crypto_errors = 0
+        self._seal_state = None
+        self._encrypt_into = None  # whether crypto.encrypt takes an output buffer, found out on first use
+        if crypto is not None:
+            self._crypto_buffers()
+        # frame kind (header_flags & FLAGS_KIND_MASK) -> handler(payload), for kinds not meant for on_recv
+        self.handlers = {}
+        # called with every frame received for us before it is dispatched, e.g. link statistics
+        self.monitors = []
+        # sees every raw frame received or sent, see ulora_capture
+        self.capture = None
+        # ack hooks, receive handler context: ack_payload(payload) returns the data of the ack to payload
+        # (None for the usual b'!'), acked(payload) runs once that ack has gone out or been enqueued
+        self.ack_payload = None
+        self.acked = None
+
+        # deferred interrupt handling: ring of rx_slots packet buffers (plus the
+        # one kept free to tell full from empty), each with views in 16 byte
+        # steps so the handler can read a packet without slicing
+        self._deferred = deferred
+        self.schedule = schedule
+        self.rx_overflows = 0
+        self._rx_head = 0
+        self._rx_tail = 0
+        self._service_pending = False
+        self._service_ref = self.service
+
+        # frames are assembled here and burst into the FIFO from a view
+        self._tx_buf = bytearray(256)
+        self._tx_view = memoryview(self._tx_buf)
+
+        # rx bookkeeping for the interrupt handlers, see _read_status / _fetch_packet:
+        # _status mirrors REG_10..REG_1A (0 rx current addr, 1 irq mask, 2 irq flags, 3 rx nb bytes,
+        # 4-7 header/packet counters, 8 modem status, 9 packet snr, 10 packet rssi), _rx_regs is
+        # burst from REG_0D: fifo addr ptr, tx base, rx base, (read only), irq mask, clear all irq flags
+        self._status = bytearray(11)
+        self._rx_regs = bytearray((0, 0, 0, 0, 0, 0xff))
+        self.crc_errors = 0
+        if not deferred:
+            self._rx_view = memoryview(bytearray(256))
+
+        # frequency hopping, see set_hopping(): Frf triplets in hop order, None when off; _home is the
+        # configured frequency's, which every frame starts on
+        self._hops = None
+        self._home = None
+        self._hop_regs = bytearray(_REG_1C_HOP_CHANNEL - _REG_12_IRQ_FLAGS + 1)
+
+        # set by the interrupt handlers on TxDone / CadDone if not None (see ulora_async)
+        self._tx_flag = None
+        self._cad_flag = None
+        self._in_handler = False
+        if deferred:
+            self._rx_slots = [bytearray(256) for _ in range(rx_slots + 1)]
+            self._rx_views = [[memoryview(slot)[:i << 4] for i in range(17)] for slot in self._rx_slots]
+            self._rx_meta = bytearray(4 * (rx_slots + 1))  # length, irq flags, snr, rssi
+            self._rx_ticks = [0] * (rx_slots + 1)  # ticks_us() at the latch, for capture
+
+        # transmit queue drained from TxDone: per slot a frame buffer (with 16 byte step views like the rx
+        # ring), its length (0 = free), priority and enqueue order
+        self.tx_dropped = 0
+        self._txq_len = None
+        self._txq_rx = False  # go back to receive once the queue is empty
+        if tx_queue:
+            self._txq_slots = [bytearray(256) for _ in range(tx_queue)]
+            self._txq_views = [[memoryview(slot)[:i << 4] for i in range(17)] for slot in self._txq_slots]
+            self._txq_len = bytearray(tx_queue)
+            self._txq_prio = bytearray(tx_queue)
+            self._txq_seq = [0] * tx_queue
+            self._txq_counter = 0
+
+        # duplicate suppression: per entry the sender, when it was last heard (0 = free) and its
+        # DEDUPE_IDS most recent header_ids, newest first (-1 = none)
+        self.rx_duplicates = 0
+        self._dup_from = None
+        if dedupe:
+            self._dup_from = bytearray(dedupe)
+            self._dup_used = [0] * dedupe
+            self._dup_ids = [-1] * (dedupe * DEDUPE_IDS)
+            self._dup_clock = 0
+
+        # listen before talk: cad_timeout caps the wait for a clear channel in seconds (0 sends without
+        # looking). After the n-th busy CAD, send waits a random 0..2**min(backoff_min + n, backoff_max) - 1
+        # slots of backoff_slot symbols; send_to_wait draws its retry backoff from the same window
         self.cad_timeout = 0
+        self.backoff_min = 2
+        self.backoff_max = 8
+        self.backoff_slot = 8
+        # channel access statistics: CADs that found the channel clear / busy, sends given up on a channel
+        # that stayed busy, and send_to_wait attempts left without an ack (under load, mostly collisions)
+        self.cad_idle = 0
+        self.cad_busy = 0
+        self.cad_failures = 0
+        self.ack_timeouts = 0
+        if METRICS:
+            # frames received for us / dropped by the address check, frames through TxDone,
+            # send_to_wait retransmissions; histograms in microseconds except retries (per send_to_wait,
+            # a call that failed counts retries + 1)
+            self.rx_packets = 0
+            self.rx_filtered = 0
+            self.tx_packets = 0
+            self.tx_retries = 0
+            self.isr_us = Histogram()
+            self.tx_us = Histogram()
+            self.ack_rtt_us = Histogram()
+            self.retries = Histogram(8, linear=True)
+            self._tx_start = 0
         self.send_retries = 2
-        self.wait_packet_sent_timeout = 0.2
-        self.retry_timeout = 0.2
+        # None derives these from the time on air of the frame in flight / the
+        # ack we are waiting for, a number overrides them (seconds)
+        self.wait_packet_sent_timeout = None
+        self.retry_timeout = None
+        # slack on top of time on air: interrupt latency, SPI, the peer's turnaround
+        self.ack_turnaround = 0.05
+        self._preamble = 8
+        self._tx_len = 0
+        # last image written by reconfigure(), one byte per CONFIG_REGISTERS entry
+        self._config = None
+
+        # register shadow: _shadow_valid[reg] is 1 once _shadow[reg] is known to match the chip,
+        # volatile registers are marked 2 and always go to the bus
+        self._shadow = None
+        self.shadow_hits = 0
+        if shadow:
+            self._shadow = bytearray(0x80)
+            self._shadow_valid = bytearray(0x80)
+            self.invalidate()
         
         # Setup the module
-#        gpio_interrupt = Pin(self._interrupt, Pin.IN, Pin.PULL_DOWN)
-        gpio_interrupt = Pin(self._interrupt, Pin.IN)
-        gpio_interrupt.irq(trigger=Pin.IRQ_RISING, handler=self._handle_interrupt)
-        
-        # reset the board
-        if reset_pin:
-            gpio_reset = Pin(reset_pin, Pin.OUT)
-            gpio_reset.value(0)
-            time.sleep(0.01)
-            gpio_reset.value(1)
-            time.sleep(0.01)
-
-        # baud rate to 5MHz
-        self.spi = SPI(self._spi_channel[0], 5000000,
-                       sck=Pin(self._spi_channel[1]), mosi=Pin(self._spi_channel[2]), miso=Pin(self._spi_channel[3]))
-
-        # cs gpio pin
-        self.cs = Pin(self._cs_pin, Pin.OUT)
-        self.cs.value(1)
+        if transport is None:
+            from ulora_hal import MachineTransport
+            transport = MachineTransport(self._spi_channel, self._interrupt, self._cs_pin, reset_pin)
+        self._transport = transport
+        # spi counters at the last stats(reset=True)
+        self._spi_base = (transport.spi_transactions, transport.spi_bytes)
+        if deferred:
+            self._transport.irq(self._handle_interrupt_deferred, hard=True)
+        else:
+            self._transport.irq(self._handle_interrupt)
+
+        # modem config, preamble, frequency and tx power (clamped here, reconfigure() rejects it)
+        tx_power = min(max(tx_power, TX_POWER_MIN), TX_POWER_MAX)
+        self.warm_started = warm_start and self._is_configured(freq, tx_power, modem_config, fixed_length)
+        if self.warm_started:
+            # the radio kept its configuration (e.g. we woke from deep sleep), just take it to standby
+            self._config = self._config_image(freq, tx_power, modem_config, self._preamble, fixed_length)
+            self._spi_write(_REG_12_IRQ_FLAGS, 0xff)
+        else:
+            self._cold_start()
+        self.set_mode_idle()
+        self.reconfigure(freq, tx_power, modem_config, self._preamble, fixed_length)
         
-        # set mode
-        self._spi_write(REG_01_OP_MODE, MODE_SLEEP | LONG_RANGE_MODE)
-        time.sleep(0.1)
+    def _wait_register(self, register, accept, timeout=0.1):
+        # poll register until accept(value), False if that takes longer than timeout seconds
+        start = ticks_ms()
+        timeout = int(timeout * 1000) + 1
+        while not accept(self._transport.read_reg(register)):
+            if ticks_diff(ticks_ms(), start) > timeout:
+                return False
+        return True
 
+    def _cold_start(self):
+        # reset, wait for the chip to answer, enter LoRa sleep and write the fixed registers
+        self._transport.reset()
+        assert self._wait_register(_REG_42_VERSION, lambda v: v not in (0x00, 0xff)), "LoRa initialization failed"
 
-        # check if mode is set
-        assert self._spi_read(REG_01_OP_MODE) == (MODE_SLEEP | LONG_RANGE_MODE), \
+        self._spi_write(_REG_01_OP_MODE, MODE_SLEEP | _LONG_RANGE_MODE)
+        assert self._wait_register(_REG_01_OP_MODE, lambda v: v == MODE_SLEEP | _LONG_RANGE_MODE), \
             "LoRa initialization failed"
-        
-        self._spi_write(0x33, 0x67)
-        self._spi_write(0x39, 0x34)
-        
-        self._spi_write(REG_0E_FIFO_TX_BASE_ADDR, 0)
-        self._spi_write(REG_0F_FIFO_RX_BASE_ADDR, 0)
-        
-        self.set_mode_idle()
 
-        # set modem config (Bw125Cr45Sf128)
-        self._spi_write(REG_1D_MODEM_CONFIG1, self._modem_config[0])
-        self._spi_write(REG_1E_MODEM_CONFIG2, self._modem_config[1])
-        self._spi_write(REG_26_MODEM_CONFIG3, self._modem_config[2])
-
-        # set preamble length (8)
-        self._spi_write(REG_20_PREAMBLE_MSB, 0)
-        self._spi_write(REG_21_PREAMBLE_LSB, 8)
+        self._write_runs(INIT_REGISTERS, INIT_VALUES, range(len(INIT_REGISTERS)))
+
+    def _is_configured(self, freq, tx_power, modem_config, fixed_length):
+        # one burst over REG_01..REG_4D: True if the chip is in LoRa mode with our configuration
+        regs = bytearray(_REG_4D_PA_DAC + 1)
+        self._transport.readinto(_REG_01_OP_MODE, memoryview(regs)[1:])
+        if self._shadow is not None:
+            self._load_shadow(regs)
+        if not regs[_REG_01_OP_MODE] & 0x80:  # LongRangeMode
+            return False
+        image = self._config_image(freq, tx_power, modem_config, self._preamble, fixed_length)
+        for i in range(len(CONFIG_REGISTERS)):
+            if regs[CONFIG_REGISTERS[i]] != image[i]:
+                return False
+        if fixed_length and regs[_REG_22_PAYLOAD_LENGTH] != fixed_length:
+            return False
+        for i in range(len(INIT_REGISTERS)):
+            if regs[INIT_REGISTERS[i]] != INIT_VALUES[i]:
+                return False
+        return True
 
-        # set frequency
-        frf = int((self._freq * 1000000.0) / FSTEP)
-        self._spi_write(REG_06_FRF_MSB, (frf >> 16) & 0xff)
-        self._spi_write(REG_07_FRF_MID, (frf >> 8) & 0xff)
-        self._spi_write(REG_08_FRF_LSB, frf & 0xff)
-        
-        # Set tx power
-        if self._tx_power < 5:
-            self._tx_power = 5
-        if self._tx_power > 23:
-            self._tx_power = 23
-
-        if self._tx_power < 20:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_ENABLE)
-            self._tx_power -= 3
+    def _write_runs(self, registers, values, indices):
+        # write values[i] to registers[i] for i in indices (ascending), runs of adjacent registers as one burst
+        indices = list(indices)
+        i = 0
+        while i < len(indices):
+            j = i + 1
+            while j < len(indices) and indices[j] == indices[j - 1] + 1 \
+                    and registers[indices[j]] == registers[indices[j - 1]] + 1:
+                j += 1
+            if j - i == 1:
+                self._spi_write(registers[indices[i]], values[indices[i]])
+            else:
+                self._spi_write(registers[indices[i]], values[indices[i]:indices[j - 1] + 1])
+            i = j
+
+    def _config_image(self, freq, tx_power, modem_config, preamble, fixed_length):
+        # values for CONFIG_REGISTERS
+        if tx_power > 20:
+            pa_dac = _PA_DAC_ENABLE
+            tx_power -= 3
         else:
-            self._spi_write(REG_4D_PA_DAC, PA_DAC_DISABLE)
+            pa_dac = _PA_DAC_DISABLE
+        return frf(freq) + bytes((_PA_SELECT | (tx_power - 5),
+                                  modem_config[0] | (_IMPLICIT_HEADER if fixed_length else 0), modem_config[1],
+                                  preamble >> 8, preamble & 0xff, modem_config[2], pa_dac))
+
+    def reconfigure(self, freq=None, tx_power=None, modem_config=None, preamble=None, fixed_length=None):
+        """
+        reconfigure(freq=None, tx_power=None, modem_config=None, preamble=None, fixed_length=None)
+        Change settings on the fly, None keeps the current value. Only registers that differ from the
+        last configuration are written (contiguous ones in one burst); the radio is taken to standby for
+        it and put back into receive if it was listening. Returns the number of registers written.
+        freq: frequency in MHz, 137-1020
+        tx_power: transmit power in dBm, 5-23
+        modem_config: ModemConfig tuple
+        preamble: preamble length in symbols, 6-65535
+        fixed_length: frame length for the implicit header, 0 for the explicit one (see LoRa)
+        """
+        freq = self._freq if freq is None else freq
+        tx_power = self._tx_power if tx_power is None else tx_power
+        modem_config = self._modem_config if modem_config is None else modem_config
+        preamble = self._preamble if preamble is None else preamble
+        fixed_length = self._fixed_length if fixed_length is None else fixed_length
+
+        if not FREQ_MIN <= freq <= FREQ_MAX:
+            raise ValueError("freq out of range")
+        if not TX_POWER_MIN <= tx_power <= TX_POWER_MAX:
+            raise ValueError("tx_power out of range")
+        if len(modem_config) != 3 or modem_config[0] >> 4 >= len(BANDWIDTHS) or not 6 <= modem_config[1] >> 4 <= 12:
+            raise ValueError("invalid modem_config")
+        if not 6 <= preamble <= 0xffff:
+            raise ValueError("preamble out of range")
+        if fixed_length and not self._header_len < fixed_length <= MAX_PACKET_LEN:
+            raise ValueError("fixed_length out of range")
+
+        image = self._config_image(freq, tx_power, modem_config, preamble, fixed_length)
+        old = self._config
+        changed = [i for i in range(len(image)) if old is None or image[i] != old[i]]
+        # where set_mode_rx() / the handlers retune to while hopping
+        self._home = memoryview(image)[:3]
+
+        if changed:
+            if self._mode == MODE_TX:
+                self._wait_sent()
+            listening = self._mode == MODE_RXCONTINUOUS
+            if self._mode not in (MODE_STDBY, MODE_SLEEP):
+                self.set_mode_idle()
+
+            self._write_runs(CONFIG_REGISTERS, image, changed)
+            if fixed_length:
+                # the receiver takes the length of an implicit header frame from here
+                self._spi_write(_REG_22_PAYLOAD_LENGTH, fixed_length)
+
+            if listening:
+                self.set_mode_rx()
+        elif fixed_length != self._fixed_length:
+            self._spi_write(_REG_22_PAYLOAD_LENGTH, fixed_length)
+
+        self._config = image
+        self._freq = freq
+        self._tx_power = tx_power
+        self._modem_config = modem_config
+        self._preamble = preamble
+        self._fixed_length = fixed_length
+        self._air_config = (image[4], modem_config[1], modem_config[2])
+        return len(changed)
+
+    @property
+    def modem_config(self):
+        # ModemConfig tuple in use, as given to the constructor or reconfigure()
+        return self._modem_config
+
+    @property
+    def preamble(self):
+        # preamble length in symbols
+        return self._preamble
+
+    @property
+    def address(self):
+        # this node's address
+        return self._this_address
+
+    @property
+    def acks(self):
+        # whether frames addressed to this node are acked
+        return self._acks
+
+    @property
+    def deferred(self):
+        # whether received frames are handled by service() rather than in the interrupt handler
+        return self._deferred
+
+    @property
+    def compact(self):
+        # whether the 2 byte compact header is in use
+        return self._compact
+
+    def set_hopping(self, plan, hop_period=0):
+        """
+        set_hopping(plan, hop_period=0)
+        Spread every frame over the channels of plan (see ulora_fhss.ChannelPlan). Frames start on the
+        configured frequency and move to the next channel of plan.hops every hop_period symbols; both ends
+        retune from the FhssChangeChannel interrupt on DIO2, so the transport needs that pin (hop_pin, see
+        ulora_hal). Both ends need the same plan and hop_period.
+        plan: ChannelPlan, None turns hopping off
+        hop_period: symbols on each channel, 1-255, 0 turns hopping off
+        """
+        if plan is None:
+            hop_period = 0
+        if not 0 <= hop_period <= 0xff:
+            raise ValueError("hop_period out of range")
+
+        self._wait_sent()
+        listening = self._mode == MODE_RXCONTINUOUS
+        if self._mode not in (MODE_STDBY, MODE_SLEEP):
+            self.set_mode_idle()
+        self._hops = list(plan.hops) if hop_period else None
+        self._spi_write(_REG_24_HOP_PERIOD, hop_period)
+        self._transport.hop_irq(self._handle_hop if hop_period else None, hard=True)
+        if self._shadow is not None:
+            # retuned behind the shadow's back from here on
+            for register in (_REG_06_FRF_MSB, _REG_07_FRF_MID, _REG_08_FRF_LSB):
+                self._shadow_valid[register] = 2
+        self._transport.write(_REG_06_FRF_MSB, self._home)
+        if listening:
+            self.set_mode_rx()
+
+    def _retune(self):
+        # back to the configured frequency after a hopped frame, or one cut short
+        if self._hops is not None:
+            self._transport.write(_REG_06_FRF_MSB, self._home)
+
+    def _handle_hop(self, channel):
+        # FhssChangeChannel, hard interrupt context: tune to the channel the chip has moved on to
+        hops = self._hops
+        if hops is None:
+            return
+        # REG_12..REG_1C in one burst; a hop still pending when TxDone / RxDone cleared the flags is
+        # stale, the frame is over and we are back on the home channel
+        transport = self._transport
+        regs = self._hop_regs
+        transport.readinto(_REG_12_IRQ_FLAGS, regs)
+        if not regs[0] & _FHSS_CHANGE_CHANNEL:
+            return
+        transport.write(_REG_06_FRF_MSB, hops[(regs[10] & _FHSS_PRESENT_CHANNEL) % len(hops)])
+        transport.write_reg(_REG_12_IRQ_FLAGS, _FHSS_CHANGE_CHANNEL)
 
-        self._spi_write(REG_09_PA_CONFIG, PA_SELECT | (self._tx_power - 5))
-        
     def on_recv(self, message):
         # This should be overridden by the user
         pass
 
     def sleep(self):
         if self._mode != MODE_SLEEP:
-            self._spi_write(REG_01_OP_MODE, MODE_SLEEP)
+            self._spi_write(_REG_01_OP_MODE, MODE_SLEEP)
             self._mode = MODE_SLEEP
 
     def set_mode_tx(self):
         if self._mode != MODE_TX:
-            self._spi_write(REG_01_OP_MODE, MODE_TX)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x40)  # Interrupt on TxDone
+            if METRICS:
+                self._tx_start = ticks_us()
+            self._retune()
+            self._spi_write(_REG_01_OP_MODE, MODE_TX)
+            self._spi_write(_REG_40_DIO_MAPPING1, 0x40)  # Interrupt on TxDone
             self._mode = MODE_TX
 
     def set_mode_rx(self):
+        if self._mode == MODE_TX and self._txq_len is not None:
+            # don't cut the queue short, the last TxDone switches to receive
+            self._txq_rx = True
+            return
         if self._mode != MODE_RXCONTINUOUS:
-            self._spi_write(REG_01_OP_MODE, MODE_RXCONTINUOUS)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x00)  # Interrupt on RxDone
+            self._retune()
+            self._spi_write(_REG_01_OP_MODE, MODE_RXCONTINUOUS)
+            self._spi_write(_REG_40_DIO_MAPPING1, 0x00)  # Interrupt on RxDone
             self._mode = MODE_RXCONTINUOUS
             
     def set_mode_cad(self):
         if self._mode != MODE_CAD:
-            self._spi_write(REG_01_OP_MODE, MODE_CAD)
-            self._spi_write(REG_40_DIO_MAPPING1, 0x80)  # Interrupt on CadDone
+            self._retune()
+            self._spi_write(_REG_01_OP_MODE, MODE_CAD)
+            self._spi_write(_REG_40_DIO_MAPPING1, 0x80)  # Interrupt on CadDone
             self._mode = MODE_CAD
 
-    def _is_channel_active(self):
+    def _channel_busy(self):
+        # one CAD, True if it picked up a LoRa preamble
+        self._cad = None
         self.set_mode_cad()
+        # CadDone comes about two symbols in
+        start = ticks_ms()
+        timeout = int((4 * symbol_time(self._modem_config) + self.ack_turnaround) * 1000) + 1
+        while self._mode == MODE_CAD and ticks_diff(ticks_ms(), start) < timeout:
+            if self._in_handler:
+                # called from the (soft) receive handler, which the CadDone interrupt can't preempt
+                irq_flags = self._spi_read(_REG_12_IRQ_FLAGS)
+                if irq_flags & _CAD_DONE:
+                    self._spi_write(_REG_12_IRQ_FLAGS, _CAD_DONE | _CAD_DETECTED)
+                    self._cad = irq_flags & _CAD_DETECTED
+                    self.set_mode_idle()
+                    self._tx_next()
+                else:
+                    time.sleep(0.001)
+        if self._mode == MODE_CAD:
+            # no CadDone, call the channel clear rather than never send again
+            self.set_mode_idle()
+        return bool(self._cad)
+
+    def _backoff_time(self, attempt):
+        # random binary exponential backoff after `attempt` busy channels / missed acks, in seconds
+        exponent = min(self.backoff_min + attempt, self.backoff_max)
+        slots = getrandbits(exponent) if exponent > 0 else 0
+        return slots * self.backoff_slot * symbol_time(self._modem_config)
+
+    def _cad_delay(self, start, attempt):
+        # backoff before the next CAD of a wait_cad that began at ticks_ms() start, None once it won't fit
+        left = self.cad_timeout - ticks_diff(ticks_ms(), start) / 1000
+        delay = self._backoff_time(attempt)
+        if delay <= left:
+            return delay
+        if attempt:
+            return None
+        return max(left, 0)
 
-        while self._mode == MODE_CAD:
-            yield
-
-        return self._cad
-    
     def wait_cad(self):
+        # listen before talk: True once CAD finds the channel clear, False if it stays busy for cad_timeout.
+        # Every CAD, the first included, follows a backoff so nodes waiting out the same frame spread out;
+        # the first one's is cut to cad_timeout, so a clear channel is always tried
         if not self.cad_timeout:
             return True
 
-        start = time.time()
-        for status in self._is_channel_active():
-            if time.time() - start < self.cad_timeout:
+        start = ticks_ms()
+        attempt = 0
+        while True:
+            delay = self._cad_delay(start, attempt)
+            if delay is None:
+                self.cad_failures += 1
                 return False
+            time.sleep(delay)
+            if not self._channel_busy():
+                self.cad_idle += 1
+                return True
+            self.cad_busy += 1
+            attempt += 1
 
-            if status is None:
-                time.sleep(0.1)
-                continue
-            else:
-                return status
+    def time_on_air(self, length):
+        # seconds on air for `length` bytes of data sent with the current settings
+        if self.crypto:
+            length += _FRAME_COUNTER_LEN + self._mac
+        if self._fixed_length:
+            return time_on_air(self._air_config, self._fixed_length, self._preamble)
+        return time_on_air(self._air_config, length + self._header_len, self._preamble)
+
+    @property
+    def max_payload(self):
+        # largest data send() takes in one frame with the current settings
+        space = (self._fixed_length or MAX_PACKET_LEN) - self._header_len
+        if self.crypto:
+            return space - _FRAME_COUNTER_LEN - self._mac
+        return space
+
+    def _tx_timeout(self):
+        if self.wait_packet_sent_timeout is not None:
+            return self.wait_packet_sent_timeout
+        return time_on_air(self._air_config, self._tx_len, self._preamble) * 1.1 + self.ack_turnaround
+
+    def _ack_timeout(self):
+        if self.retry_timeout is not None:
+            return self.retry_timeout
+        return self.time_on_air(1) + 2 * self.ack_turnaround
+
+    def _backoff(self, attempt=0):
+        # ack window for a send_to_wait attempt, with a backoff that grows with each retry so senders
+        # whose frames collided don't collide again
+        return self._ack_timeout() + self._backoff_time(attempt)
 
     def wait_packet_sent(self):
-        # wait for `_handle_interrupt` to switch the mode back
-        start = time.time()
-        while time.time() - start < self.wait_packet_sent_timeout:
+        # wait for `_handle_interrupt` to switch the mode back, after any queued frames
+        return self._wait_sent()
+
+    def _wait_sent(self):
+        # wait_packet_sent, always blocking: what the driver's own synchronous methods wait with, as AsyncLoRa
+        # makes wait_packet_sent a coroutine
+        # ticks, not time.time(): on MicroPython that counts whole seconds
+        start = ticks_ms()
+        timeout = int(self._tx_timeout() * (1 + self.tx_pending) * 1000) + 1
+        while ticks_diff(ticks_ms(), start) < timeout:
             if self._mode != MODE_TX:
                 return True
+            if self._in_handler:
+                # called from the (soft) receive handler, which the TxDone interrupt can't preempt
+                if self._spi_read(_REG_12_IRQ_FLAGS) & _TX_DONE:
+                    self._spi_write(_REG_12_IRQ_FLAGS, _TX_DONE | _FHSS_CHANGE_CHANNEL)
+                    self.set_mode_idle()
+                    if METRICS:
+                        self._count_tx()
+                    return True
+                time.sleep(0.001)
 
         return False
 
     def set_mode_idle(self):
         if self._mode != MODE_STDBY:
-            self._spi_write(REG_01_OP_MODE, MODE_STDBY)
+            self._spi_write(_REG_01_OP_MODE, MODE_STDBY)
             self._mode = MODE_STDBY
 
     def send(self, data, header_to, header_id=0, header_flags=0):
+        # False, without sending, if listen before talk gave up on a busy channel
+        self.wait_packet_sent()
+        self.set_mode_idle()
+        if not self.wait_cad():
+            return False
+        # CadDone may have started queued frames
         self.wait_packet_sent()
         self.set_mode_idle()
-        self.wait_cad()
 
-        header = [header_to, self._this_address, header_id, header_flags]
-        if type(data) == int:
-            data = [data]
-        elif type(data) == bytes:
-            data = [p for p in data]
-        elif type(data) == str:
-            data = [ord(s) for s in data]
+        self._load(data, header_to, header_id, header_flags)
+        self.set_mode_tx()
+        return True
 
+    def _load(self, data, header_to, header_id, header_flags):
+        # write header and data into the FIFO, ready for set_mode_tx
+        length = self._assemble(self._tx_buf, data, header_to, header_id, header_flags)
+        self._tx_len = length
+        if self.capture is not None:
+            self.capture.record(CAPTURE_TX, self._tx_buf, length)
+        self._spi_write(_REG_0D_FIFO_ADDR_PTR, 0)
+        self._spi_write(_REG_00_FIFO, self._tx_view[:length])
+        self._spi_write(_REG_22_PAYLOAD_LENGTH, length)
+
+    def _assemble(self, buf, data, header_to, header_id, header_flags, seal=True):
+        # header and (encrypted) data into buf, returns the frame length
+        # data may be an int, str, bytes, bytearray, memoryview or list of ints
+        # seal: False leaves a crypto frame to _seal, for the transmit queue to number frames in the order they
+        # go out rather than the order they were queued in
+        counter = mac = 0
         if self.crypto:
-            data = [b for b in self._encrypt(bytes(data))]
-
-        payload = header + data
-        self._spi_write(REG_0D_FIFO_ADDR_PTR, 0)
-        self._spi_write(REG_00_FIFO, payload)
-        self._spi_write(REG_22_PAYLOAD_LENGTH, len(payload))
-
-        self.set_mode_tx()
+            header_flags |= FLAGS_CRYPTO
+            counter = _FRAME_COUNTER_LEN
+            mac = self._mac
+        if self._compact:
+            if header_flags & FLAGS_KIND_MASK:
+                raise ValueError("frame kinds need the full header")
+            if header_to >= COMPACT_BROADCAST and header_to != BROADCAST_ADDRESS:
+                raise ValueError("compact header addresses are 0-14")
+            buf[0] = ((header_to & 0x0f) << 4) | self._this_address
+            buf[1] = (header_flags & 0xf0) | (header_id & 0x0f)
+            header = 2
+        else:
+            buf[0] = header_to
+            buf[1] = self._this_address
+            buf[2] = header_id
+            buf[3] = header_flags
+            header = 4
+
+        # encrypted data goes after the frame counter, which _seal fills in
+        start = header + counter
+        if type(data) == int:
+            buf[start] = data
+            length = start + 1
+        else:
+            if type(data) == str:
+                data = data.encode()
+            elif type(data) == list:
+                data = bytes(data)
+            length = start + len(data)
+            if length > (self._fixed_length or MAX_PACKET_LEN) - mac:
+                raise ValueError("payload too long")
+            buf[start:length] = data
+        end = self._fixed_length - mac
+        if length < end:
+            # padded before encryption, so the MAC stays at the end
+            for i in range(length, end):
+                buf[i] = 0
+            length = end
+        if self.crypto and seal:
+            length = self._seal(buf, header, length)
+        return length
+
+    def enqueue(self, data, header_to, priority=PRIORITY_NORMAL, header_id=0, header_flags=0):
+        """
+        enqueue(data, header_to, priority=PRIORITY_NORMAL, header_id=0, header_flags=0)
+        Queue a frame and return at once (needs tx_queue). The interrupt handler starts the next frame on
+        TxDone, highest priority first and oldest first within a priority; a listening radio goes back to
+        receive when the queue is empty. If the queue is full the newest frame of the lowest priority below
+        this one makes room, or this frame is dropped; either way tx_dropped counts it.
+        Returns False if this frame was dropped.
+        """
+        if self._txq_len is None:
+            raise ValueError("enqueue needs tx_queue")
+        if self.crypto:
+            # _tx_next can't raise in the interrupt handler
+            if self.crypto_counter + len(self._txq_len) > 0xffffffff:
+                raise ValueError("crypto_counter used up, change the key")
+            # and must not allocate there: the cipher state and how crypto.encrypt is called are settled here
+            if self._seal_state is None:
+                self._crypto_buffers()
+            if self._encrypt_into is None:
+                self._encipher(bytearray(16), bytearray(16))
+        transport = self._transport
+        state = transport.disable_irq()
+        slot = self._txq_reserve(priority)
+        transport.enable_irq(state)
+        if slot < 0:
+            self.tx_dropped += 1
+            return False
+
+        try:
+            length = self._assemble(self._txq_slots[slot], data, header_to, header_id, header_flags, False)
+        except Exception:
+            self._txq_prio[slot] = priority  # release the reservation
+            raise
+
+        state = transport.disable_irq()
+        self._txq_counter = (self._txq_counter + 1) & 0x3fffffff
+        self._txq_seq[slot] = self._txq_counter
+        self._txq_prio[slot] = priority
+        self._txq_len[slot] = length
+        if self._mode != MODE_TX and self._mode != MODE_CAD:
+            if self._mode == MODE_RXCONTINUOUS:
+                self._txq_rx = True
+            self._tx_next()
+        transport.enable_irq(state)
         return True
 
-    def send_to_wait(self, data, header_to, header_flags=0, retries=3):
-        self._last_header_id += 1
+    @property
+    def tx_queue(self):
+        # frames the transmit queue holds, 0 without one (enqueue() then raises)
+        if self._txq_len is None:
+            return 0
+        return len(self._txq_len)
+
+    @property
+    def transmitting(self):
+        # True while a frame or a CAD is on the air
+        return self._mode == MODE_TX or self._mode == MODE_CAD
+
+    @property
+    def tx_pending(self):
+        # frames waiting in the transmit queue
+        if self._txq_len is None:
+            return 0
+        return len(self._txq_len) - self._txq_len.count(0)
+
+    def _txq_reserve(self, priority):
+        # a free slot, or the newest of the lowest priority frames below `priority` (dropped), else -1
+        lens = self._txq_len
+        prio = self._txq_prio
+        seq = self._txq_seq
+        victim = -1
+        for i in range(len(lens)):
+            if prio[i] == _TXQ_RESERVED:
+                continue
+            if not lens[i]:
+                prio[i] = _TXQ_RESERVED
+                return i
+            if prio[i] < priority and (victim < 0 or prio[i] < prio[victim] or
+                                       (prio[i] == prio[victim] and seq[i] > seq[victim])):
+                victim = i
+        if victim >= 0:
+            lens[victim] = 0
+            prio[victim] = _TXQ_RESERVED
+            self.tx_dropped += 1
+        return victim
+
+    def _tx_next(self):
+        # start the next queued frame, or go back to receive if asked to once the queue is empty;
+        # returns True if a frame was started. Runs in the interrupt handlers: no allocation
+        lens = self._txq_len
+        if lens is None:
+            return False
+        prio = self._txq_prio
+        seq = self._txq_seq
+        best = -1
+        for i in range(len(lens)):
+            if lens[i] and (best < 0 or prio[i] > prio[best] or (prio[i] == prio[best] and seq[i] < seq[best])):
+                best = i
+
+        if best < 0:
+            if self._txq_rx:
+                self._txq_rx = False
+                self._retune()
+                self._spi_write(_REG_01_OP_MODE, MODE_RXCONTINUOUS)
+                self._spi_write(_REG_40_DIO_MAPPING1, 0x00)  # Interrupt on RxDone
+                self._mode = MODE_RXCONTINUOUS
+            return False
+
+        buf = self._txq_slots[best]
+        length = lens[best]
+        if buf[self._header_len - 1] & FLAGS_CRYPTO:
+            # numbered now, so a frame overtaking older ones doesn't get them dropped as replays
+            length = self._seal(buf, self._header_len, length)
+        if self.capture is not None:
+            self.capture.record(CAPTURE_TX, buf, length)
+        if self._mode != MODE_STDBY:
+            self._spi_write(_REG_01_OP_MODE, MODE_STDBY)
+        self._spi_write(_REG_0D_FIFO_ADDR_PTR, 0)
+        self._spi_write(_REG_00_FIFO, self._txq_views[best][(length + 15) >> 4])
+        self._spi_write(_REG_22_PAYLOAD_LENGTH, length)
+        lens[best] = 0
+        self._tx_len = length
+        if METRICS:
+            self._tx_start = ticks_us()
+        self._retune()
+        self._spi_write(_REG_01_OP_MODE, MODE_TX)
+        self._spi_write(_REG_40_DIO_MAPPING1, 0x40)  # Interrupt on TxDone
+        self._mode = MODE_TX
+        return True
 
-        for _ in range(retries + 1):
-            self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+    def send_to_wait(self, data, header_to, header_flags=0, retries=3, header_id=None):
+        # True once acked, see last_ack. header_id: None for the next one, else resend under that id
+        self._last_header_id = (self._last_header_id + 1) & 0xff if header_id is None else header_id
+
+        for attempt in range(retries + 1):
+            if attempt:
+                header_flags |= FLAGS_RETRY
+                if METRICS:
+                    self.tx_retries += 1
+            sent = self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+            sent_at = ticks_us()
+            # switching to rx while the frame is still on air aborts it
+            self.wait_packet_sent()
             self.set_mode_rx()
+            if not sent:
+                continue
 
             if header_to == BROADCAST_ADDRESS:  # Don't wait for acks from a broadcast message
                 return True
 
-            start = time.time()
-            while time.time() - start < self.retry_timeout + (self.retry_timeout * (getrandbits(16) / (2**16 - 1))):
-                if self._last_payload:
-                    if self._last_payload.header_to == self._this_address and \
-                            self._last_payload.header_flags & FLAGS_ACK and \
-                            self._last_payload.header_id == self._last_header_id:
-
-                        # We got an ACK
-                        return True
+            start = ticks_ms()
+            window = int(self._backoff(attempt) * 1000) + 1
+            while ticks_diff(ticks_ms(), start) < window:
+                ack = self._last_payload
+                if self._is_ack(ack):
+                    # We got an ACK
+                    self.last_ack = ack
+                    if METRICS:
+                        self.ack_rtt_us.add(ticks_diff(ticks_us(), sent_at))
+                        self.retries.add(attempt)
+                    return True
+            self.ack_timeouts += 1
+        if METRICS:
+            self.retries.add(retries + 1)
         return False
 
+    def _is_ack(self, payload):
+        # is `payload` the ack for our last send_to_wait
+        return payload is not None and payload.header_to == self._this_address and \
+            payload.header_flags & FLAGS_ACK and payload.header_id == self._last_header_id & self._id_mask
+
+    @property
+    def last_header_id(self):
+        # header_id of the last send_to_wait
+        return self._last_header_id
+
     def send_ack(self, header_to, header_id):
-        self.send(b'!', header_to, header_id, FLAGS_ACK)
+        self.send_control(b'!', header_to, header_id, FLAGS_ACK)
+
+    def ack(self, payload):
+        # ack a received payload, through the ack_payload and acked hooks
+        self.send_control(self._ack_data(payload), payload.header_from, payload.header_id, FLAGS_ACK)
+        if self.acked is not None:
+            self.acked(payload)
+
+    def _ack_data(self, payload):
+        data = None
+        if self.ack_payload is not None:
+            data = self.ack_payload(payload)
+        return b'!' if data is None else data
+
+    def send_control(self, data, header_to, header_id, header_flags):
+        # a reply to the frame just received (acks and the like): with a transmit queue it goes ahead of
+        # anything queued without blocking the receive handler, otherwise it is sent and waited for
+        if self._txq_len is not None:
+            self.enqueue(data, header_to, PRIORITY_ACK, header_id, header_flags)
+            return
+        # no listen before talk: the peer is waiting for this and should be the only one expecting the channel
+        self.wait_packet_sent()
+        self.set_mode_idle()
+        self._load(data, header_to, header_id, header_flags)
+        self.set_mode_tx()
         self.wait_packet_sent()
 
     def _spi_write(self, register, payload):
+        # payload is an int (single register) or anything bytes-like, sent as one burst
+        shadow = self._shadow
         if type(payload) == int:
-            payload = [payload]
-        elif type(payload) == bytes:
-            payload = [p for p in payload]
-        elif type(payload) == str:
-            payload = [ord(s) for s in payload]
-        self.cs.value(0)
-        self.spi.write(bytearray([register | 0x80] + payload))
-        self.cs.value(1)
+            if shadow is not None and self._shadow_valid[register] != 2:
+                if self._shadow_valid[register] and shadow[register] == payload:
+                    self.shadow_hits += 1
+                    return
+                shadow[register] = payload
+                self._shadow_valid[register] = 1
+            self._transport.write_reg(register, payload)
+            return
+        if type(payload) == str:
+            payload = payload.encode()
+        elif type(payload) == list:
+            payload = bytes(payload)
+        self._transport.write(register, payload)
+        # bursts always go out, the FIFO doesn't auto-increment so there is nothing to record for it
+        if shadow is not None and register != _REG_00_FIFO:
+            valid = self._shadow_valid
+            for i in range(len(payload)):
+                if valid[register + i] != 2:
+                    shadow[register + i] = payload[i]
+                    valid[register + i] = 1
 
     def _spi_read(self, register, length=1):
-        self.cs.value(0)
         if length == 1:
-            data = self.spi.read(length + 1, register)[1]
-        else:
-            data = self.spi.read(length + 1, register)[1:]
-        self.cs.value(1)
-        return data
+            shadow = self._shadow
+            if shadow is None or self._shadow_valid[register] == 2:
+                return self._transport.read_reg(register)
+            if self._shadow_valid[register]:
+                self.shadow_hits += 1
+                return shadow[register]
+            shadow[register] = self._transport.read_reg(register)
+            self._shadow_valid[register] = 1
+            return shadow[register]
+        return self._transport.read(register, length)
+
+    def invalidate(self):
+        # forget the register shadow, the next access to each register goes to the chip
+        if self._shadow is None:
+            return
+        valid = self._shadow_valid
+        for register in range(len(valid)):
+            valid[register] = 0
+        for register in SHADOW_VOLATILE:
+            valid[register] = 2
+        if self._hops is not None:
+            # still retuned by _handle_hop, as set_hopping marked them
+            for register in (_REG_06_FRF_MSB, _REG_07_FRF_MID, _REG_08_FRF_LSB):
+                valid[register] = 2
+
+    def resync(self):
+        # reload the register shadow from the chip in one burst (REG_01 up, skipping the FIFO)
+        if self._shadow is None:
+            return
+        regs = bytearray(len(self._shadow))
+        self._transport.readinto(_REG_01_OP_MODE, memoryview(regs)[1:])
+        self._load_shadow(regs)
+
+    def _load_shadow(self, regs):
+        # regs[register] as read from the chip, from REG_01 up to len(regs)
+        shadow = self._shadow
+        valid = self._shadow_valid
+        for register in range(1, len(regs)):
+            if valid[register] != 2:
+                shadow[register] = regs[register]
+                valid[register] = 1
         
-    def _decrypt(self, message):
-        decrypted_msg = self.crypto.decrypt(message)
-        msg_length = decrypted_msg[0]
-        return decrypted_msg[1:msg_length + 1]
-
-    def _encrypt(self, message):
-        msg_length = len(message)
-        padding = bytes(((math.ceil((msg_length + 1) / 16) * 16) - (msg_length + 1)) * [0])
-        msg_bytes = bytes([msg_length]) + message + padding
-        encrypted_msg = self.crypto.encrypt(msg_bytes)
-        return encrypted_msg
+    def _encipher(self, blocks, out):
+        # ECB over whole 16 byte blocks into out (the same length), straight into it if crypto.encrypt
+        # takes an output buffer as cryptolib's does
+        if self._encrypt_into is None:
+            try:
+                self.crypto.encrypt(blocks, out)
+                self._encrypt_into = True
+                return
+            except TypeError:
+                self._encrypt_into = False
+        if self._encrypt_into:
+            self.crypto.encrypt(blocks, out)
+        else:
+            out[:] = self.crypto.encrypt(blocks)
+
+    def _nonce(self, block, offset, frame, header, domain, length):
+        # block[offset:offset + 15]: domain, the frame's header bytes (zero filled to 4), its counter and length
+        block[offset] = domain
+        for i in range(4):
+            block[offset + 1 + i] = frame[i] if i < header else 0
+        for i in range(_FRAME_COUNTER_LEN):
+            block[offset + 5 + i] = frame[header + i]
+        block[offset + 9] = length
+        for i in range(offset + 10, offset + 15):
+            block[i] = 0
+
+    def _crypto_buffers(self):
+        # counter mode, see _seal / _open. Sealing (main loop, or an ack from the receive handler, with the
+        # handler held off) and opening (receive handler or service()) each have their own state, so a frame
+        # arriving never overwrites the keystream of one being sent. Here from __init__, or on first use if
+        # crypto was set later
+        self._seal_state = self._cipher_state()
+        self._open_state = self._cipher_state()
+        self._plain = bytearray(256)
+        self._rx_counters = [-1] * 256  # per sender address, the highest frame counter taken
+
+    def _cipher_state(self):
+        # a frame's counter blocks (up to 17) built in ctr and enciphered with one call into ks, both with
+        # views in 16 byte steps, and the CBC-MAC's input and output block
+        ctr = bytearray(272)
+        ks = bytearray(272)
+        return (ctr, [memoryview(ctr)[:i << 4] for i in range(18)], ks, [memoryview(ks)[:i << 4] for i in range(18)],
+                bytearray(16), bytearray(16))
+
+    def _keystream(self, state, frame, header, size):
+        # counter mode keystream for size bytes of frame's data into state's ks: block 0 masks the MAC,
+        # the data uses 1 on
+        ctr, ctr_views, ks, ks_views, _, _ = state
+        blocks = ((size + 15) >> 4) + 1
+        for n in range(blocks):
+            self._nonce(ctr, n << 4, frame, header, _CTR_BLOCK, 0)
+            ctr[(n << 4) + 15] = n
+        self._encipher(ctr_views[blocks], ks_views[blocks])
+        return ks
+
+    def _cbc_mac(self, state, frame, header, end):
+        # CBC-MAC of frame[header:end] (counter and encrypted data) with the header and length in the
+        # first block, into state's output block
+        block = state[4]
+        out = state[5]
+        self._nonce(block, 0, frame, header, _MAC_BLOCK, end - header)
+        block[15] = 0
+        self._encipher(block, out)
+        for start in range(header, end, 16):
+            for i in range(16):
+                j = start + i
+                block[i] = out[i] ^ (frame[j] if j < end else 0)
+            self._encipher(block, out)
+        return out
+
+    def _seal(self, buf, header, length):
+        # number the frame in buf, encrypt its data (buf[header + 4:length]) in place and append the MAC;
+        # returns the new length. The interrupt handler, whose acks are sealed too, is held off throughout
+        if self._seal_state is None:
+            self._crypto_buffers()
+        transport = self._transport
+        irq = transport.disable_irq()
+        try:
+            counter = self.crypto_counter
+            if counter > 0xffffffff:
+                raise ValueError("crypto_counter used up, change the key")
+            self.crypto_counter = counter + 1
+            for i in range(_FRAME_COUNTER_LEN):
+                buf[header + i] = (counter >> (i << 3)) & 0xff
+            state = self._seal_state
+            start = header + _FRAME_COUNTER_LEN
+            ks = self._keystream(state, buf, header, length - start)
+            for i in range(start, length):
+                buf[i] ^= ks[i - start + 16]
+            if self._mac:
+                tag = self._cbc_mac(state, buf, header, length)
+                for i in range(self._mac):
+                    buf[length + i] = tag[i] ^ ks[i]
+                length += self._mac
+            return length
+        finally:
+            transport.enable_irq(irq)
+
+    def _open(self, packet, header, sender):
+        # the decrypted data of a FLAGS_CRYPTO frame from sender, None if it is too short, its MAC doesn't
+        # match or its counter isn't above the last one taken from sender
+        if self._seal_state is None:
+            self._crypto_buffers()
+        mac = self._mac
+        start = header + _FRAME_COUNTER_LEN
+        end = len(packet) - mac
+        if end < start:
+            return None
+        counter = 0
+        for i in range(_FRAME_COUNTER_LEN):
+            counter |= packet[header + i] << (i << 3)
+        if counter <= self._rx_counters[sender]:
+            return None
+        state = self._open_state
+        ks = self._keystream(state, packet, header, end - start)
+        if mac:
+            tag = self._cbc_mac(state, packet, header, end)
+            diff = 0
+            for i in range(mac):
+                diff |= tag[i] ^ ks[i] ^ packet[end + i]
+            if diff:
+                return None
+        self._rx_counters[sender] = counter
+        plain = self._plain
+        for i in range(start, end):
+            plain[i - start] = packet[i] ^ ks[i - start + 16]
+        return bytes(plain[:end - start])
+
+    def _read_status(self):
+        # one burst over REG_10..REG_1A, see the layout at self._status; returns the irq flags
+        self._transport.readinto(_REG_10_FIFO_RX_CURRENT_ADDR, self._status)
+        return self._status[2]
+
+    def _fetch_packet(self, view):
+        # point the FIFO at the packet and clear the irq flags in one burst, then read it into view
+        self._rx_regs[0] = self._status[0]
+        self._transport.write(_REG_0D_FIFO_ADDR_PTR, self._rx_regs)
+        self._transport.readinto(_REG_00_FIFO, view)
+
+    def _count_tx(self):
+        # a frame got through TxDone, interrupt handler context
+        self.tx_packets += 1
+        self.tx_us.add(ticks_diff(ticks_us(), self._tx_start))
 
     def _handle_interrupt(self, channel):
-        irq_flags = self._spi_read(REG_12_IRQ_FLAGS)
-
-        print(f"Got an interrupt -> {irq_flags}")
-
-        if self._mode == MODE_RXCONTINUOUS and (irq_flags & RX_DONE):
-            packet_len = self._spi_read(REG_13_RX_NB_BYTES)
-            self._spi_write(REG_0D_FIFO_ADDR_PTR, self._spi_read(REG_10_FIFO_RX_CURRENT_ADDR))
-
-            packet = self._spi_read(REG_00_FIFO, packet_len)
-            self._spi_write(REG_12_IRQ_FLAGS, 0xff)  # Clear all IRQ flags
-
-            snr = self._spi_read(REG_19_PKT_SNR_VALUE) / 4
-            rssi = self._spi_read(REG_1A_PKT_RSSI_VALUE)
-
-            if snr < 0:
-                rssi = snr + rssi
+        if METRICS:
+            start = ticks_us()
+        irq_flags = self._read_status()
+        if irq_flags & (_RX_DONE | _TX_DONE):
+            self._retune()
+
+        if self._mode == MODE_RXCONTINUOUS and (irq_flags & _RX_DONE):
+            status = self._status
+            packet = self._rx_view[:status[3]]
+            self._fetch_packet(packet)  # also clears the irq flags
+
+            if irq_flags & _PAYLOAD_CRC_ERROR:
+                self.crc_errors += 1
             else:
-                rssi = rssi * 16 / 15
+                snr, rssi = self._packet_signal(status[9], status[10])
+                # the TxDone of an ack sent from in here can't interrupt us, see wait_packet_sent
+                self._in_handler = True
+                try:
+                    self._receive(packet, snr, rssi)
+                finally:
+                    self._in_handler = False
+            if METRICS:
+                self.isr_us.add(ticks_diff(ticks_us(), start))
+            return
+
+        elif self._mode == MODE_TX and (irq_flags & _TX_DONE):
+            self.set_mode_idle()
+            if METRICS:
+                self._count_tx()
+            self._tx_next()
+            if self._tx_flag is not None:
+                self._tx_flag.set()
+
+        elif self._mode == MODE_CAD and (irq_flags & _CAD_DONE):
+            self._cad = irq_flags & _CAD_DETECTED
+            self.set_mode_idle()
+            # frames enqueued during the CAD wait for this
+            self._tx_next()
+            if self._cad_flag is not None:
+                self._cad_flag.set()
+
+        self._spi_write(_REG_12_IRQ_FLAGS, 0xff)
+        if METRICS:
+            self.isr_us.add(ticks_diff(ticks_us(), start))
+
+    def _packet_signal(self, snr, rssi):
+        # raw RegPktSnrValue (two's complement, quarter dB) / RegPktRssiValue to (snr, rssi)
+        if snr > 127:
+            snr -= 256
+        snr = snr / 4
+
+        if snr < 0:
+            rssi = snr + rssi
+        else:
+            rssi = rssi * 16 / 15
 
-            if self._freq >= 779:
-                rssi = round(rssi - 157, 2)
-            else:
-                rssi = round(rssi - 164, 2)
+        if self._freq >= 779:
+            rssi = round(rssi - 157, 2)
+        else:
+            rssi = round(rssi - 164, 2)
+        return snr, rssi
+
+    def _parse(self, packet, snr, rssi):
+        # Payload for a raw packet, or None if it is too short or not for us
+        header = self._header_len
+        if len(packet) < header:
+            return None
+
+        if self._compact:
+            header_to = packet[0] >> 4
+            if header_to == COMPACT_BROADCAST:
+                header_to = BROADCAST_ADDRESS
+            header_from = packet[0] & 0x0f
+            header_id = packet[1] & 0x0f
+            header_flags = packet[1] & 0xf0
+        else:
+            header_to = packet[0]
+            header_from = packet[1]
+            header_id = packet[2]
+            header_flags = packet[3]
+
+        if (self._this_address != header_to) and ((header_to != BROADCAST_ADDRESS) or (self._receive_all is False)):
+            if METRICS:
+                self.rx_filtered += 1
+            return None
+        if METRICS:
+            self.rx_packets += 1
+
+        if header_flags & FLAGS_CRYPTO:
+            message = self._open(packet, header, header_from) if self.crypto else None
+            if message is None:
+                self.crypto_errors += 1
+                return None
+        elif self.crypto and self._mac:
+            # a MAC is expected and a plain frame has none
+            self.crypto_errors += 1
+            return None
+        else:
+            message = bytes(packet[header:]) if len(packet) > header else b''
 
-            if packet_len >= 4:
-                header_to = packet[0]
-                header_from = packet[1]
-                header_id = packet[2]
-                header_flags = packet[3]
-                message = bytes(packet[4:]) if packet_len > 4 else b''
+        return Payload(message, header_to, header_from, header_id, header_flags, rssi, snr)
 
-                if (self._this_address != header_to) and ((header_to != BROADCAST_ADDRESS) or (self._receive_all is False)):
-                    return
+    def _wants_ack(self, payload):
+        return self._acks and payload.header_to == self._this_address and not payload.header_flags & FLAGS_ACK
 
-                if self.crypto and len(message) % 16 == 0:
-                    message = self._decrypt(message)
+    def _receive(self, packet, snr, rssi, ticks=None):
+        payload = self._dispatch(packet, snr, rssi, ticks)
+        if payload is None:
+            return
 
-                if self._acks and header_to == self._this_address and not header_flags & FLAGS_ACK:
-                    self.send_ack(header_from, header_id)
+        if self._wants_ack(payload):
+            self.ack(payload)
 
-                self.set_mode_rx()
+        self.set_mode_rx()
 
-                self._last_payload = namedtuple(
-                    "Payload",
-                    ['message', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
-                )(message, header_to, header_from, header_id, header_flags, rssi, snr)
+        if self._accept(payload):
+            self.on_recv(payload)
 
-                if not header_flags & FLAGS_ACK:
-                    self.on_recv(self._last_payload)
+    def _dispatch(self, packet, snr, rssi, ticks=None):
+        # receive path up to the ack, shared with AsyncLoRa: capture, parse, monitors and the handlers of
+        # frame kinds. Returns the Payload still to be acked and accepted, None if nothing is left to do.
+        # ticks: when the packet came in if not just now, i.e. latched by the deferred handler
+        if self.capture is not None:
+            self.capture.record(CAPTURE_RX, packet, len(packet), rssi, snr, ticks)
+        payload = self._parse(packet, snr, rssi)
+        if payload is None:
+            return None
 
-        elif self._mode == MODE_TX and (irq_flags & TX_DONE):
-            self.set_mode_idle()
+        for monitor in self.monitors:
+            monitor(payload)
 
-        elif self._mode == MODE_CAD and (irq_flags & CAD_DONE):
-            self._cad = irq_flags & CAD_DETECTED
-            self.set_mode_idle()
+        handler = self.handlers.get(payload.header_flags & FLAGS_KIND_MASK)
+        if handler is not None:
+            handler(payload)
+            self.set_mode_rx()
+            return None
+        return payload
+
+    def _accept(self, payload):
+        # receive path after the ack: True if payload is new data for on_recv (not an ack, not a duplicate)
+        self._last_payload = payload
+        if payload.header_flags & FLAGS_ACK:
+            return False
+        if self._is_duplicate(payload):
+            self.rx_duplicates += 1
+            return False
+        return True
+
+    def _is_duplicate(self, payload):
+        # note the header_id of a frame from its sender, True if it is a retry of one already delivered;
+        # a frame without FLAGS_RETRY is always new, so a rebooted sender restarting its ids gets through
+        peers = self._dup_from
+        if peers is None:
+            return False
+        used = self._dup_used
+        sender = payload.header_from
+        slot = 0
+        for i in range(len(peers)):
+            if used[i] and peers[i] == sender:
+                slot = i
+                break
+            if used[i] < used[slot]:
+                slot = i
+        else:
+            # not heard from lately, take over the least recently used entry
+            peers[slot] = sender
+            for i in range(slot * DEDUPE_IDS, (slot + 1) * DEDUPE_IDS):
+                self._dup_ids[i] = -1
+        self._dup_clock = (self._dup_clock & 0x3fffffff) + 1
+        used[slot] = self._dup_clock
+
+        ids = self._dup_ids
+        base = slot * DEDUPE_IDS
+        header_id = payload.header_id
+        if payload.header_flags & FLAGS_RETRY:
+            for i in range(base, base + DEDUPE_IDS):
+                if ids[i] == header_id:
+                    return True
+        for i in range(base + DEDUPE_IDS - 1, base, -1):
+            ids[i] = ids[i - 1]
+        ids[base] = header_id
+        return False
 
-        self._spi_write(REG_12_IRQ_FLAGS, 0xff)
+    def _handle_interrupt_deferred(self, channel):
+        # hard interrupt context: no allocation, no printing, no waiting
+        if METRICS:
+            start = ticks_us()
+        transport = self._transport
+        irq_flags = self._read_status()
+        cleared = False
+        if irq_flags & (_RX_DONE | _TX_DONE):
+            self._retune()
+
+        if self._mode == MODE_RXCONTINUOUS and (irq_flags & _RX_DONE):
+            head = self._rx_head
+            nxt = head + 1
+            if nxt == len(self._rx_slots):
+                nxt = 0
+            if irq_flags & _PAYLOAD_CRC_ERROR:
+                self.crc_errors += 1
+            elif nxt == self._rx_tail:
+                self.rx_overflows += 1
+            else:
+                status = self._status
+                meta = self._rx_meta
+                i = head << 2
+                meta[i] = status[3]
+                meta[i + 1] = irq_flags
+                meta[i + 2] = status[9]
+                meta[i + 3] = status[10]
+                self._rx_ticks[head] = ticks_us()
+                self._fetch_packet(self._rx_views[head][(status[3] + 15) >> 4])
+                cleared = True
+                self._rx_head = nxt
+
+                if not self._service_pending and self.schedule is not None:
+                    self._service_pending = True
+                    try:
+                        self.schedule(self._service_ref, None)
+                    except RuntimeError:
+                        # scheduler queue full, the next packet retries
+                        self._service_pending = False
+
+        elif self._mode == MODE_TX and (irq_flags & _TX_DONE):
+            transport.write_reg(_REG_01_OP_MODE, MODE_STDBY)
+            self._mode = MODE_STDBY
+            if METRICS:
+                self._count_tx()
+            self._tx_next()
+            if self._tx_flag is not None:
+                self._tx_flag.set()
+
+        elif self._mode == MODE_CAD and (irq_flags & _CAD_DONE):
+            self._cad = irq_flags & _CAD_DETECTED
+            transport.write_reg(_REG_01_OP_MODE, MODE_STDBY)
+            self._mode = MODE_STDBY
+            # frames enqueued during the CAD wait for this
+            self._tx_next()
+            if self._cad_flag is not None:
+                self._cad_flag.set()
+
+        if not cleared:
+            transport.write_reg(_REG_12_IRQ_FLAGS, 0xff)
+        if METRICS:
+            self.isr_us.add(ticks_diff(ticks_us(), start))
+
+    @property
+    def rx_pending(self):
+        # packets latched by the deferred handler and not yet serviced
+        n = self._rx_head - self._rx_tail
+        return n + len(self._rx_slots) if n < 0 else n
+
+    def _next_packet(self):
+        # oldest packet in the deferred ring as (packet, snr, rssi, ticks at the latch), freeing its slot
+        tail = self._rx_tail
+        if tail == self._rx_head:
+            return None
+        i = tail << 2
+        meta = self._rx_meta
+        packet = bytes(self._rx_views[tail][16][:meta[i]])
+        snr, rssi = self._packet_signal(meta[i + 2], meta[i + 3])
+        ticks = self._rx_ticks[tail]
+        self._rx_tail = tail + 1 if tail + 1 < len(self._rx_slots) else 0
+        return packet, snr, rssi, ticks
+
+    def service(self, _=None):
+        # soft context half of the deferred handler, returns the number of packets handled
+        self._service_pending = False
+        handled = 0
+        while True:
+            item = self._next_packet()
+            if item is None:
+                return handled
+            self._receive(*item)
+            handled += 1
+
+    def inject(self, packet, snr=0, rssi=0):
+        # run a raw frame (header included) through the receive path as if the radio had just received it,
+        # e.g. to replay a capture
+        self._receive(packet, snr, rssi)
+
+    def disable_irq(self):
+        # hold off the radio's interrupt handler, e.g. around state it shares with a layer; returns the
+        # state for enable_irq. With deferred=True that is only the latching half, not service()
+        return self._transport.disable_irq()
+
+    def enable_irq(self, state):
+        self._transport.enable_irq(state)
+
+    def stats(self, reset=False):
+        """
+        stats(reset=False)
+        The counters above as a dict, the histograms as {"count", "max", "buckets"} (see Histogram) and
+        spi_transactions / spi_bytes since the last reset, all read with the interrupt held off.
+        reset: zero everything once read, e.g. each time a gateway exports them
+        """
+        transport = self._transport
+        names = self.stats_counters + self.metrics_counters if METRICS else self.stats_counters
+        state = transport.disable_irq()
+        stats = {}
+        for name in names:
+            stats[name] = getattr(self, name)
+        spi = (transport.spi_transactions, transport.spi_bytes)
+        stats["spi_transactions"] = (spi[0] - self._spi_base[0]) & 0x3fffffff
+        stats["spi_bytes"] = (spi[1] - self._spi_base[1]) & 0x3fffffff
+        if METRICS:
+            for name in self.metrics_histograms:
+                stats[name] = getattr(self, name).snapshot()
+        if reset:
+            for name in names:
+                setattr(self, name, 0)
+            if METRICS:
+                for name in self.metrics_histograms:
+                    getattr(self, name).reset()
+            self._spi_base = spi
+        transport.enable_irq(state)
+        return stats
+
+    def snapshot(self):
+        # all LoRa registers in one burst read, as a ulora_regs.Snapshot
+        from ulora_regs import Snapshot
+        return Snapshot.read(self._transport)
 
     def close(self):
-        self.spi.deinit()
+        self._transport.deinit()
@@ -0,0 +1,285 @@
+"""
+Adaptive data rate: pick the fastest ModemConfig the links can carry and move both ends to it.
+
+    adr = Adr(lora)                     # on every node, starts collecting link statistics
+    ...
+    adr.adapt(SERVER_ADDRESS)           # from time to time on one end: switch if another preset fits better
+    adr.poll()                          # in the main loop of the other end, see below
+
+Every frame received for us adds its SNR and RSSI to a rolling window kept
+per sender (the `links` dict, up to `max_peers` senders).  From the window
+mean, margin() estimates how many dB a link would have left at another
+preset: the SNR moved to the other bandwidth's noise floor, less the SNR
+the spreading factor needs to demodulate (SX127x datasheet), or from the
+RSSI against the preset's sensitivity while the SNR is above 0 dB, where
+the chip's reading flattens out.  select() takes the fastest preset, by
+time on air, that leaves every peer asked about `margin` dB, and the
+slowest one if none does.
+
+An SX127x hears one setting at a time, so both ends change together with
+KIND_ADR control frames:
+
+    PROPOSE config  ->              sent on the old settings
+                    <- PROPOSE ack  the peer switches once the ack is out
+    CONFIRM         ->              sent on the new settings
+                    <- CONFIRM ack  done
+
+The proposing end goes back to the old settings if no CONFIRM ack comes
+back; the peer does the same if no CONFIRM arrives within `fallback`
+seconds, which is what poll() checks.  adapt() with several peers moves
+them all: every one has to accept before anyone confirms.  One case is
+left open: a peer that got CONFIRM but whose acks were all lost stays
+behind on the new settings.  This works with LoRa, not AsyncLoRa.
+"""
+import math
+
+from ulora import KIND_ADR, FLAGS_ACK, BANDWIDTHS, ModemConfig, time_on_air, ticks_ms, ticks_diff
+
+# fastest to slowest is worked out from the time on air, the order here doesn't matter
+PRESETS = (ModemConfig.Bw500Cr45Sf128, ModemConfig.Bw125Cr45Sf128, ModemConfig.Lorawan,
+           ModemConfig.Bw31_25Cr48Sf512, ModemConfig.Bw125Cr45Sf2048, ModemConfig.Bw125Cr48Sf4096)
+
+# SNR (dB) the demodulator needs per spreading factor, SF6..SF12
+REQUIRED_SNR = (-5.0, -7.5, -10.0, -12.5, -15.0, -17.5, -20.0)
+NOISE_FIGURE = 6.0  # dB, receiver noise figure assumed for sensitivity()
+
+_PROPOSE = 1
+_CONFIRM = 2
+
+
+def sensitivity(modem_config):
+    # weakest signal (dBm) a preset receives: thermal noise over the bandwidth, noise figure, required SNR
+    bw = BANDWIDTHS[modem_config[0] >> 4]
+    return -174 + 10 * math.log10(bw) + NOISE_FIGURE + REQUIRED_SNR[(modem_config[1] >> 4) - 6]
+
+
+class _Link(object):
+    # the last `window` SNR / RSSI readings from one sender
+    def __init__(self, window):
+        self.snr_window = [0.0] * window
+        self.rssi_window = [0.0] * window
+        self.samples = 0
+        self.heard = 0
+        self._pos = 0
+
+    def add(self, snr, rssi):
+        self.snr_window[self._pos] = snr
+        self.rssi_window[self._pos] = rssi
+        self._pos = (self._pos + 1) % len(self.snr_window)
+        if self.samples < len(self.snr_window):
+            self.samples += 1
+
+    def clear(self):
+        self.samples = 0
+        self._pos = 0
+
+    @property
+    def snr(self):
+        return sum(self.snr_window[:self.samples]) / self.samples if self.samples else None
+
+    @property
+    def rssi(self):
+        return sum(self.rssi_window[:self.samples]) / self.samples if self.samples else None
+
+
+class Adr(object):
+    def __init__(self, lora, presets=PRESETS, margin=10.0, hysteresis=3.0, window=8, min_samples=4,
+                 max_peers=16, retries=3, fallback=None):
+        """
+        Adr(lora, presets=PRESETS, margin=10.0, hysteresis=3.0, window=8, min_samples=4, max_peers=16,
+            retries=3, fallback=None)
+        lora: the LoRa instance to watch and reconfigure
+        presets: ModemConfig tuples to choose from, the same on every node
+        margin: dB a link must have left at the chosen preset
+        hysteresis: extra dB asked for before moving to a faster preset, so links don't flap
+        window: readings averaged per peer
+        min_samples: readings a peer needs before select() takes it into account
+        max_peers: senders tracked, the one heard least recently is forgotten first
+        retries: resends of each control frame before giving up
+        fallback: seconds the peer waits on new settings for CONFIRM, None derives it from the time on air
+        """
+        self.lora = lora
+        self.margin = margin
+        self.hysteresis = hysteresis
+        self.window = window
+        self.min_samples = min_samples
+        self.max_peers = max_peers
+        self.retries = retries
+        self.fallback = fallback
+        self.links = {}
+        self.switches = 0
+        self.failed = 0
+
+        # fastest first, by time on air of a full frame
+        self.presets = sorted(presets, key=lambda preset: time_on_air(preset, 255, lora.preamble))
+
+        self._id = 0
+        self._reply = None  # (header_from, header_id, op) of the last ack
+        self._revert = None  # peer side: (settings to go back to, ticks_ms() of the switch, ms to wait) until CONFIRM
+        self._clock = 0
+
+        lora.monitors.append(self._on_payload)
+        lora.handlers[KIND_ADR] = self._on_control
+
+    def close(self):
+        self.lora.monitors.remove(self._on_payload)
+        self.lora.handlers.pop(KIND_ADR, None)
+
+    def _on_payload(self, payload):
+        # monitor: every frame received for us
+        link = self.links.get(payload.header_from)
+        if link is None:
+            if len(self.links) >= self.max_peers:
+                quiet = min(self.links, key=lambda peer: self.links[peer].heard)
+                del self.links[quiet]
+            link = _Link(self.window)
+            self.links[payload.header_from] = link
+        self._clock += 1
+        link.heard = self._clock
+        link.add(payload.snr, payload.rssi)
+
+    def margin_at(self, peer, modem_config):
+        # dB the link from `peer` would have left at modem_config, None without readings
+        link = self.links.get(peer)
+        if link is None or not link.samples:
+            return None
+        current = self.lora.modem_config
+        snr = link.snr
+        bw_ratio = BANDWIDTHS[modem_config[0] >> 4] / BANDWIDTHS[current[0] >> 4]
+        margin = snr - 10 * math.log10(bw_ratio) - REQUIRED_SNR[(modem_config[1] >> 4) - 6]
+        if snr >= 0:
+            margin = max(margin, link.rssi - sensitivity(modem_config))
+        return margin
+
+    def select(self, peers=None):
+        # fastest preset leaving every peer (all with min_samples readings by default) `margin` dB
+        if peers is None:
+            peers = [peer for peer in self.links if self.links[peer].samples >= self.min_samples]
+        elif type(peers) == int:
+            peers = (peers,)
+        current = self.lora.modem_config
+        faster = True
+        for preset in self.presets:
+            if preset == current:
+                faster = False
+            need = self.margin + (self.hysteresis if faster else 0)
+            fits = True
+            for peer in peers:
+                margin = self.margin_at(peer, preset)
+                if margin is None or margin < need:
+                    fits = False
+                    break
+            if fits:
+                return preset
+        return self.presets[-1]
+
+    def adapt(self, peers=None):
+        # negotiate a switch to select(peers) with them if it differs from the current preset;
+        # True if the radio changed settings
+        if peers is None:
+            peers = [peer for peer in self.links if self.links[peer].samples >= self.min_samples]
+        elif type(peers) == int:
+            peers = [peers]
+        for peer in peers:
+            link = self.links.get(peer)
+            if link is None or link.samples < self.min_samples:
+                return False
+        if not peers:
+            return False
+        preset = self.select(peers)
+        if preset == self.lora.modem_config:
+            return False
+        return self.negotiate(peers, preset)
+
+    def negotiate(self, peers, modem_config):
+        # move this radio and `peers` to modem_config, True once every peer confirmed
+        if type(peers) == int:
+            peers = [peers]
+        lora = self.lora
+        old = lora.modem_config
+        data = bytes((_PROPOSE,)) + bytes(modem_config)
+        for peer in peers:
+            if not self._request(peer, data):
+                # the ones that accepted go back by themselves
+                self.failed += 1
+                return False
+
+        lora.reconfigure(modem_config=modem_config)
+        data = bytes((_CONFIRM,)) + bytes(modem_config)
+        confirmed = True
+        for peer in peers:
+            confirmed = self._request(peer, data) and confirmed
+        if not confirmed:
+            lora.reconfigure(modem_config=old)
+            self.failed += 1
+            return False
+
+        for peer in peers:
+            if peer in self.links:
+                self.links[peer].clear()
+        self.switches += 1
+        return True
+
+    def _reply_timeout(self):
+        lora = self.lora
+        return 2 * lora.time_on_air(4) + 2 * lora.ack_turnaround
+
+    def _request(self, peer, data):
+        # send a control frame until its ack comes back, False after `retries` resends
+        lora = self.lora
+        self._id = (self._id + 1) & 0xff
+        for _ in range(self.retries + 1):
+            self._reply = None
+            lora.send(data, peer, self._id, KIND_ADR)
+            lora.wait_packet_sent()
+            lora.set_mode_rx()
+            start = ticks_ms()
+            timeout = int(self._reply_timeout() * 1000) + 1
+            while ticks_diff(ticks_ms(), start) < timeout:
+                if self._reply == (peer, self._id, data[0]):
+                    return True
+        return False
+
+    def _on_control(self, payload):
+        # receive handler context
+        data = payload.message
+        if len(data) != 4:
+            return
+        op = data[0]
+        if payload.header_flags & FLAGS_ACK:
+            self._reply = (payload.header_from, payload.header_id, op)
+            return
+
+        lora = self.lora
+        modem_config = tuple(data[1:])
+        if modem_config not in self.presets:
+            return
+        if op == _PROPOSE:
+            lora.send_control(data, payload.header_from, payload.header_id, KIND_ADR | FLAGS_ACK)
+            if modem_config != lora.modem_config:
+                old = lora.modem_config if self._revert is None else self._revert[0]
+                lora.reconfigure(modem_config=modem_config)  # waits for the ack to go out first
+                self._revert = (old, ticks_ms(), int(self._fallback() * 1000) + 1)
+        elif op == _CONFIRM and modem_config == lora.modem_config:
+            lora.send_control(data, payload.header_from, payload.header_id, KIND_ADR | FLAGS_ACK)
+            if self._revert is not None:
+                self._revert = None
+                self.switches += 1
+                link = self.links.get(payload.header_from)
+                if link is not None:
+                    link.clear()
+
+    def _fallback(self):
+        if self.fallback is not None:
+            return self.fallback
+        return (self.retries + 2) * self._reply_timeout()
+
+    def poll(self):
+        # go back to the old settings if a proposed switch was never confirmed; True if it did
+        revert = self._revert
+        if revert is None or ticks_diff(ticks_ms(), revert[1]) < revert[2]:
+            return False
+        self._revert = None
+        self.failed += 1
+        self.lora.reconfigure(modem_config=revert[0])
+        return True
@@ -0,0 +1,283 @@
+"""
+asyncio flavour of ulora.LoRa.
+
+    async def main():
+        lora = AsyncLoRa(SPIConfig.rp2_0, 28, 2, 5, reset_pin=27, freq=902.3, acks=True)
+        lora.set_mode_rx()
+        async for payload in lora.packets():
+            print(payload.header_from, payload.message)
+            await lora.send_to_wait(b"pong", payload.header_from)
+
+AsyncLoRa always runs the deferred interrupt handler: TxDone, CadDone and
+newly latched packets set ThreadSafeFlags from the interrupt, and the
+coroutines below await those instead of spinning on the clock, so the
+radio shares the event loop with everything else on the node.  Received
+packets are handed out through `packets()` rather than `on_recv`.
+wait_packet_sent, wait_cad, send and send_to_wait become coroutines; the
+LoRa methods left synchronous still block until a frame on the air is out
+before they touch the radio.
+
+The receive path is LoRa's: monitors, capture and the handlers of frame
+kinds run as they do there, and whole messages the layers put together
+(ulora_frag) come out of packets() too.  Replies sent from the receive
+path (acks, the layers' control frames) can't be awaited there, so
+send_control() enqueues them with a transmit queue, and holds them until
+the handler returns otherwise.  The layers' own send methods expect a
+plain LoRa.
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from ulora import (LoRa, BROADCAST_ADDRESS, FLAGS_ACK, FLAGS_RETRY, METRICS, MODE_TX, PRIORITY_ACK, symbol_time,
+                   ticks_ms, ticks_us, ticks_diff)
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:
+    class ThreadSafeFlag(object):
+        # CPython stand-in for uasyncio.ThreadSafeFlag: set() may be called from any thread
+        def __init__(self):
+            self._event = asyncio.Event()
+            self._loop = None
+            self._early = False
+
+        def set(self):
+            if self._loop is None:
+                self._early = True
+            else:
+                self._loop.call_soon_threadsafe(self._event.set)
+
+        async def wait(self):
+            self._loop = asyncio.get_running_loop()
+            if self._early:
+                self._early = False
+                return
+            await self._event.wait()
+            self._event.clear()
+
+
+class AsyncLoRa(LoRa):
+    stats_counters = LoRa.stats_counters + ("packets_dropped",)
+
+    def __init__(self, *args, queue_size=8, **kwargs):
+        """
+        AsyncLoRa(*args, queue_size=8, **kwargs)
+        Takes the same arguments as LoRa (deferred is always on).
+        queue_size: packets held for packets() before the oldest is dropped (counted in packets_dropped)
+        """
+        kwargs["deferred"] = True
+        super().__init__(*args, **kwargs)
+
+        self._tx_flag = ThreadSafeFlag()
+        self._cad_flag = ThreadSafeFlag()
+        self._rx_flag = ThreadSafeFlag()
+        # the deferred handler "schedules" service by waking our task
+        self.schedule = self._wake
+
+        self._ack_event = asyncio.Event()
+        self._packet_event = asyncio.Event()
+        self._packets = []
+        self._queue_size = queue_size
+        self.packets_dropped = 0
+        self._task = None
+        self._replies = []  # (data, header_to, header_id, header_flags) from send_control
+        self._dispatching = False
+        self._acked = []  # payloads whose acks are in _replies, for the acked hook
+
+    def _wake(self, func, arg):
+        self._rx_flag.set()
+
+    def start(self):
+        # start the receive task, done implicitly by the coroutines below
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def _run(self):
+        while True:
+            await self._rx_flag.wait()
+            self._service_pending = False
+            while True:
+                item = self._next_packet()
+                if item is None:
+                    break
+                await self._receive_async(*item)
+
+    async def _receive_async(self, packet, snr, rssi, ticks=None):
+        self._dispatching = True
+        try:
+            payload = self._dispatch(packet, snr, rssi, ticks)
+        finally:
+            self._dispatching = False
+        # whatever a handler answered
+        await self._send_replies()
+        if payload is None:
+            return
+
+        if self._wants_ack(payload):
+            self.ack(payload)
+            await self._send_replies()
+
+        self.set_mode_rx()
+
+        accepted = self._accept(payload)
+        if payload.header_flags & FLAGS_ACK:
+            self._ack_event.set()
+        if accepted:
+            self.on_recv(payload)
+
+    def on_recv(self, payload):
+        # data frames, and the messages of the layers' handlers, queued for packets()
+        if len(self._packets) >= self._queue_size:
+            self._packets.pop(0)
+            self.packets_dropped += 1
+        self._packets.append(payload)
+        self._packet_event.set()
+
+    async def _wait_flag(self, flag, timeout):
+        try:
+            await asyncio.wait_for(flag.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait_packet_sent(self):
+        # wait for the TxDone interrupt to switch the mode back
+        start = ticks_ms()
+        timeout = self._tx_timeout()
+        while self._mode == MODE_TX:
+            remaining = timeout - ticks_diff(ticks_ms(), start) / 1000
+            if remaining <= 0 or not await self._wait_flag(self._tx_flag, remaining):
+                return self._mode != MODE_TX
+        return True
+
+    async def wait_cad(self):
+        # True once CAD finds the channel clear, False if it stays busy for cad_timeout; backs off like LoRa
+        if not self.cad_timeout:
+            return True
+
+        start = ticks_ms()
+        attempt = 0
+        while True:
+            delay = self._cad_delay(start, attempt)
+            if delay is None:
+                self.cad_failures += 1
+                return False
+            await asyncio.sleep(delay)
+            self._cad = None
+            self.set_mode_cad()
+            if not await self._wait_flag(self._cad_flag, 4 * symbol_time(self._modem_config) + self.ack_turnaround):
+                self.set_mode_idle()
+            if not self._cad:
+                self.cad_idle += 1
+                return True
+            self.cad_busy += 1
+            attempt += 1
+
+    async def send(self, data, header_to, header_id=0, header_flags=0):
+        # False, without sending, if listen before talk gave up on a busy channel
+        self.start()
+        await self.wait_packet_sent()
+        self.set_mode_idle()
+        if not await self.wait_cad():
+            return False
+        # CadDone may have started queued frames
+        await self.wait_packet_sent()
+        self.set_mode_idle()
+
+        self._load(data, header_to, header_id, header_flags)
+        self.set_mode_tx()
+        return True
+
+    async def send_to_wait(self, data, header_to, header_flags=0, retries=3, header_id=None):
+        self._last_header_id = (self._last_header_id + 1) & 0xff if header_id is None else header_id
+
+        for attempt in range(retries + 1):
+            if attempt:
+                header_flags |= FLAGS_RETRY
+                if METRICS:
+                    self.tx_retries += 1
+            sent = await self.send(data, header_to, header_id=self._last_header_id, header_flags=header_flags)
+            sent_at = ticks_us()
+            await self.wait_packet_sent()
+            self.set_mode_rx()
+            if not sent:
+                continue
+
+            if header_to == BROADCAST_ADDRESS:  # Don't wait for acks from a broadcast message
+                return True
+
+            start = ticks_ms()
+            window = self._backoff(attempt)
+            while True:
+                ack = self._last_payload
+                if self._is_ack(ack):
+                    self.last_ack = ack
+                    if METRICS:
+                        self.ack_rtt_us.add(ticks_diff(ticks_us(), sent_at))
+                        self.retries.add(attempt)
+                    return True
+                remaining = window - ticks_diff(ticks_ms(), start) / 1000
+                if remaining <= 0:
+                    break
+                self._ack_event.clear()
+                await self._wait_flag(self._ack_event, remaining)
+            self.ack_timeouts += 1
+        if METRICS:
+            self.retries.add(retries + 1)
+        return False
+
+    def send_control(self, data, header_to, header_id, header_flags):
+        # a reply from the receive path, which can't wait for it to go out: enqueued with a transmit queue,
+        # otherwise sent by the receive task once the handler returns (or by a task of its own from elsewhere)
+        if self._txq_len is not None:
+            self.enqueue(data, header_to, PRIORITY_ACK, header_id, header_flags)
+            return
+        self._replies.append((data if type(data) == int else bytes(data), header_to, header_id, header_flags))
+        if not self._dispatching:
+            asyncio.create_task(self._send_replies())
+
+    def ack(self, payload):
+        # as LoRa.ack, but without a transmit queue acked waits for _send_replies to get the ack out
+        if self._txq_len is not None or self.acked is None:
+            LoRa.ack(self, payload)
+            return
+        self._acked.append(payload)
+        self.send_control(self._ack_data(payload), payload.header_from, payload.header_id, FLAGS_ACK)
+
+    async def _send_replies(self):
+        # no listen before talk, as LoRa.send_control; back to receive after them
+        if not self._replies:
+            return
+        while self._replies:
+            data, header_to, header_id, header_flags = self._replies.pop(0)
+            await self.wait_packet_sent()
+            self.set_mode_idle()
+            self._load(data, header_to, header_id, header_flags)
+            self.set_mode_tx()
+            await self.wait_packet_sent()
+        while self._acked:
+            self.acked(self._acked.pop(0))
+        self.set_mode_rx()
+
+    def packets(self):
+        # async iterator over received packets
+        self.start()
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._packets:
+            self._packet_event.clear()
+            await self._packet_event.wait()
+        return self._packets.pop(0)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        super().close()
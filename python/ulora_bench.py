@@ -0,0 +1,581 @@
+"""
+Packet-rate and latency benchmarks for ulora, run against ulora_sim on a CPython host.
+
+    python ulora_bench.py                      # every case, table on stderr
+    python ulora_bench.py --json bench.json    # also write machine-readable results
+
+Each case pairs a sender and a receiver on one VirtualChannel and pushes
+`count` packets through `send` (or `send_to_wait` with acks) for one
+ModemConfig preset, with and without the crypto hook, using the inline or
+(--deferred) the deferred interrupt handler, optionally with the register
+shadow (--shadow).  With --queue N the sender has an N frame transmit
+queue and cases without acks go through `enqueue`.  Reported per case:
+
+    pps               packets per second through the sender
+    tx_spi, rx_spi    SPI transactions per packet on the sender / receiver
+    tx_alloc          bytes allocated assembling and loading one frame (LoRa._load, tracemalloc peak)
+    isr_us            interrupt handler duration, both radios
+    ack_rtt_ms        `send_to_wait` round trip, acks cases only
+    delivered         fraction of packets passed to the receiver's on_recv
+
+The stream suite moves `count` payloads of `size` bytes between the same
+pair, once with stop-and-wait `send_to_wait` and once through a
+ulora_stream.Stream with --window frames in flight, over a link that loses
+--loss of its frames:
+
+    goodput           payload bytes acknowledged per second
+    frames            frames the sender put on air
+    retransmits       of those, repeats
+    delivered         fraction of payloads the receiver got (in order for the stream)
+
+The csma suite has --nodes senders share the channel to one receiver, each
+pushing `count` packets through `send_to_wait` as fast as acks allow, once
+without listen before talk and once with CAD and exponential backoff:
+
+    pps               packets delivered per second, all nodes together
+    collisions        frames lost to overlapping transmissions (simulator count)
+    cad_busy, cad_idle  CADs that found the channel busy / clear, all nodes
+    cad_failures      sends given up because the channel stayed busy
+    ack_timeouts      send_to_wait attempts that got no ack
+    delivered         fraction of packets that reached the receiver
+
+The header suite sends `count` frames of `size` bytes with RadioHead's 4
+byte header, the compact 2 byte one, the implicit LoRa header
+(fixed_length) and both, per preset:
+
+    airtime_ms        time on air of one frame
+    pps               packets per second through the sender
+    delivered         fraction of frames the receiver got intact
+
+The mesh suite sends `count` messages of `size` bytes across a chain of
+--hops + 1 ulora_mesh nodes, each in range of its neighbours only, one
+at a time from the first node to the last.  The first one waits for route
+discovery, the rest take the cached route:
+
+    latency_ms        send() on the first node to on_recv on the last (p50 / max)
+    first_ms          the same for the first message, discovery included
+    hit_rate          route cache lookups that found a route, all nodes
+    forward_us        receiving a frame to starting to relay it, relays only (p50 bucket bound / max)
+    discoveries       route requests started
+    delivered         fraction of messages the last node got
+
+The import suite starts a fresh interpreter per sample (--interpreter, e.g.
+the MicroPython unix port) and reports, per module:
+
+    import_ms         wall time of the import statement (median)
+    heap              bytes allocated by it (tracemalloc, gc.mem_alloc on MicroPython)
+    globals           names left in the module namespace
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import ulora
+from ulora_mesh import Mesh
+from ulora_sim import Scheduler, VirtualChannel, time_on_air
+from ulora_stream import Stream
+
+PRESETS = ("Bw125Cr45Sf128", "Bw500Cr45Sf128", "Bw31_25Cr48Sf512", "Bw125Cr48Sf4096", "Bw125Cr45Sf2048", "Lorawan")
+
+SENDER = 1
+RECEIVER = 2
+
+
+class XorCipher(object):
+    # stands in for cryptolib / ucrypto AES, which have no CPython build; same contract (whole 16 byte
+    # blocks in, same length out, into `out` if given) so the driver does the same work
+    def __init__(self, key=b"0123456789abcdef"):
+        self.key = key
+
+    def encrypt(self, data, out=None):
+        assert len(data) % 16 == 0
+        if out is None:
+            return bytes(b ^ self.key[i & 15] for i, b in enumerate(data))
+        for i in range(len(data)):
+            out[i] = data[i] ^ self.key[i & 15]
+
+    decrypt = encrypt
+
+
+def summary(values, scale=1.0):
+    if not values:
+        return None
+    values = sorted(v * scale for v in values)
+    n = len(values)
+    return {
+        "n": n,
+        "mean": round(sum(values) / n, 3),
+        "p50": round(values[n // 2], 3),
+        "p99": round(values[min(n - 1, (n * 99) // 100)], 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def make_pair(channel, **kwargs):
+    receiver = ulora.LoRa(None, None, RECEIVER, None, transport=channel.radio("receiver"), **kwargs)
+    sender = ulora.LoRa(None, None, SENDER, None, transport=channel.radio("sender"), **kwargs)
+    if kwargs.get("deferred"):
+        receiver.schedule = Scheduler().schedule
+        sender.schedule = Scheduler().schedule
+    return sender, receiver
+
+
+def run_case(preset, crypto=False, acks=False, count=10, size=16, time_scale=1.0, deferred=False, shadow=False,
+             queue=0):
+    channel = VirtualChannel(time_scale=time_scale, seed=1)
+    options = dict(freq=902.3, modem_config=getattr(ulora.ModemConfig, preset), acks=acks, deferred=deferred,
+                   shadow=shadow, tx_queue=queue)
+    sender, receiver = make_pair(channel, crypto=XorCipher() if crypto else None, **options)
+
+    received = []
+    receiver.on_recv = received.append
+    receiver.set_mode_rx()
+
+    data = bytes(range(size))
+    allocs = []
+    tracemalloc.start()
+    for _ in range(count):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        sender._load(data, RECEIVER, 0, 0)
+        allocs.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    tx_chip, rx_chip = sender._transport, receiver._transport
+    tx_spi, rx_spi = tx_chip.spi_transactions, rx_chip.spi_transactions
+    del tx_chip.isr_times[:]
+    del rx_chip.isr_times[:]
+
+    rtts = []
+    start = time.perf_counter()
+    for _ in range(count):
+        if acks:
+            t = time.perf_counter()
+            if sender.send_to_wait(data, RECEIVER):
+                rtts.append(time.perf_counter() - t)
+        elif queue:
+            while sender.tx_pending == queue:
+                pass
+            sender.enqueue(data, RECEIVER)
+        else:
+            sender.send(data, RECEIVER)
+    sender.wait_packet_sent()
+    elapsed = time.perf_counter() - start
+
+    # let the last frame land before reading the counters
+    time.sleep(time_on_air(tx_chip.regs, size + 4) * time_scale + 0.05)
+    result = {
+        "preset": preset,
+        "crypto": crypto,
+        "acks": acks,
+        "deferred": deferred,
+        "shadow": shadow,
+        "queue": queue,
+        "count": count,
+        "size": size,
+        "time_scale": time_scale,
+        "pps": round(count / elapsed, 2),
+        "tx_spi": round((tx_chip.spi_transactions - tx_spi) / count, 2),
+        "rx_spi": round((rx_chip.spi_transactions - rx_spi) / count, 2),
+        "tx_alloc": round(sum(allocs) / len(allocs)),
+        "isr_us": summary(tx_chip.isr_times + rx_chip.isr_times, 1e6),
+        "ack_rtt_ms": summary(rtts, 1e3),
+        "delivered": round(len(received) / count, 3),
+        "rx_overflows": receiver.rx_overflows,
+    }
+    channel.close()
+    return result
+
+
+def run_link(count=10, size=16, time_scale=1.0, presets=PRESETS, deferred=False, shadow=False, queue=0):
+    results = []
+    for preset in presets:
+        for crypto in (False, True):
+            for acks in (False, True):
+                result = run_case(preset, crypto, acks, count, size, time_scale, deferred, shadow, queue)
+                results.append(result)
+                print_row(result)
+    return results
+
+
+def run_transfer(preset, mode, count=10, size=16, time_scale=1.0, window=8, loss=0.0):
+    channel = VirtualChannel(time_scale=time_scale, seed=1)
+    options = dict(freq=902.3, modem_config=getattr(ulora.ModemConfig, preset), acks=mode == "stop-and-wait")
+    sender, receiver = make_pair(channel, **options)
+    channel.set_link(sender._transport, receiver._transport, loss=loss)
+
+    received = []
+    payloads = [bytes((i & 0xff,)) * size for i in range(count)]
+    start = time.perf_counter()
+    if mode == "stop-and-wait":
+        receiver.on_recv = lambda payload: received.append(payload.message)
+        receiver.set_mode_rx()
+        acked = 0
+        for data in payloads:
+            if sender.send_to_wait(data, RECEIVER):
+                acked += len(data)
+        frames = sender._transport.tx_frames
+        in_order = received == payloads
+    else:
+        stream, peer = Stream(sender, RECEIVER, window), Stream(receiver, SENDER, window)
+        peer.on_recv = received.append
+        receiver.set_mode_rx()
+        for data in payloads:
+            stream.send(data)
+        stream.flush()
+        acked = stream.bytes_acked
+        frames = sender._transport.tx_frames
+        in_order = received == payloads
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "preset": preset,
+        "mode": mode,
+        "window": window if mode == "stream" else 1,
+        "loss": loss,
+        "count": count,
+        "size": size,
+        "goodput": round(acked / elapsed, 1),
+        "frames": frames,
+        "retransmits": max(frames - count, 0),
+        "delivered": round(len(received) / count, 3),
+        "in_order": in_order,
+    }
+    channel.close()
+    return result
+
+
+def run_stream(count=10, size=16, time_scale=1.0, presets=PRESETS, window=8, loss=0.0):
+    results = []
+    for preset in presets:
+        for mode in ("stop-and-wait", "stream"):
+            r = run_transfer(preset, mode, count, size, time_scale, window, loss)
+            results.append(r)
+            sys.stderr.write("%-17s %-13s window=%2d loss=%.2f goodput=%8.1f B/s frames=%4d retransmits=%4d delivered=%.2f\n" % (
+                r["preset"], r["mode"], r["window"], r["loss"], r["goodput"], r["frames"], r["retransmits"],
+                r["delivered"]))
+    return results
+
+
+def run_contention(preset, lbt, nodes=10, count=10, size=16, time_scale=1.0):
+    channel = VirtualChannel(time_scale=time_scale, seed=1)
+    options = dict(freq=902.3, modem_config=getattr(ulora.ModemConfig, preset), acks=True)
+    receiver = ulora.LoRa(None, None, RECEIVER, None, transport=channel.radio("receiver"), **options)
+    senders = [ulora.LoRa(None, None, 10 + i, None, transport=channel.radio("node%d" % i), **options)
+               for i in range(nodes)]
+    received = []
+    receiver.on_recv = received.append
+    receiver.set_mode_rx()
+    data = bytes(range(size))
+    for sender in senders:
+        if lbt:
+            # long enough for every other node to get a frame out, twice
+            sender.cad_timeout = 2 * nodes * sender.time_on_air(size) * time_scale
+        sender.set_mode_rx()
+
+    def run(sender):
+        for _ in range(count):
+            sender.send_to_wait(data, RECEIVER)
+
+    threads = [threading.Thread(target=run, args=(sender,)) for sender in senders]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "preset": preset,
+        "lbt": lbt,
+        "nodes": nodes,
+        "count": count,
+        "size": size,
+        "pps": round(len(received) / elapsed, 2),
+        "collisions": channel.collisions,
+        "cad_busy": sum(sender.cad_busy for sender in senders),
+        "cad_idle": sum(sender.cad_idle for sender in senders),
+        "cad_failures": sum(sender.cad_failures for sender in senders),
+        "ack_timeouts": sum(sender.ack_timeouts for sender in senders),
+        "delivered": round(len(received) / (nodes * count), 3),
+    }
+    channel.close()
+    return result
+
+
+def run_csma(count=10, size=16, time_scale=1.0, presets=PRESETS[:1], nodes=10):
+    results = []
+    for preset in presets:
+        for lbt in (False, True):
+            r = run_contention(preset, lbt, nodes, count, size, time_scale)
+            results.append(r)
+            sys.stderr.write("%-17s lbt=%-5s nodes=%3d pps=%7.2f collisions=%5d cad_busy=%5d cad_idle=%5d cad_failures=%4d ack_timeouts=%5d delivered=%.2f\n" % (
+                r["preset"], r["lbt"], r["nodes"], r["pps"], r["collisions"], r["cad_busy"], r["cad_idle"],
+                r["cad_failures"], r["ack_timeouts"], r["delivered"]))
+    return results
+
+
+HEADER_MODES = (
+    ("explicit", {}),
+    ("compact", {"compact": True}),
+    ("implicit", {"fixed": True}),
+    ("implicit+compact", {"compact": True, "fixed": True}),
+)
+
+
+def run_header_case(preset, mode, options, count=10, size=16, time_scale=1.0):
+    channel = VirtualChannel(time_scale=time_scale, seed=1)
+    compact = options.get("compact", False)
+    fixed_length = (2 if compact else 4) + size if options.get("fixed") else 0
+    sender, receiver = make_pair(channel, freq=902.3, modem_config=getattr(ulora.ModemConfig, preset),
+                                 compact=compact, fixed_length=fixed_length)
+    received = []
+    receiver.on_recv = received.append
+    receiver.set_mode_rx()
+    data = bytes(range(size))
+
+    start = time.perf_counter()
+    for _ in range(count):
+        sender.send(data, RECEIVER)
+    sender.wait_packet_sent()
+    elapsed = time.perf_counter() - start
+    time.sleep(sender.time_on_air(size) * time_scale + 0.05)
+
+    result = {
+        "preset": preset,
+        "mode": mode,
+        "count": count,
+        "size": size,
+        "airtime_ms": round(sender.time_on_air(size) * 1e3, 2),
+        "pps": round(count / elapsed, 2),
+        "delivered": round(sum(1 for p in received if p.message == data) / count, 3),
+    }
+    channel.close()
+    return result
+
+
+def run_header(count=10, size=16, time_scale=1.0, presets=PRESETS):
+    results = []
+    for preset in presets:
+        for mode, options in HEADER_MODES:
+            r = run_header_case(preset, mode, options, count, size, time_scale)
+            results.append(r)
+            sys.stderr.write("%-17s %-16s airtime_ms=%8.2f pps=%7.2f delivered=%.2f\n" % (
+                r["preset"], r["mode"], r["airtime_ms"], r["pps"], r["delivered"]))
+    return results
+
+
+def histogram_p50(snapshot):
+    # upper bound of the bucket holding the median of a ulora.Histogram snapshot
+    half = (snapshot["count"] + 1) // 2
+    seen = 0
+    for i, n in enumerate(snapshot["buckets"]):
+        seen += n
+        if n and seen >= half:
+            return min((1 << i) - 1, snapshot["max"])
+    return 0
+
+
+def run_mesh_case(preset, hops=3, count=10, size=16, time_scale=1.0):
+    channel = VirtualChannel(time_scale=time_scale, seed=1)
+    options = dict(freq=902.3, modem_config=getattr(ulora.ModemConfig, preset), acks=True, receive_all=True)
+    radios = [channel.radio("node%d" % i) for i in range(hops + 1)]
+    for i in range(hops + 1):
+        for j in range(i + 2, hops + 1):
+            channel.set_link(radios[i], radios[j], loss=1.0)
+    nodes = [ulora.LoRa(None, None, i + 1, None, transport=radios[i], **options) for i in range(hops + 1)]
+    meshes = [Mesh(node) for node in nodes]
+    received = []
+    nodes[-1].on_recv = lambda payload: received.append(time.perf_counter())
+    for node in nodes:
+        node.cad_timeout = 4 * node.time_on_air(size) * time_scale
+        node.set_mode_rx()
+    running = [True]
+
+    def run(mesh):
+        while running[0]:
+            if not mesh.service():
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=run, args=(mesh,)) for mesh in meshes]
+    for thread in threads:
+        thread.start()
+    data = bytes(range(size))
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        meshes[0].send(data, nodes[-1].address)
+        deadline = start + meshes[0]._timeout() * time_scale + 1.0
+        while len(received) <= len(latencies) and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        if len(received) > len(latencies):
+            latencies.append(received[len(latencies)] - start)
+    running[0] = False
+    for thread in threads:
+        thread.join()
+
+    stats = [mesh.stats() for mesh in meshes]
+    hits = sum(s["route_hits"] for s in stats)
+    lookups = hits + sum(s["route_misses"] for s in stats)
+    forward = {"count": 0, "max": 0, "buckets": [0] * len(meshes[0].forward_us.buckets)}
+    for s in stats:
+        if "forward_us" in s:
+            forward["count"] += s["forward_us"]["count"]
+            forward["max"] = max(forward["max"], s["forward_us"]["max"])
+            forward["buckets"] = [a + b for a, b in zip(forward["buckets"], s["forward_us"]["buckets"])]
+    result = {
+        "preset": preset,
+        "hops": hops,
+        "count": count,
+        "size": size,
+        "latency_ms": summary(latencies[1:], 1e3),
+        "first_ms": round(latencies[0] * 1e3, 2) if latencies else None,
+        "hit_rate": round(hits / lookups, 3) if lookups else None,
+        "forward_us": dict(forward, p50=histogram_p50(forward)),
+        "discoveries": sum(s["discoveries"] for s in stats),
+        "delivered": round(len(received) / count, 3),
+    }
+    for mesh in meshes:
+        mesh.close()
+    channel.close()
+    return result
+
+
+def run_mesh(count=10, size=16, time_scale=1.0, presets=PRESETS[:1], hops=3):
+    results = []
+    for preset in presets:
+        r = run_mesh_case(preset, hops, count, size, time_scale)
+        results.append(r)
+        latency = r["latency_ms"]
+        sys.stderr.write("%-17s hops=%2d latency_ms(p50/max)=%s first_ms=%s hit_rate=%s forward_us(p50/max)=%d/%d discoveries=%3d delivered=%.2f\n" % (
+            r["preset"], r["hops"], "%.1f/%.1f" % (latency["p50"], latency["max"]) if latency else "-",
+            "%.1f" % r["first_ms"] if r["first_ms"] is not None else "-",
+            "%.2f" % r["hit_rate"] if r["hit_rate"] is not None else "-", r["forward_us"]["p50"],
+            r["forward_us"]["max"], r["discoveries"], r["delivered"]))
+    return results
+
+
+IMPORT_MODULES = ("ulora", "ulora_async", "ulora_regs")
+
+# runs in a fresh interpreter, CPython or MicroPython
+IMPORT_PROBE = """
+import gc, sys, time
+sys.path.insert(0, %r)
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+clock = getattr(time, "perf_counter", None) or (lambda: time.ticks_us() / 1e6)
+gc.collect()
+if tracemalloc:
+    tracemalloc.start()
+else:
+    base = gc.mem_alloc()
+t = clock()
+module = __import__(%r)
+t = clock() - t
+heap = tracemalloc.get_traced_memory()[0] if tracemalloc else gc.mem_alloc() - base
+print(t, heap, len(dir(module)))
+"""
+
+
+def run_import(count=10, interpreter=sys.executable, modules=IMPORT_MODULES):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for name in modules:
+        times, heaps = [], []
+        for _ in range(count):
+            out = subprocess.check_output([interpreter, "-c", IMPORT_PROBE % (here, name)]).split()
+            times.append(float(out[0]))
+            heaps.append(int(out[1]))
+        result = {
+            "module": name,
+            "interpreter": os.path.basename(interpreter),
+            "count": count,
+            "import_ms": summary(times, 1e3),
+            "heap": min(heaps),
+            "globals": int(out[2]),
+        }
+        results.append(result)
+        sys.stderr.write("%-17s import_ms(p50)=%7.2f heap=%7d globals=%4d\n" % (
+            name, result["import_ms"]["p50"], result["heap"], result["globals"]))
+    return results
+
+
+def print_row(r):
+    isr = r["isr_us"]
+    rtt = r["ack_rtt_ms"]
+    sys.stderr.write("%-17s crypto=%-5s acks=%-5s pps=%8.2f tx_spi=%5.1f rx_spi=%5.1f alloc=%6s isr_us(p50/max)=%s rtt_ms=%s delivered=%.2f" % (
+        r["preset"], r["crypto"], r["acks"], r["pps"], r["tx_spi"], r["rx_spi"], r["tx_alloc"],
+        "%.0f/%.0f" % (isr["p50"], isr["max"]) if isr else "-",
+        "%.1f" % rtt["p50"] if rtt else "-", r["delivered"]) + "\n")
+
+
+SUITES = {
+    "link": run_link,
+    "stream": run_stream,
+    "csma": run_csma,
+    "header": run_header,
+    "mesh": run_mesh,
+    "import": run_import,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="suites to run, default all")
+    parser.add_argument("--count", type=int, default=10, help="packets per case")
+    parser.add_argument("--size", type=int, default=16, help="payload bytes")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="simulated air time multiplier, below 1 runs faster but shortens rx turnaround windows")
+    parser.add_argument("--preset", action="append", choices=PRESETS, help="ModemConfig presets, default all")
+    parser.add_argument("--deferred", action="store_true", help="use the deferred interrupt handler")
+    parser.add_argument("--shadow", action="store_true", help="enable the register shadow")
+    parser.add_argument("--queue", type=int, default=0, help="transmit queue depth, 0 sends synchronously")
+    parser.add_argument("--window", type=int, default=8, help="stream suite window")
+    parser.add_argument("--nodes", type=int, default=10, help="csma suite senders")
+    parser.add_argument("--hops", type=int, default=3, help="mesh suite chain length")
+    parser.add_argument("--loss", type=float, default=0.0, help="stream suite frame loss on the link")
+    parser.add_argument("--interpreter", default=sys.executable, help="python for the import suite")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    report = {"python": sys.version.split()[0], "suites": {}}
+    for name in args.suite or sorted(SUITES):
+        kwargs = dict(count=args.count)
+        if name == "import":
+            kwargs["interpreter"] = args.interpreter
+        if name == "stream":
+            kwargs.update(size=args.size, time_scale=args.time_scale, presets=args.preset or PRESETS,
+                          window=args.window, loss=args.loss)
+        if name == "header":
+            kwargs.update(size=args.size, time_scale=args.time_scale, presets=args.preset or PRESETS)
+        if name == "csma":
+            kwargs.update(size=args.size, time_scale=args.time_scale, presets=args.preset or PRESETS[:1],
+                          nodes=args.nodes)
+        if name == "mesh":
+            kwargs.update(size=args.size, time_scale=args.time_scale, presets=args.preset or PRESETS[:1],
+                          hops=args.hops)
+        if name == "link":
+            kwargs.update(size=args.size, time_scale=args.time_scale)
+            kwargs["presets"] = args.preset or PRESETS
+            kwargs["deferred"] = args.deferred
+            kwargs["shadow"] = args.shadow
+            kwargs["queue"] = args.queue
+        report["suites"][name] = SUITES[name](**kwargs)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=1)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Packet capture: every frame a LoRa receives or sends, logged to a compact binary file.
+
+    log = open("capture.bin", "wb")
+    capture = Capture(lora, log)      # from now on every frame is recorded
+    while True:
+        ...
+        capture.flush()               # from the main loop, writes what was recorded
+    capture.close()
+
+    # on the host
+    for r in records("capture.bin"):
+        print(r.time_us, r.direction, r.header_from, r.rssi, r.frame)
+
+    python ulora_capture.py capture.bin                 # the same, as a table
+    python ulora_capture.py capture.bin --replay 2      # through a LoRa with address 2, in ulora_sim
+
+record() runs wherever the driver sees a frame, the interrupt handlers
+included: it copies the frame into a ring of `size` preallocated bytes and
+nothing else (no allocation, no file access), and counts a frame that
+doesn't fit in `dropped`.  flush() writes the ring out.  Received frames
+are recorded raw, before address filtering and decryption, sent ones as
+loaded into the FIFO, retransmissions and acks included.
+
+The file starts with MAGIC, a version byte and a flags byte (FILE_COMPACT
+when the LoRa used the compact header), then one record per frame:
+
+    length      1 byte, of the frame
+    direction   1 byte, CAPTURE_RX or CAPTURE_TX
+    delta_us    4 bytes little endian, signed, microseconds since the record before (since Capture() for the first)
+    rssi        2 bytes little endian, signed, quarter dBm (0 when sent)
+    snr         1 byte, signed, quarter dB (0 when sent)
+    frame       `length` bytes, header included
+
+Times are MicroPython ticks, so a gap of more than about 9 minutes between
+two frames comes out short.  A frame received with deferred=True is stamped
+when the interrupt latched it, not when service() got to it, so a frame
+sent in between is recorded first with a later time and the delta after it
+is negative: records are in the order the driver saw them, time_us is when
+they were on the air.  records() reads the file a chunk at a time,
+so captures of any size iterate in constant memory; replay() feeds the
+received frames back into a LoRa's receive path (addressing, acks,
+handlers, on_recv) as fast as it takes them, or at the recorded pace.
+"""
+import time
+
+from ulora import CAPTURE_RX, CAPTURE_TX, ticks_us, ticks_diff
+
+try:
+    from ucollections import namedtuple
+except ImportError:
+    from collections import namedtuple
+
+MAGIC = b"uLcp"
+VERSION = 2  # 1 had unsigned deltas, still read
+FILE_COMPACT = 0x01
+FILE_HEADER = 6
+RECORD_HEADER = 9
+
+Record = namedtuple(
+    "Record",
+    ['time_us', 'direction', 'frame', 'header_to', 'header_from', 'header_id', 'header_flags', 'rssi', 'snr']
+)
+
+
+class Capture(object):
+    def __init__(self, lora, stream, size=4096):
+        """
+        Capture(lora, stream, size=4096)
+        lora: the LoRa instance whose frames are recorded
+        stream: where flush() writes, e.g. a file opened "wb"; the file header is written at once
+        size: bytes of the ring between record() and flush(), each frame takes 9 more than its length
+        """
+        self.lora = lora
+        self.stream = stream
+        self.dropped = 0  # frames that didn't fit in the ring
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._head = 0
+        self._tail = 0
+        self._used = 0
+        self._record = bytearray(RECORD_HEADER)
+        self._last = ticks_us()
+
+        stream.write(MAGIC + bytes((VERSION, FILE_COMPACT if lora.compact else 0)))
+        lora.capture = self
+
+    def record(self, direction, frame, length, rssi=0, snr=0, ticks=None):
+        # called by the driver, interrupt handlers included: one record into the ring, False if it didn't fit.
+        # ticks: ticks_us() of when the frame came in if not now
+        lora = self.lora
+        state = lora.disable_irq()
+        try:
+            buf = self._buf
+            size = len(buf)
+            if size - self._used < RECORD_HEADER + length:
+                self.dropped += 1
+                return False
+            now = ticks_us() if ticks is None else ticks
+            delta = ticks_diff(now, self._last)
+            self._last = now
+            rssi = int(rssi * 4) & 0xffff
+            header = self._record
+            header[0] = length
+            header[1] = direction
+            header[2] = delta & 0xff
+            header[3] = (delta >> 8) & 0xff
+            header[4] = (delta >> 16) & 0xff
+            header[5] = (delta >> 24) & 0xff
+            header[6] = rssi & 0xff
+            header[7] = rssi >> 8
+            header[8] = int(snr * 4) & 0xff
+            # byte by byte: a slice would allocate, which a hard interrupt handler can't
+            pos = self._head
+            for i in range(RECORD_HEADER):
+                buf[pos] = header[i]
+                pos += 1
+                if pos == size:
+                    pos = 0
+            for i in range(length):
+                buf[pos] = frame[i]
+                pos += 1
+                if pos == size:
+                    pos = 0
+            self._head = pos
+            self._used += RECORD_HEADER + length
+            return True
+        finally:
+            lora.enable_irq(state)
+
+    @property
+    def pending(self):
+        # bytes recorded and not yet flushed
+        return self._used
+
+    def flush(self):
+        # write the recorded frames to the stream, from the main loop; returns the number of bytes written
+        lora = self.lora
+        state = lora.disable_irq()
+        used = self._used
+        tail = self._tail
+        lora.enable_irq(state)
+        if not used:
+            return 0
+        size = len(self._buf)
+        end = tail + used
+        if end <= size:
+            self.stream.write(self._view[tail:end])
+        else:
+            self.stream.write(self._view[tail:])
+            self.stream.write(self._view[:end - size])
+        # record() only ever adds, so what was read is still there to be freed
+        state = lora.disable_irq()
+        self._tail = end % size
+        self._used -= used
+        lora.enable_irq(state)
+        return used
+
+    def close(self):
+        # stop recording and flush; the stream stays open
+        if self.lora.capture is self:
+            self.lora.capture = None
+        self.flush()
+        if hasattr(self.stream, "flush"):
+            self.stream.flush()
+
+
+def records(source, chunk=65536):
+    """
+    records(source, chunk=65536)
+    Iterate over the Records of a capture, time_us counted from the start of it.
+    source: file name or binary stream positioned at the file header
+    chunk: bytes read at a time
+    """
+    import struct
+
+    if isinstance(source, str):
+        with open(source, "rb") as stream:
+            for record in records(stream, chunk):
+                yield record
+        return
+
+    head = source.read(FILE_HEADER)
+    if len(head) < FILE_HEADER or head[:4] != MAGIC:
+        raise ValueError("not a ulora capture")
+    if head[4] not in (1, VERSION):
+        raise ValueError("capture version %d not supported" % head[4])
+    compact = head[5] & FILE_COMPACT
+    header_len = 2 if compact else 4
+    unpack = struct.Struct("<BBIhb" if head[4] == 1 else "<BBihb").unpack_from
+
+    elapsed = 0
+    data = b""
+    pos = 0
+    while True:
+        block = source.read(chunk)
+        if not block:
+            if pos < len(data):
+                raise ValueError("capture truncated")
+            return
+        data = data[pos:] + block
+        pos = 0
+        end = len(data)
+        while pos + RECORD_HEADER <= end:
+            length, direction, delta, rssi, snr = unpack(data, pos)
+            start = pos + RECORD_HEADER
+            if start + length > end:
+                break
+            frame = data[start:start + length]
+            pos = start + length
+            elapsed += delta
+            if length < header_len:
+                fields = (None, None, None, None)
+            elif compact:
+                to = frame[0] >> 4
+                fields = (255 if to == 0x0f else to, frame[0] & 0x0f, frame[1] & 0x0f, frame[1] & 0xf0)
+            else:
+                fields = (frame[0], frame[1], frame[2], frame[3])
+            yield Record(elapsed, direction, frame, fields[0], fields[1], fields[2], fields[3], rssi / 4, snr / 4)
+
+
+def replay(lora, source, time_scale=0):
+    """
+    replay(lora, source, time_scale=0)
+    Feed the received frames of a capture into lora's receive path, as if they had just come in.
+    Returns {"frames", "elapsed", "pps"}.
+    lora: the LoRa instance to receive them, e.g. on a ulora_sim radio
+    source: file name or stream, see records()
+    time_scale: 0 replays as fast as the driver takes them, 1 at the recorded pace, 0.5 twice as fast
+    """
+    frames = 0
+    start = time.perf_counter()
+    for record in records(source):
+        if record.direction != CAPTURE_RX:
+            continue
+        if time_scale:
+            wait = start + record.time_us * time_scale / 1e6 - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        lora.inject(record.frame, record.snr, record.rssi)
+        frames += 1
+    elapsed = time.perf_counter() - start
+    return {"frames": frames, "elapsed": round(elapsed, 3), "pps": round(frames / elapsed, 2) if elapsed else None}
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--limit", type=int, default=0, help="print at most this many records, 0 for all")
+    parser.add_argument("--replay", type=int, metavar="ADDRESS",
+                        help="replay the received frames through a LoRa with this address, in ulora_sim")
+    parser.add_argument("--time-scale", type=float, default=0, help="replay pace, see replay()")
+    parser.add_argument("--compact", action="store_true", help="replay LoRa uses the compact header")
+    args = parser.parse_args(argv)
+
+    if args.replay is not None:
+        import ulora
+        from ulora_sim import VirtualChannel
+
+        channel = VirtualChannel()
+        lora = ulora.LoRa(None, None, args.replay, None, transport=channel.radio("replay"), freq=902.3,
+                          compact=args.compact)
+        received = []
+        lora.on_recv = received.append
+        lora.set_mode_rx()
+        result = replay(lora, args.capture, args.time_scale)
+        result["delivered"] = len(received)
+        result.update(lora.stats())
+        channel.close()
+        sys.stdout.write("%s\n" % result)
+        return result
+
+    direction = {CAPTURE_RX: "rx", CAPTURE_TX: "tx"}
+    for n, r in enumerate(records(args.capture)):
+        if args.limit and n >= args.limit:
+            break
+        sys.stdout.write("%12.6f %s to=%-3s from=%-3s id=%-3s flags=0x%02x rssi=%7.2f snr=%6.2f len=%3d %s\n" % (
+            r.time_us / 1e6, direction.get(r.direction, "?"), r.header_to, r.header_from, r.header_id,
+            r.header_flags or 0, r.rssi, r.snr, len(r.frame), r.frame.hex()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Channel plans: frequency hopping within a frame and a channel per exchange on a link.
+
+    plan = ChannelPlan.uniform(902.3, 0.2, 8, seed=7)   # 902.3, 902.5 ... 903.7 MHz, hopped in a shuffled order
+    lora = LoRa(SPIConfig.rp2_0, 28, 1, 5, reset_pin=27, freq=plan.freqs[0], acks=True,
+                transport=MachineTransport(SPIConfig.rp2_0, 28, 5, 27, hop_pin=26))
+    lora.set_hopping(plan, hop_period(lora.modem_config, 0.1))   # 100 ms per channel
+
+    link = Rotation(lora, plan, SERVER_ADDRESS)         # and on the server, Rotation(lora, plan, CLIENT_ADDRESS)
+    link.send_to_wait(b"reading")                       # each exchange on the next channel of the plan
+
+Hopping uses the chip's FHSS support: with RegHopPeriod set the modem
+raises FhssChangeChannel on DIO2 every hop period, on the transmitter and
+on the receiver locked on to the frame alike, and LoRa.set_hopping's
+handler writes the next of the plan's precomputed Frf triplets (one
+three byte burst, no arithmetic in the interrupt).  Every frame starts on
+the radio's configured frequency and the driver goes back to it on TxDone
+and RxDone.  DIO2 has to be wired, see hop_pin in ulora_hal.
+
+Rotation moves a point to point link to the next channel of the plan after
+every exchange.  The receiver moves when it acks a first transmission
+(retransmissions don't move it) and its ack carries the channel index it
+is moving to, which the sender takes over.  When an ack is lost the ends
+can be one channel apart, either way round, so a sender left without an
+ack tries the same frame on the channel after and then the one before.
+Rotation takes the LoRa's ack_payload and acked hooks.
+A radio listens on one channel at a time, so a node talking to several
+peers keeps one Rotation, or gives each radio of a ulora_multi.MultiRadio
+its own.  Both ends need acks=True.
+"""
+from ulora import FLAGS_RETRY, FREQ_MIN, FREQ_MAX, frf, symbol_time
+
+
+def hop_period(modem_config, dwell):
+    # hop period in symbols that keeps each channel under `dwell` seconds, for set_hopping
+    return max(1, min(0xff, int(dwell / symbol_time(modem_config))))
+
+
+class ChannelPlan(object):
+    def __init__(self, freqs, seed=0):
+        """
+        ChannelPlan(freqs, seed=0)
+        freqs: channel frequencies in MHz; give the radio one of them as freq
+        seed: 0 keeps freqs in order, anything else shuffles them the same way on every node and port
+        """
+        for freq in freqs:
+            if not FREQ_MIN <= freq <= FREQ_MAX:
+                raise ValueError("freq out of range")
+        if not freqs:
+            raise ValueError("no channels")
+        self.freqs = tuple(freqs)
+        self.order = _shuffle(len(self.freqs), seed)
+        # RegFrf triplets: per channel, and in hop / rotation order
+        self.frf = [frf(freq) for freq in self.freqs]
+        self.hops = [self.frf[i] for i in self.order]
+
+    @classmethod
+    def uniform(cls, first, spacing, count, seed=0):
+        # count channels spacing MHz apart from first, e.g. the 64 US915 uplinks: uniform(902.3, 0.2, 64)
+        return cls([round(first + i * spacing, 4) for i in range(count)], seed)
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def freq(self, index):
+        # frequency of the index-th channel in plan order, wrapping around
+        return self.freqs[self.order[index % len(self.order)]]
+
+
+def _shuffle(count, seed):
+    # Fisher-Yates on an xorshift32, so every port gets the same order for a seed
+    order = list(range(count))
+    if not seed:
+        return order
+    x = seed & 0xffffffff or 1
+    for i in range(count - 1, 0, -1):
+        x ^= (x << 13) & 0xffffffff
+        x ^= x >> 17
+        x ^= (x << 5) & 0xffffffff
+        j = x % (i + 1)
+        order[i], order[j] = order[j], order[i]
+    return order
+
+
+class Rotation(object):
+    def __init__(self, lora, plan, peer):
+        """
+        Rotation(lora, plan, peer)
+        lora: the LoRa instance of this end, with acks=True
+        plan: ChannelPlan, the same on both ends
+        peer: address of the other end, frames from anyone else don't move the link
+        """
+        if len(plan) > 256:
+            raise ValueError("too many channels")
+        self.lora = lora
+        self.plan = plan
+        self.peer = peer
+        self.index = 0
+        self.fallbacks = 0  # exchanges that got their ack on a neighbouring channel
+        self._advance = False
+
+        if lora.ack_payload is not None or lora.acked is not None:
+            raise ValueError("lora already has ack hooks")
+        lora.ack_payload = self._ack_payload
+        lora.acked = self._acked
+        self._tune(0)
+
+    def close(self):
+        self.lora.ack_payload = None
+        self.lora.acked = None
+
+    def _tune(self, index):
+        self.index = index % len(self.plan)
+        self.lora.reconfigure(freq=self.plan.freq(self.index))
+
+    @property
+    def freq(self):
+        return self.plan.freq(self.index)
+
+    def _ack_payload(self, payload):
+        # LoRa.ack_payload: the channel index the link moves to, the next one after a first transmission
+        if payload.header_from != self.peer:
+            return None
+        self._advance = not payload.header_flags & FLAGS_RETRY
+        index = self.index + 1 if self._advance else self.index
+        return bytes((index % len(self.plan),))
+
+    def _acked(self, payload):
+        # LoRa.acked: move on once the ack is out
+        if payload.header_from == self.peer and self._advance:
+            self._advance = False
+            self._tune(self.index + 1)  # waits for the ack to go out first
+
+    def send_to_wait(self, data, header_flags=0, retries=3):
+        # LoRa.send_to_wait to the peer on the link's channel, then the neighbouring ones; True once acked
+        lora = self.lora
+        start = self.index
+        header_id = None
+        for offset in (0, 1, -1):
+            if offset:
+                # same frame, same header_id, in case the peer got it and moved on without us hearing the ack
+                self._tune(start + offset)
+                header_flags |= FLAGS_RETRY
+            if lora.send_to_wait(data, self.peer, header_flags, retries, header_id):
+                ack = lora.last_ack.message
+                if len(ack) == 1:
+                    self._tune(ack[0])
+                if offset:
+                    self.fallbacks += 1
+                return True
+            header_id = lora.last_header_id
+        self._tune(start)
+        return False
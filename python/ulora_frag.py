@@ -0,0 +1,180 @@
+"""
+Messages larger than one LoRa frame, split into fragments and put back together on the other end.
+
+    frag = Fragmenter(lora)
+    frag.send(firmware_chunk, SERVER_ADDRESS)   # up to 256 frames, each as full as the radio allows
+
+    # on the peer, whole messages arrive at lora.on_recv like any other
+    frag = Fragmenter(lora, max_size=8192, slots=2)
+    lora.on_recv = lambda payload: print(len(payload.message))
+    lora.set_mode_rx()
+
+Fragments keep the RadioHead header: header_id numbers the transfer and the
+kind bits of header_flags say KIND_FRAGMENT.  The data of each fragment
+starts with a 4 byte fragment header:
+
+    index, last index, total length (2 bytes, big endian)
+
+The message is split evenly, every fragment but the last carries
+ceil(total / count) bytes, so the receiver knows where each one goes
+without waiting for the first.  It copies them into one of `slots`
+buffers of `max_size` bytes allocated up front, so a flood of fragments
+can't run it out of memory; a transfer that is too large, or arrives
+while every slot is busy, is dropped.  A transfer that stops getting
+fragments for `timeout` seconds gives its slot up.
+
+Fragments are not acknowledged, a lost one loses the message.  Send
+through ulora_stream.Stream in max_payload sized pieces where every byte
+has to arrive.
+"""
+from ulora import KIND_FRAGMENT, FLAGS_KIND_MASK, MAX_PACKET_LEN, Payload, ticks_ms, ticks_diff
+
+HEADER_LEN = 4
+MAX_FRAGMENTS = 256
+
+
+class _Slot(object):
+    # one transfer being reassembled
+    def __init__(self, max_size):
+        self.buf = bytearray(max_size)
+        self.view = memoryview(self.buf)
+        self.seen = bytearray(MAX_FRAGMENTS >> 3)
+        self.key = None  # (header_from, header_id) while in use
+        self.total = 0
+        self.count = 0
+        self.missing = 0
+        self.heard = 0  # ticks_ms() of the last fragment
+
+
+class Fragmenter(object):
+    def __init__(self, lora, max_size=4096, slots=2, timeout=None):
+        """
+        Fragmenter(lora, max_size=4096, slots=2, timeout=None)
+        lora: the LoRa instance to send and receive through
+        max_size: largest message accepted from a peer, each slot preallocates this many bytes
+        slots: transfers reassembled at the same time
+        timeout: seconds without a fragment before a transfer is dropped, None derives it from the time on air
+        """
+        self.lora = lora
+        self.max_size = max_size
+        self.timeout = timeout
+        self._slots = [_Slot(max_size) for _ in range(slots)]
+        self._frame = bytearray(MAX_PACKET_LEN)
+        self._next_id = 0
+
+        self.fragments_sent = 0
+        self.completed = 0
+        self.expired = 0
+        self.dropped = 0  # fragments thrown away: malformed, oversized or no free slot
+
+        lora.handlers[KIND_FRAGMENT] = self._on_fragment
+
+    def close(self):
+        self.lora.handlers.pop(KIND_FRAGMENT, None)
+
+    def send(self, data, header_to, header_flags=0):
+        # send `data` as one transfer; False if the radio did not get every fragment out
+        if type(data) == str:
+            data = data.encode()
+        total = len(data)
+        chunk = self.lora.max_payload - HEADER_LEN
+        count = max(1, -(-total // chunk))
+        if count > MAX_FRAGMENTS or total > 0xffff:
+            raise ValueError("payload too long")
+        # same number of frames, but spread evenly so the receiver can place each one alone
+        chunk = -(-total // count)
+
+        self._next_id = (self._next_id + 1) & 0xff
+        flags = (header_flags & ~FLAGS_KIND_MASK) | KIND_FRAGMENT
+        frame = self._frame
+        view = memoryview(frame)
+        data = memoryview(data)
+        frame[1] = count - 1
+        frame[2] = total >> 8
+        frame[3] = total & 0xff
+
+        lora = self.lora
+        sent = True
+        for index in range(count):
+            start = index * chunk
+            end = min(start + chunk, total)
+            frame[0] = index
+            frame[HEADER_LEN:HEADER_LEN + end - start] = data[start:end]
+            sent = lora.send(view[:HEADER_LEN + end - start], header_to, self._next_id, flags) and sent
+            self.fragments_sent += 1
+        sent = lora.wait_packet_sent() and sent
+        lora.set_mode_rx()
+        return sent
+
+    def _timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        lora = self.lora
+        return 3 * lora.time_on_air(lora.max_payload) + lora.ack_turnaround
+
+    def expire(self):
+        # give up the slots of transfers that went quiet, also done as fragments arrive
+        now = ticks_ms()
+        timeout = int(self._timeout() * 1000) + 1
+        for slot in self._slots:
+            if slot.key is not None and ticks_diff(now, slot.heard) > timeout:
+                slot.key = None
+                self.expired += 1
+
+    def _claim(self, key, total, count):
+        # the slot reassembling `key`, a fresh one for a new transfer, or None
+        self.expire()
+        free = None
+        for slot in self._slots:
+            if slot.key == key:
+                if slot.total == total and slot.count == count:
+                    return slot
+                # the sender's transfer id wrapped onto one that never finished
+                slot.key = None
+                self.expired += 1
+            if slot.key is None and free is None:
+                free = slot
+        if free is not None:
+            free.key = key
+            free.total = total
+            free.count = count
+            free.missing = count
+            free.seen[:] = bytes(len(free.seen))
+        return free
+
+    def _on_fragment(self, payload):
+        # receive handler context
+        data = payload.message
+        if len(data) < HEADER_LEN:
+            self.dropped += 1
+            return
+        index = data[0]
+        count = data[1] + 1
+        total = (data[2] << 8) | data[3]
+        chunk = -(-total // count)
+        start = index * chunk
+        end = min(start + chunk, total)
+        if index >= count or total > self.max_size or len(data) - HEADER_LEN != end - start:
+            self.dropped += 1
+            return
+
+        slot = self._claim((payload.header_from, payload.header_id), total, count)
+        if slot is None:
+            self.dropped += 1
+            return
+        slot.heard = ticks_ms()
+
+        bit = 1 << (index & 7)
+        if slot.seen[index >> 3] & bit:
+            return
+        slot.seen[index >> 3] |= bit
+        slot.view[start:end] = memoryview(data)[HEADER_LEN:]
+        slot.missing -= 1
+        if slot.missing:
+            return
+
+        slot.key = None
+        self.completed += 1
+        self.lora.on_recv(Payload(bytes(slot.view[:total]), payload.header_to, payload.header_from,
+                                  payload.header_id, payload.header_flags & ~FLAGS_KIND_MASK, payload.rssi,
+                                  payload.snr))
@@ -0,0 +1,186 @@
+import time
+from machine import SPI
+from machine import Pin
+from machine import disable_irq, enable_irq
+
+# A transport is whatever sits between `LoRa` and the radio.  The driver only
+# ever calls the methods below, so anything implementing them (for example the
+# simulated chip in ulora_sim.py) can stand in for real hardware:
+#
+#   irq(handler, hard=False)  attach `handler` to the rising edge of DIO0, as a
+#                             hard interrupt if `hard` (handler must not allocate)
+#   hop_irq(handler, hard=False)  the same for DIO2 (FhssChangeChannel), None detaches;
+#                             only needed for LoRa.set_hopping()
+#   reset()                   hardware reset of the transceiver, if wired
+#   write(register, data)     one SPI transaction writing `data` from `register`
+#   readinto(register, buf)   one SPI transaction filling `buf` from `register`
+#   read(register, length)    as readinto, returning a new bytes object
+#   write_reg(register, value)  single register write
+#   read_reg(register)        single register read, returns an int
+#   disable_irq() / enable_irq(state)  hold off (and restore) the interrupt handler around a
+#                             critical section shared with it
+#   deinit()                  release the bus
+#
+# and counts its traffic in spi_transactions / spi_bytes (address byte included).
+#
+# Several transceivers can share one SPI bus, each with its own chip select and
+# DIO0, through SharedBus.transport().  Every transaction already runs with
+# interrupts disabled, so no radio's handler can cut into another's transfer.
+
+
+class SPIConfig():
+    # spi pin defs for various boards (channel, sck, mosi, miso)
+    rp2_0 = (0, 6, 7, 4)
+    rp2_1 = (1, 10, 11, 8)
+    esp8286_1 = (1, 14, 13, 12)
+    esp32_1 = (1, 14, 13, 12)
+    esp32_2 = (2, 18, 23, 19)
+
+
+class SharedBus(object):
+    def __init__(self, spi_channel, baudrate=5000000):
+        """
+        SharedBus(spi_channel, baudrate=5000000)
+        One SPI bus for several transceivers, see transport(). The bus is released once every
+        transport on it is closed.
+        spi_channel: SPI channel, check SPIConfig for preconfigured names
+        baudrate: SPI clock, 5MHz by default
+        """
+        self.spi = SPI(spi_channel[0], baudrate,
+                       sck=Pin(spi_channel[1]), mosi=Pin(spi_channel[2]), miso=Pin(spi_channel[3]))
+        self._users = 0
+
+    def transport(self, interrupt, cs_pin, reset_pin=None, hop_pin=None):
+        # a MachineTransport for the radio on cs_pin; a reset line wired to several radios belongs to the first
+        self._users += 1
+        return MachineTransport(None, interrupt, cs_pin, reset_pin, bus=self, hop_pin=hop_pin)
+
+    def release(self):
+        self._users -= 1
+        if self._users <= 0:
+            self.spi.deinit()
+
+
+class MachineTransport(object):
+    def __init__(self, spi_channel, interrupt, cs_pin, reset_pin=None, baudrate=5000000, bus=None, hop_pin=None):
+        """
+        MachineTransport(spi_channel, interrupt, cs_pin, reset_pin=None, baudrate=5000000, bus=None, hop_pin=None)
+        spi_channel: SPI channel, check SPIConfig for preconfigured names
+        interrupt: GPIO pin connected to DIO0
+        cs_pin: chip select pin from microcontroller
+        reset_pin: the GPIO used to reset the RFM9x if connected
+        baudrate: SPI clock, 5MHz by default
+        bus: a SharedBus to use instead of setting up spi_channel (spi_channel and baudrate are ignored)
+        hop_pin: GPIO pin connected to DIO2, for frequency hopping
+        """
+        self._interrupt = Pin(interrupt, Pin.IN)
+        self._hop_pin = None if hop_pin is None else Pin(hop_pin, Pin.IN)
+        self._reset_pin = reset_pin
+
+        self._bus = bus
+        if bus is not None:
+            self.spi = bus.spi
+        else:
+            self.spi = SPI(spi_channel[0], baudrate,
+                           sck=Pin(spi_channel[1]), mosi=Pin(spi_channel[2]), miso=Pin(spi_channel[3]))
+
+        # cs gpio pin
+        self.cs = Pin(cs_pin, Pin.OUT)
+        self.cs.value(1)
+
+        # address byte and single register buffer, only touched with
+        # interrupts disabled so handlers can share them
+        self._addr = bytearray(1)
+        self._reg = bytearray(2)
+
+        # wrapped so the counters stay small ints, incrementing one in a hard handler must not allocate
+        self.spi_transactions = 0
+        self.spi_bytes = 0
+
+    def irq(self, handler, hard=False):
+        self._interrupt.irq(trigger=Pin.IRQ_RISING, handler=handler, hard=hard)
+
+    def hop_irq(self, handler, hard=False):
+        if self._hop_pin is None:
+            raise ValueError("no hop_pin (DIO2) given")
+        self._hop_pin.irq(trigger=Pin.IRQ_RISING, handler=handler, hard=hard)
+
+    def disable_irq(self):
+        return disable_irq()
+
+    def enable_irq(self, state):
+        enable_irq(state)
+
+    def reset(self):
+        # the chip needs the line low for 100us; LoRa polls RegVersion for the end of the 5ms boot
+        if self._reset_pin:
+            gpio_reset = Pin(self._reset_pin, Pin.OUT)
+            gpio_reset.value(0)
+            time.sleep_us(100)
+            gpio_reset.value(1)
+
+    # interrupts are held off for the length of a transaction so a hard
+    # handler never lands in the middle of one
+
+    def write(self, register, data):
+        state = disable_irq()
+        self._addr[0] = register | 0x80
+        self.cs.value(0)
+        self.spi.write(self._addr)
+        self.spi.write(data)
+        self.cs.value(1)
+        self.spi_transactions = (self.spi_transactions + 1) & 0x3fffffff
+        self.spi_bytes = (self.spi_bytes + len(data) + 1) & 0x3fffffff
+        enable_irq(state)
+
+    def readinto(self, register, buf):
+        state = disable_irq()
+        self._addr[0] = register & 0x7f
+        self.cs.value(0)
+        self.spi.write(self._addr)
+        self.spi.readinto(buf)
+        self.cs.value(1)
+        self.spi_transactions = (self.spi_transactions + 1) & 0x3fffffff
+        self.spi_bytes = (self.spi_bytes + len(buf) + 1) & 0x3fffffff
+        enable_irq(state)
+
+    def write_reg(self, register, value):
+        state = disable_irq()
+        self._reg[0] = register | 0x80
+        self._reg[1] = value
+        self.cs.value(0)
+        self.spi.write(self._reg)
+        self.cs.value(1)
+        self.spi_transactions = (self.spi_transactions + 1) & 0x3fffffff
+        self.spi_bytes = (self.spi_bytes + 2) & 0x3fffffff
+        enable_irq(state)
+
+    def read_reg(self, register):
+        state = disable_irq()
+        self._reg[0] = register & 0x7f
+        self.cs.value(0)
+        self.spi.write_readinto(self._reg, self._reg)
+        self.cs.value(1)
+        value = self._reg[1]
+        self.spi_transactions = (self.spi_transactions + 1) & 0x3fffffff
+        self.spi_bytes = (self.spi_bytes + 2) & 0x3fffffff
+        enable_irq(state)
+        return value
+
+    def read(self, register, length=1):
+        buf = bytearray(length)
+        self.readinto(register, buf)
+        return bytes(buf)
+
+    def deinit(self):
+        # once only, a shared bus counts its users
+        if self.spi is None:
+            return
+        self._interrupt.irq(handler=None)
+        if self._hop_pin is not None:
+            self._hop_pin.irq(handler=None)
+        if self._bus is None:
+            self.spi.deinit()
+        else:
+            self._bus.release()
+        self.spi = None
@@ -0,0 +1,351 @@
+"""
+Multi-hop mesh: frames relayed node to node to reach a destination out of direct range.
+
+    lora = LoRa(SPIConfig.rp2_0, 28, 7, 5, reset_pin=27, freq=902.3, receive_all=True, acks=True)
+    mesh = Mesh(lora)                        # on every node
+    lora.set_mode_rx()
+    mesh.send(b"reading", GATEWAY_ADDRESS)   # queued; a route is looked for first if there is none
+    while True:
+        mesh.service()                       # sends and relays, from the main loop
+
+    # on the destination, messages arrive at lora.on_recv with header_from the node they started at
+
+Mesh frames are KIND_MESH.  The RadioHead header addresses the hop
+(header_to the next node, header_from the one relaying) and the data
+starts with a 5 byte mesh header:
+
+    type, origin, destination, sequence, hops
+
+DATA carries a message.  ROUTE_REQUEST is broadcast and flooded towards the
+destination: every node relays a request once, after a random jitter so
+neighbours don't all answer at once, and learns the way back to its origin
+from the node it heard it from.  The destination sends ROUTE_REPLY back that
+way, which sets up the route at every node it passes.  ROUTE_FAILURE goes
+back to the origin when a hop on its route stops answering, and the origin
+looks for a new one with its next message.  Every node remembers the last
+`seen` (origin, sequence) pairs, so a frame heard again (a hop ack that got
+lost, the flood coming back) is neither relayed nor delivered twice.
+
+Routes are kept for at most `max_routes` destinations, the least recently
+used goes first.  The receive handler only parses and queues (hop acks
+aside, which go out at once like LoRa's own); sending, relaying and
+giving up on routes happen in service(), so nothing in the receive path
+waits for the air.  route_hits / route_misses, and the forward_us histogram
+(microseconds from receiving a frame to starting to relay it), show how
+the table and the relays do, see stats() and the mesh suite of ulora_bench.
+
+LoRa only passes broadcasts on with receive_all=True, which route requests
+need; mesh frames meant for other nodes are ignored.  Hops are acked with
+send_to_wait when the LoRa has acks=True, and sent once otherwise.
+
+The routing table and queues are shared between service() and the
+receive handler, and kept consistent by holding the radio's interrupt off
+(LoRa.disable_irq).  That doesn't hold off a deferred LoRa's service(),
+which runs from micropython.schedule, so Mesh takes deferred=False only
+(and so no AsyncLoRa).
+"""
+from ulora import (KIND_MESH, BROADCAST_ADDRESS, METRICS, Histogram, Payload, getrandbits, ticks_ms, ticks_us,
+                   ticks_add, ticks_diff)
+
+DATA = 0
+ROUTE_REQUEST = 1
+ROUTE_REPLY = 2
+ROUTE_FAILURE = 3
+
+HEADER_LEN = 5
+
+
+class Mesh(object):
+    # reported and zeroed by stats()
+    stats_counters = ("sent", "delivered", "forwarded", "duplicates", "route_hits", "route_misses", "discoveries",
+                      "route_failures", "dropped")
+
+    def __init__(self, lora, max_routes=16, ttl=8, seen=32, queue_size=8, retries=3, jitter=None, timeout=None):
+        """
+        Mesh(lora, max_routes=16, ttl=8, seen=32, queue_size=8, retries=3, jitter=None, timeout=None)
+        lora: the LoRa instance to send and relay through (receive_all=True, see above)
+        max_routes: destinations kept in the routing table
+        ttl: hops a frame or route request may travel
+        seen: (origin, sequence) pairs remembered to suppress duplicates
+        queue_size: frames waiting to go out or for a route
+        retries: send_to_wait retries per hop
+        jitter: most seconds a relayed route request waits, None derives it from the time on air
+        timeout: seconds to wait for a route, None derives it from ttl and the time on air
+        """
+        if lora.deferred:
+            raise ValueError("Mesh needs deferred=False")
+        self.lora = lora
+        self.max_routes = max_routes
+        self.ttl = ttl
+        self.queue_size = queue_size
+        self.retries = retries
+        self.jitter = jitter
+        self.timeout = timeout
+        self.routes = {}  # destination -> [next hop, hops, last used]
+        self._queue = []  # [ticks_ms due, next hop, frame, ticks_us when received or None] in order
+        self._waiting = []  # [destination, frame, ticks_ms deadline] until a route turns up
+        self._seen = [-1] * seen  # origin << 8 | sequence, a ring
+        self._seen_pos = 0
+        self._seq = 0
+        self._clock = 0
+
+        for name in self.stats_counters:
+            setattr(self, name, 0)
+        self.forward_us = Histogram()
+
+        lora.handlers[KIND_MESH] = self._on_frame
+
+    def close(self):
+        self.lora.handlers.pop(KIND_MESH, None)
+
+    @property
+    def max_payload(self):
+        return self.lora.max_payload - HEADER_LEN
+
+    def _jitter(self):
+        if self.jitter is not None:
+            limit = self.jitter
+        else:
+            limit = 2 * (self.lora.time_on_air(HEADER_LEN) + self.lora.ack_turnaround)
+        return limit * getrandbits(8) / 256
+
+    def _timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        lora = self.lora
+        hop = lora.time_on_air(HEADER_LEN) + lora.ack_turnaround
+        return 2 * self.ttl * (3 * hop) + 4 * hop
+
+    # routing table
+
+    def _learn(self, destination, hop, hops):
+        # a way to destination through neighbour `hop`, kept if it is no longer than the one we have
+        self._clock += 1
+        route = self.routes.get(destination)
+        if route is not None:
+            if hops <= route[1] or route[0] == hop:
+                route[0] = hop
+                route[1] = hops
+                route[2] = self._clock
+            return
+        if len(self.routes) >= self.max_routes:
+            stale = min(self.routes, key=lambda peer: self.routes[peer][2])
+            del self.routes[stale]
+        self.routes[destination] = [hop, hops, self._clock]
+
+    def _lookup(self, destination):
+        # next hop towards destination or None, counted in route_hits / route_misses
+        route = self.routes.get(destination)
+        if route is None:
+            self.route_misses += 1
+            return None
+        self.route_hits += 1
+        self._clock += 1
+        route[2] = self._clock
+        return route[0]
+
+    def _forget(self, hop):
+        # the link to neighbour `hop` broke: every route through it goes
+        for destination in [d for d in self.routes if self.routes[d][0] == hop]:
+            del self.routes[destination]
+
+    def _is_seen(self, origin, seq):
+        key = (origin << 8) | seq
+        if key in self._seen:
+            return True
+        self._seen[self._seen_pos] = key
+        self._seen_pos = (self._seen_pos + 1) % len(self._seen)
+        return False
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xff
+        return self._seq
+
+    # queues, shared with the receive handler: main loop side under disable_irq
+
+    def _push(self, hop, frame, received=None, delay=0):
+        if len(self._queue) + len(self._waiting) >= self.queue_size:
+            self.dropped += 1
+            return False
+        self._queue.append([ticks_add(ticks_ms(), int(delay * 1000)), hop, frame, received])
+        return True
+
+    def _locked(self, func, *args):
+        lora = self.lora
+        state = lora.disable_irq()
+        try:
+            return func(*args)
+        finally:
+            lora.enable_irq(state)
+
+    def send(self, data, destination):
+        # queue data for destination, looking for a route first if there is none; False if it was dropped
+        if type(data) == str:
+            data = data.encode()
+        if len(data) > self.max_payload:
+            raise ValueError("payload too long")
+        me = self.lora.address
+        frame = bytes((DATA, me, destination, self._next_seq(), 0)) + data
+        self.sent += 1
+        if destination == BROADCAST_ADDRESS:
+            # one hop, everyone in range
+            return self._locked(self._push, BROADCAST_ADDRESS, frame)
+        return self._locked(self._route, destination, frame)
+
+    def _route(self, destination, frame):
+        hop = self._lookup(destination)
+        if hop is not None:
+            return self._push(hop, frame)
+        if len(self._queue) + len(self._waiting) >= self.queue_size:
+            self.dropped += 1
+            return False
+        searching = False
+        for waiting in self._waiting:
+            if waiting[0] == destination:
+                searching = True
+        self._waiting.append([destination, frame, ticks_add(ticks_ms(), int(self._timeout() * 1000) + 1)])
+        if not searching:
+            self.discoveries += 1
+            request = bytes((ROUTE_REQUEST, self.lora.address, destination, self._next_seq(), 0))
+            self._queue.append([ticks_ms(), BROADCAST_ADDRESS, request, None])
+        return True
+
+    def _found(self, destination):
+        # receive handler context: a route to destination came in, release what waited for it
+        hop = self.routes[destination][0]
+        for waiting in [w for w in self._waiting if w[0] == destination]:
+            self._waiting.remove(waiting)
+            self._queue.append([ticks_ms(), hop, waiting[1], None])
+
+    def service(self):
+        # send what is due and give up on routes that never came; returns the number of frames sent
+        now = ticks_ms()
+        self._locked(self._expire, now)
+        sent = 0
+        while True:
+            item = self._locked(self._next_due, now)
+            if item is None:
+                return sent
+            self._transmit(item)
+            sent += 1
+
+    def _expire(self, now):
+        for waiting in [w for w in self._waiting if ticks_diff(w[2], now) < 0]:
+            self._waiting.remove(waiting)
+            self.dropped += 1
+
+    def _next_due(self, now):
+        for i in range(len(self._queue)):
+            if ticks_diff(self._queue[i][0], now) <= 0:
+                return self._queue.pop(i)
+        return None
+
+    def _transmit(self, item):
+        _, hop, frame, received = item
+        lora = self.lora
+        if received is not None and METRICS:
+            self.forward_us.add(ticks_diff(ticks_us(), received))
+        if hop == BROADCAST_ADDRESS or not lora.acks:
+            sent = lora.send(frame, hop, 0, KIND_MESH)
+            lora.wait_packet_sent()
+            lora.set_mode_rx()
+        else:
+            sent = lora.send_to_wait(frame, hop, KIND_MESH, self.retries)
+        if received is not None and sent:
+            self.forwarded += 1
+        if not sent and hop != BROADCAST_ADDRESS:
+            self._locked(self._broken, hop, frame)
+
+    def _broken(self, hop, frame):
+        # no ack from `hop`: drop the routes through it and tell the origin of the frame
+        self.route_failures += 1
+        self.dropped += 1
+        self._forget(hop)
+        me = self.lora.address
+        origin = frame[1]
+        if origin != me and frame[0] != ROUTE_FAILURE:
+            failure = bytes((ROUTE_FAILURE, me, origin, self._next_seq(), 0, frame[2]))
+            back = self._lookup(origin)
+            if back is not None:
+                self._push(back, failure)
+
+    # receive handler context
+
+    def _on_frame(self, payload):
+        lora = self.lora
+        me = lora.address
+        if payload.header_to != me and payload.header_to != BROADCAST_ADDRESS:
+            return
+        data = payload.message
+        hop = payload.header_from
+        if payload.header_to == me and lora.acks:
+            lora.ack(payload)
+        if len(data) < HEADER_LEN:
+            self.dropped += 1
+            return
+        kind = data[0]
+        origin = data[1]
+        destination = data[2]
+        seq = data[3]
+        hops = data[4]
+        if origin == me:
+            return  # our own route request, flooded back to us
+
+        self._learn(hop, hop, 1)
+        if origin != hop:
+            self._learn(origin, hop, hops + 1)
+        if self._is_seen(origin, seq):
+            self.duplicates += 1
+            return
+
+        if kind == ROUTE_REQUEST:
+            if destination == me:
+                self._push(hop, bytes((ROUTE_REPLY, me, origin, self._next_seq(), 0)))
+            elif hops + 1 < self.ttl:
+                relay = bytearray(data)
+                relay[4] = hops + 1
+                self._push(BROADCAST_ADDRESS, relay, ticks_us(), self._jitter())
+        elif destination == me or (kind == DATA and destination == BROADCAST_ADDRESS):
+            if kind == DATA:
+                self.delivered += 1
+                lora.on_recv(Payload(bytes(data[HEADER_LEN:]), destination, origin, seq, 0, payload.rssi,
+                                     payload.snr))
+            elif kind == ROUTE_REPLY:
+                self._found(origin)
+            elif kind == ROUTE_FAILURE and len(data) > HEADER_LEN:
+                self.routes.pop(data[HEADER_LEN], None)
+        else:
+            self._relay(data, destination, hops)
+
+    def _relay(self, data, destination, hops):
+        received = ticks_us()
+        if hops + 1 >= self.ttl:
+            self.dropped += 1
+            return
+        hop = self._lookup(destination)
+        if hop is None:
+            self.dropped += 1
+            return
+        relay = bytearray(data)
+        relay[4] = hops + 1
+        self._push(hop, relay, received)
+
+    def stats(self, reset=False):
+        """
+        stats(reset=False)
+        The counters above as a dict, forward_us as {"count", "max", "buckets"} (see Histogram), and the
+        route cache hit rate.
+        reset: zero everything once read
+        """
+        stats = {}
+        for name in self.stats_counters:
+            stats[name] = getattr(self, name)
+        lookups = self.route_hits + self.route_misses
+        stats["hit_rate"] = self.route_hits / lookups if lookups else None
+        if METRICS:
+            stats["forward_us"] = self.forward_us.snapshot()
+        if reset:
+            for name in self.stats_counters:
+                setattr(self, name, 0)
+            self.forward_us.reset()
+        return stats
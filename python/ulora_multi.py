@@ -0,0 +1,189 @@
+"""
+Several transceivers on one SPI bus, run as one gateway.
+
+    multi = MultiRadio.on_bus(SPIConfig.rp2_0, SERVER_ADDRESS, (
+        (28, 5, 27, 868.1),     # interrupt, cs_pin, reset_pin, freq of each radio
+        (22, 13, None, 868.3),  # the reset line is shared, the first radio owns it
+    ))
+    multi.listen()
+    while True:
+        received = multi.receive()
+        if received is not None:
+            radio, payload = received
+            multi.send(b"ok", payload.header_from)
+
+The radios share one machine.SPI (ulora_hal.SharedBus), each with its own
+chip select and DIO0.  Every SPI transaction runs with interrupts
+disabled, so one radio's handler never lands in the middle of another's
+transfer, and the bus is released when the last radio is closed.
+
+Whatever any radio hands to on_recv goes into one queue, oldest first, as
+(radio index, Payload); receive() takes from it and packets_dropped counts
+what didn't fit.  send() has to pick the radio:
+
+    a peer that was heard      the radio that heard it last, the peer listens on that channel
+    BROADCAST_ADDRESS          every radio
+    anyone else                the next idle radio, round robin, or the least loaded one
+
+Radios with a tx_queue (on_bus() gives them one) take frames with
+enqueue() and go back to receive by themselves, so the others keep
+transmitting and receiving meanwhile; a radio without one sends and waits.
+"""
+from ulora import LoRa, BROADCAST_ADDRESS, PRIORITY_NORMAL
+
+
+class MultiRadio(object):
+    def __init__(self, radios, queue_size=16, max_peers=64):
+        """
+        MultiRadio(radios, queue_size=16, max_peers=64)
+        radios: LoRa instances, usually on different channels, see on_bus()
+        queue_size: packets held for receive() before the oldest is dropped (counted in packets_dropped)
+        max_peers: senders whose radio is remembered, the one heard least recently is forgotten first
+        """
+        self.radios = list(radios)
+        self.max_peers = max_peers
+        self.routes = {}  # peer -> [radio index, heard]
+        self.sent = [0] * len(self.radios)
+        self.packets_dropped = 0
+        self._queue_size = queue_size
+        self._packets = []
+        self._next = 0
+        self._clock = 0
+
+        for index, radio in enumerate(self.radios):
+            radio.on_recv = self._receiver(index)
+            radio.monitors.append(self._monitor(index))
+
+    @classmethod
+    def on_bus(cls, spi_channel, this_address, radios, baudrate=5000000, tx_queue=4, **kwargs):
+        """
+        MultiRadio.on_bus(spi_channel, this_address, radios, baudrate=5000000, tx_queue=4, **kwargs)
+        Set up a LoRa per transceiver on one shared SPI bus.
+        spi_channel: SPI channel, check SPIConfig for preconfigured names
+        this_address: address of every radio
+        radios: (interrupt, cs_pin, reset_pin, freq) for each transceiver
+        tx_queue: frames each radio queues, see LoRa
+        kwargs: passed on to every LoRa (and queue_size / max_peers to MultiRadio)
+        """
+        from ulora_hal import SharedBus
+        options = {}
+        for name in ("queue_size", "max_peers"):
+            if name in kwargs:
+                options[name] = kwargs.pop(name)
+        bus = SharedBus(spi_channel, baudrate)
+        # every chip select driven high before the first radio is talked to
+        transports = [bus.transport(interrupt, cs_pin, reset_pin) for interrupt, cs_pin, reset_pin, _ in radios]
+        members = []
+        for transport, (interrupt, cs_pin, reset_pin, freq) in zip(transports, radios):
+            members.append(LoRa(spi_channel, interrupt, this_address, cs_pin, reset_pin, freq,
+                                transport=transport, tx_queue=tx_queue, **kwargs))
+        return cls(members, **options)
+
+    def _receiver(self, index):
+        def on_recv(payload):
+            if len(self._packets) >= self._queue_size:
+                self._packets.pop(0)
+                self.packets_dropped += 1
+            self._packets.append((index, payload))
+        return on_recv
+
+    def _monitor(self, index):
+        def monitor(payload):
+            # every frame for us, acks and control frames too: remember where the sender listens
+            self._clock += 1
+            route = self.routes.get(payload.header_from)
+            if route is None:
+                if len(self.routes) >= self.max_peers:
+                    quiet = min(self.routes, key=lambda peer: self.routes[peer][1])
+                    del self.routes[quiet]
+                self.routes[payload.header_from] = [index, self._clock]
+            else:
+                route[0] = index
+                route[1] = self._clock
+        return monitor
+
+    def receive(self):
+        # oldest received packet as (radio index, Payload), or None
+        if not self._packets:
+            return None
+        return self._packets.pop(0)
+
+    @property
+    def pending(self):
+        return len(self._packets)
+
+    def listen(self):
+        for radio in self.radios:
+            radio.set_mode_rx()
+
+    def service(self):
+        # run the deferred handlers where there is no scheduler, returns the number of packets handled
+        handled = 0
+        for radio in self.radios:
+            handled += radio.service()
+        return handled
+
+    def is_idle(self, index):
+        # neither transmitting, doing CAD nor holding queued frames
+        radio = self.radios[index]
+        return not radio.transmitting and not radio.tx_pending
+
+    def pick(self, header_to):
+        # index of the radio send() would use for header_to
+        route = self.routes.get(header_to)
+        if route is not None:
+            return route[0]
+        count = len(self.radios)
+        for step in range(count):
+            index = (self._next + step) % count
+            if self.is_idle(index):
+                self._next = (index + 1) % count
+                return index
+        # all busy: the shortest queue
+        best = self._next
+        for index in range(count):
+            if self.radios[index].tx_pending < self.radios[best].tx_pending:
+                best = index
+        self._next = (best + 1) % count
+        return best
+
+    def send(self, data, header_to, header_id=0, header_flags=0, priority=PRIORITY_NORMAL):
+        # send through the radio pick() chooses, every radio for a broadcast; False if one of them dropped it
+        if header_to == BROADCAST_ADDRESS:
+            indices = range(len(self.radios))
+        else:
+            indices = (self.pick(header_to),)
+        sent = True
+        for index in indices:
+            sent = self._send_on(index, data, header_to, header_id, header_flags, priority) and sent
+        return sent
+
+    def _send_on(self, index, data, header_to, header_id, header_flags, priority):
+        radio = self.radios[index]
+        if radio.tx_queue:
+            sent = radio.enqueue(data, header_to, priority, header_id, header_flags)
+        else:
+            sent = radio.send(data, header_to, header_id, header_flags) and radio.wait_packet_sent()
+            radio.set_mode_rx()
+        if sent:
+            self.sent[index] += 1
+        return sent
+
+    def send_to_wait(self, data, header_to, header_flags=0, retries=3):
+        # LoRa.send_to_wait on the radio pick() chooses, blocks until acked or given up
+        index = self.pick(header_to)
+        radio = self.radios[index]
+        radio.wait_packet_sent()
+        acked = radio.send_to_wait(data, header_to, header_flags, retries)
+        radio.set_mode_rx()
+        if acked:
+            self.sent[index] += 1
+        return acked
+
+    def stats(self, reset=False):
+        # LoRa.stats() of every radio, in order
+        return [radio.stats(reset) for radio in self.radios]
+
+    def close(self):
+        for radio in self.radios:
+            radio.close()
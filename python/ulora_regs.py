@@ -0,0 +1,193 @@
+"""
+SX127x LoRa register map.
+
+    snap = lora.snapshot()              # or Snapshot.read(transport), one SPI transaction
+    print(snap)                         # same as dumpCfg(lora)
+    snap.decode()["RegModemConfig1"]["Bw"]
+    diff(before, snap)                  # {register: {field: (before, after)}}
+
+A snapshot is one burst read of REG_01..REG_42 (the LoRa page plus the DIO
+mapping and version registers).  The FIFO at 0x00 is left out: a burst that
+starts there keeps reading the FIFO instead of walking the registers.
+"""
+
+# (name, address, fields) with fields as (name, mask), the value is shifted down to the mask
+REGISTERS = (
+    ("RegOpMode", 0x01, (("LongRangeMode", 0x80), ("AccessSharedReg", 0x40), ("LowFrequencyModeOn", 0x08),
+                         ("Mode", 0x07))),
+    ("RegFrfMsb", 0x06, ()),
+    ("RegFrfMid", 0x07, ()),
+    ("RegFrfLsb", 0x08, ()),
+    ("RegPaConfig", 0x09, (("PaSelect", 0x80), ("MaxPower", 0x70), ("OutputPower", 0x0f))),
+    ("RegPaRamp", 0x0a, (("PaRamp", 0x0f),)),
+    ("RegOcp", 0x0b, (("OcpOn", 0x20), ("OcpTrim", 0x1f))),
+    ("RegLna", 0x0c, (("LnaGain", 0xe0), ("LnaBoostLf", 0x18), ("LnaBoostHf", 0x03))),
+    ("RegFifoAddrPtr", 0x0d, ()),
+    ("RegFifoTxBaseAddr", 0x0e, ()),
+    ("RegFifoRxBaseAddr", 0x0f, ()),
+    ("RegFifoRxCurrentAddr", 0x10, ()),
+    ("RegIrqFlagsMask", 0x11, (("RxTimeoutMask", 0x80), ("RxDoneMask", 0x40), ("PayloadCrcErrorMask", 0x20),
+                               ("ValidHeaderMask", 0x10), ("TxDoneMask", 0x08), ("CadDoneMask", 0x04),
+                               ("FhssChangeChannelMask", 0x02), ("CadDetectedMask", 0x01))),
+    ("RegIrqFlags", 0x12, (("RxTimeout", 0x80), ("RxDone", 0x40), ("PayloadCrcError", 0x20), ("ValidHeader", 0x10),
+                           ("TxDone", 0x08), ("CadDone", 0x04), ("FhssChangeChannel", 0x02), ("CadDetected", 0x01))),
+    ("RegRxNbBytes", 0x13, ()),
+    ("RegRxHeaderCntValueMsb", 0x14, ()),
+    ("RegRxHeaderCntValueLsb", 0x15, ()),
+    ("RegRxPacketCntValueMsb", 0x16, ()),
+    ("RegRxPacketCntValueLsb", 0x17, ()),
+    ("RegModemStat", 0x18, (("RxCodingRate", 0xe0), ("ModemClear", 0x10), ("HeaderInfoValid", 0x08),
+                            ("RxOnGoing", 0x04), ("SignalSynchronized", 0x02), ("SignalDetected", 0x01))),
+    ("RegPktSnrValue", 0x19, ()),
+    ("RegPktRssiValue", 0x1a, ()),
+    ("RegRssiValue", 0x1b, ()),
+    ("RegHopChannel", 0x1c, (("PllTimeout", 0x80), ("CrcOnPayload", 0x40), ("FhssPresentChannel", 0x3f))),
+    ("RegModemConfig1", 0x1d, (("Bw", 0xf0), ("CodingRate", 0x0e), ("ImplicitHeaderModeOn", 0x01))),
+    ("RegModemConfig2", 0x1e, (("SpreadingFactor", 0xf0), ("TxContinuousMode", 0x08), ("RxPayloadCrcOn", 0x04),
+                               ("SymbTimeoutMsb", 0x03))),
+    ("RegSymbTimeoutLsb", 0x1f, ()),
+    ("RegPreambleMsb", 0x20, ()),
+    ("RegPreambleLsb", 0x21, ()),
+    ("RegPayloadLength", 0x22, ()),
+    ("RegMaxPayloadLength", 0x23, ()),
+    ("RegHopPeriod", 0x24, ()),
+    ("RegFifoRxByteAddr", 0x25, ()),
+    ("RegModemConfig3", 0x26, (("LowDataRateOptimize", 0x08), ("AgcAutoOn", 0x04))),
+    ("RegPpmCorrection", 0x27, ()),
+    ("RegFeiMsb", 0x28, (("FreqError", 0x0f),)),
+    ("RegFeiMid", 0x29, ()),
+    ("RegFeiLsb", 0x2a, ()),
+    ("RegRssiWideband", 0x2c, ()),
+    ("RegDetectOptimize", 0x31, (("DetectionOptimize", 0x07),)),
+    ("RegInvertIQ", 0x33, (("InvertIQRx", 0x40), ("InvertIQTx", 0x01))),
+    ("RegDetectionThreshold", 0x37, ()),
+    ("RegSyncWord", 0x39, ()),
+    ("RegInvertIQ2", 0x3b, ()),
+    ("RegDioMapping1", 0x40, (("Dio0Mapping", 0xc0), ("Dio1Mapping", 0x30), ("Dio2Mapping", 0x0c),
+                              ("Dio3Mapping", 0x03))),
+    ("RegDioMapping2", 0x41, (("Dio4Mapping", 0xc0), ("Dio5Mapping", 0x30), ("MapPreambleDetect", 0x01))),
+    ("RegVersion", 0x42, ()),
+)
+
+# values spread over several registers, most significant first: (name, address, count)
+WIDE = (
+    ("Frf", 0x06, 3),
+    ("RxHeaderCnt", 0x14, 2),
+    ("RxPacketCnt", 0x16, 2),
+    ("PreambleLength", 0x20, 2),
+)
+
+# registers the chip updates by itself, skipped by diff() unless asked for
+VOLATILE = (0x01, 0x0d, 0x10, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b, 0x1c, 0x25, 0x28, 0x29,
+            0x2a, 0x2c)
+
+SNAPSHOT_START = 0x01
+SNAPSHOT_END = 0x43
+
+FXOSC = 32000000.0
+
+maxRegLen = 23
+maxFieldLen = maxRegLen
+
+
+def field(value, mask):
+    # value of the bits under mask, shifted down
+    while not mask & 1:
+        mask >>= 1
+        value >>= 1
+    return value & mask
+
+
+class Snapshot(object):
+    def __init__(self, data, start=SNAPSHOT_START):
+        """
+        Snapshot(data, start=SNAPSHOT_START)
+        data: register contents from `start` on, as read in one burst
+        start: address of data[0]
+        """
+        self.data = bytes(data)
+        self.start = start
+        self._decoded = None
+
+    @classmethod
+    def read(cls, transport, start=SNAPSHOT_START, end=SNAPSHOT_END):
+        # one burst read of start..end-1
+        buf = bytearray(end - start)
+        transport.readinto(start, buf)
+        return cls(buf, start)
+
+    def __getitem__(self, address):
+        return self.data[address - self.start]
+
+    def __eq__(self, other):
+        return self.start == other.start and self.data == other.data
+
+    def wide(self, address, count):
+        value = 0
+        for i in range(count):
+            value = (value << 8) | self[address + i]
+        return value
+
+    def decode(self):
+        # {register name: {"value": raw, field: value, ...}, wide name: value, ...}, built on first use
+        if self._decoded is None:
+            decoded = {}
+            for name, address, fields in REGISTERS:
+                value = self[address]
+                entry = {"value": value}
+                for field_name, mask in fields:
+                    entry[field_name] = field(value, mask)
+                decoded[name] = entry
+            for name, address, count in WIDE:
+                decoded[name] = self.wide(address, count)
+            snr = self[0x19]
+            decoded["CarrierMHz"] = decoded["Frf"] * FXOSC / (1 << 19) / 1e6
+            decoded["PktSnrDb"] = (snr - 256 if snr > 127 else snr) / 4
+            self._decoded = decoded
+        return self._decoded
+
+    def diff(self, other, volatile=False):
+        return diff(self, other, volatile)
+
+    def lines(self):
+        decoded = self.decode()
+        for name, address, fields in REGISTERS:
+            yield "-----------------------------------------------"
+            reg_name = f"{name}(0x{address:02x})"
+            yield f"{reg_name:>{maxRegLen}}: 0x{self[address]:02x}"
+            for field_name, _ in fields:
+                yield f"\t{field_name:>{maxFieldLen}}: {decoded[name][field_name]}"
+        yield "-----------------------------------------------"
+        for name, _, _ in WIDE:
+            yield f"{name:>{maxRegLen}}: {decoded[name]}"
+        yield f"{'CarrierMHz':>{maxRegLen}}: {decoded['CarrierMHz']}"
+        yield f"{'PktSnrDb':>{maxRegLen}}: {decoded['PktSnrDb']}"
+
+    def __str__(self):
+        return "\n".join(self.lines())
+
+
+def dumpCfg(lora):
+    # print every LoRa register with its fields, read in one burst
+    print(lora.snapshot())
+
+
+def diff(a, b, volatile=False):
+    """
+    diff(a, b, volatile=False)
+    Registers that differ between two snapshots as {name: {field: (a, b)}}, with "value" for the raw byte.
+    volatile: if False, leave out status registers the chip updates by itself (VOLATILE)
+    """
+    changes = {}
+    for name, address, fields in REGISTERS:
+        if not volatile and address in VOLATILE:
+            continue
+        old, new = a[address], b[address]
+        if old == new:
+            continue
+        entry = {"value": (old, new)}
+        for field_name, mask in fields:
+            if field(old, mask) != field(new, mask):
+                entry[field_name] = (field(old, mask), field(new, mask))
+        changes[name] = entry
+    return changes
@@ -0,0 +1,628 @@
+"""
+Register-level model of the SX127x LoRa modem for running ulora on a CPython host.
+
+    channel = VirtualChannel(time_scale=0.01)
+    server = LoRa(None, None, 2, None, transport=channel.radio())
+    client = LoRa(None, None, 1, None, transport=channel.radio())
+
+Each `SX127x` behaves like a transceiver wired to its own MCU: register and
+FIFO access go through `write`/`readinto`, and DIO0 edges call the attached
+handler from a per-radio interrupt thread, so the driver's busy loops run
+against it the same way they run against hardware.  All radios created from
+one `VirtualChannel` share the air: frames take their real time on air
+(scaled by `time_scale`), overlapping frames on the same frequency and
+spreading factor collide, and per-link RSSI/SNR/loss can be set with
+`set_link`.
+
+With RegHopPeriod set, a frame raises FhssChangeChannel (on DIO2, see
+`hop_irq`) every hop period on its transmitter and every receiver locked on
+to it, bumping FhssPresentChannel.  Halfway into each dwell a receiver not
+tuned where the transmitter is loses the frame, which then ends in a CRC
+error, as it does on the chip.  Collisions and CAD only look at the
+frequency a frame starts on.
+"""
+import heapq
+import math
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+
+FXOSC = 32000000.0
+FSTEP = (FXOSC / 524288)
+
+# op modes (RegOpMode bits 2-0)
+MODE_SLEEP = 0
+MODE_STDBY = 1
+MODE_TX = 3
+MODE_RXCONTINUOUS = 5
+MODE_RXSINGLE = 6
+MODE_CAD = 7
+LONG_RANGE_MODE = 0x80
+
+# RegIrqFlags
+RX_TIMEOUT = 0x80
+RX_DONE = 0x40
+PAYLOAD_CRC_ERROR = 0x20
+VALID_HEADER = 0x10
+TX_DONE = 0x08
+CAD_DONE = 0x04
+FHSS_CHANGE_CHANNEL = 0x02
+CAD_DETECTED = 0x01
+
+# RegDioMapping1 bits 7-6 -> flag driving DIO0, bits 3-2 -> DIO2
+DIO0_MAPPING = (RX_DONE, TX_DONE, CAD_DONE, 0)
+DIO2_MAPPING = (FHSS_CHANGE_CHANNEL, FHSS_CHANGE_CHANNEL, FHSS_CHANGE_CHANNEL, 0)
+
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+
+# registers the chip computes itself, writes are ignored
+READ_ONLY = frozenset((0x10, 0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b, 0x1c, 0x25, 0x42))
+
+RESET_VALUES = {
+    0x01: 0x09, 0x06: 0x6c, 0x07: 0x80, 0x08: 0x00, 0x09: 0x4f, 0x0a: 0x09, 0x0b: 0x2b, 0x0c: 0x20,
+    0x0e: 0x80, 0x1d: 0x72, 0x1e: 0x70, 0x1f: 0x64, 0x21: 0x08, 0x22: 0x01, 0x23: 0xff, 0x26: 0x04,
+    0x31: 0xc3, 0x33: 0x27, 0x37: 0x0a, 0x39: 0x12, 0x42: 0x12, 0x4d: 0x84,
+}
+
+
+def time_on_air(regs, length):
+    """Seconds on air for a `length` byte payload with the modem settings in `regs`."""
+    bw = BANDWIDTHS[regs[0x1d] >> 4]
+    cr = (regs[0x1d] >> 1) & 0x07
+    ih = regs[0x1d] & 0x01
+    sf = regs[0x1e] >> 4
+    crc = (regs[0x1e] >> 2) & 0x01
+    de = (regs[0x26] >> 3) & 0x01
+    preamble = (regs[0x20] << 8) | regs[0x21]
+    tsym = (1 << sf) / bw
+    bits = 8 * length - 4 * sf + 28 + 16 * crc - 20 * ih
+    payload_symbols = 8 + max(math.ceil(bits / (4 * (sf - 2 * de))) * (cr + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * tsym
+
+
+def symbol_time(regs):
+    return (1 << (regs[0x1e] >> 4)) / BANDWIDTHS[regs[0x1d] >> 4]
+
+
+class Link(object):
+    def __init__(self, rssi=-60.0, snr=9.0, loss=0.0):
+        self.rssi = rssi
+        self.snr = snr
+        self.loss = loss
+
+
+class Frame(object):
+    def __init__(self, radio, payload, start, end, sync):
+        self.radio = radio
+        self.payload = payload
+        self.air = radio.air_key()
+        self.start = start
+        self.end = end
+        self.sync = sync
+        self.collided = False
+        self.aborted = False
+        self.listeners = []
+        self.hop_period = 0  # seconds, scaled
+        self.hops = 0
+        self.lost = set()  # receivers that fell out of step with the hops
+
+
+class VirtualChannel(object):
+    def __init__(self, time_scale=1.0, seed=None):
+        """
+        VirtualChannel(time_scale=1.0, seed=None)
+        time_scale: multiplier applied to every on-air duration, e.g. 0.01 runs the air 100x faster
+        seed: seed for the loss model
+        """
+        self.time_scale = time_scale
+        self.radios = []
+        self.on_air = []
+        self.frames = 0
+        self.collisions = 0
+        self.lock = threading.RLock()
+        self._links = {}
+        self._random = random.Random(seed)
+        self._events = []
+        self._seq = 0
+        self._cond = threading.Condition(self.lock)
+        self._running = True
+        # the radios' interrupt threads stand in for IRQs, don't let a busy
+        # loop in the main thread hold them off for the default 5ms
+        sys.setswitchinterval(0.0002)
+        self._thread = threading.Thread(target=self._run, name="ulora-sim", daemon=True)
+        self._thread.start()
+
+    def radio(self, name=None):
+        radio = SX127x(self, name or "radio%d" % len(self.radios))
+        with self.lock:
+            self.radios.append(radio)
+        return radio
+
+    def set_link(self, a, b, rssi=None, snr=None, loss=None, symmetric=True):
+        pairs = ((a, b), (b, a)) if symmetric else ((a, b),)
+        with self.lock:
+            for pair in pairs:
+                link = self._links.setdefault(pair, Link())
+                if rssi is not None:
+                    link.rssi = rssi
+                if snr is not None:
+                    link.snr = snr
+                if loss is not None:
+                    link.loss = loss
+
+    def link(self, a, b):
+        return self._links.get((a, b)) or Link()
+
+    def now(self):
+        return time.monotonic()
+
+    def schedule(self, delay, callback, *args):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._events, (self.now() + delay, self._seq, callback, args))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        for radio in list(self.radios):
+            radio.deinit()
+
+    def _run(self):
+        with self._cond:
+            while self._running:
+                if not self._events:
+                    self._cond.wait()
+                    continue
+                delay = self._events[0][0] - self.now()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                _, _, callback, args = heapq.heappop(self._events)
+                try:
+                    callback(*args)
+                except Exception:
+                    traceback.print_exc()
+
+    # called with self.lock held
+
+    def transmit(self, radio, payload):
+        start = self.now()
+        end = start + time_on_air(radio.regs, len(payload)) * self.time_scale
+        preamble = (radio.regs[0x20] << 8) | radio.regs[0x21]
+        sync = start + (preamble + 4.25) * symbol_time(radio.regs) * self.time_scale
+        frame = Frame(radio, payload, start, end, sync)
+        for other in self.on_air:
+            if other.air[:2] == frame.air[:2]:
+                other.collided = frame.collided = True
+                self.collisions += 1
+        frame.listeners = [r for r in self.radios if r is not radio and r.listening(frame.air)]
+        self.on_air.append(frame)
+        self.frames += 1
+        radio.tx_frames += 1
+        for r in [radio] + frame.listeners:
+            r.regs[0x1c] &= 0xc0  # FhssPresentChannel starts over with every frame
+        if radio.regs[0x24]:
+            frame.hop_period = radio.regs[0x24] * symbol_time(radio.regs) * self.time_scale
+            if frame.hop_period < end - start:
+                self.schedule(frame.hop_period, self._hop, frame)
+        self.schedule(end - start, self._frame_end, frame)
+        return frame
+
+    def join(self, radio):
+        # a receiver entering rx during the preamble still locks on to the frame
+        now = self.now()
+        for frame in self.on_air:
+            if frame.radio is not radio and now <= frame.sync and radio.listening(frame.air) \
+                    and radio not in frame.listeners:
+                frame.listeners.append(radio)
+                radio.regs[0x1c] &= 0xc0
+
+    def busy(self, radio):
+        key = radio.air_key()[:2]
+        return any(f.air[:2] == key and f.radio is not radio for f in self.on_air)
+
+    def _hop(self, frame):
+        if frame.aborted or frame not in self.on_air:
+            return
+        frame.hops += 1
+        frame.radio.hop(frame.hops)
+        for radio in frame.listeners:
+            if radio.locked(frame):
+                if radio.regs[0x24] == frame.radio.regs[0x24]:
+                    radio.hop(frame.hops)
+                elif radio.regs[0x24]:
+                    frame.lost.add(radio)
+        self.schedule(frame.hop_period / 2, self._dwell, frame)
+        if (frame.hops + 1) * frame.hop_period < frame.end - frame.start:
+            self.schedule(frame.hop_period, self._hop, frame)
+
+    def _dwell(self, frame):
+        # by now everyone should have retuned to the transmitter's channel
+        if frame.aborted or frame not in self.on_air:
+            return
+        tuned = frame.radio.regs[0x06:0x09]
+        for radio in frame.listeners:
+            if radio.regs[0x06:0x09] != tuned:
+                frame.lost.add(radio)
+
+    def _frame_end(self, frame):
+        self.on_air.remove(frame)
+        if frame.aborted:
+            return
+        frame.radio.tx_done(frame)
+        for radio in frame.listeners:
+            if frame.hops:
+                # the receivers have hopped along, only the modem settings still have to match
+                if not radio.locked(frame):
+                    continue
+                link = self.link(frame.radio, radio)
+                lost = link.loss and self._random.random() < link.loss
+                # a receiver that followed the hops demodulates to the end even if the signal went
+                radio.rx_done(frame, link, self._random, corrupt=lost or radio in frame.lost)
+                continue
+            if not radio.listening(frame.air):
+                continue
+            link = self.link(frame.radio, radio)
+            if link.loss and self._random.random() < link.loss:
+                continue
+            radio.rx_done(frame, link, self._random)
+
+
+class SX127x(object):
+    def __init__(self, channel, name):
+        self.channel = channel
+        self.name = name
+        self.regs = bytearray(0x80)
+        self.fifo = bytearray(256)
+        self.spi_transactions = 0
+        self.spi_bytes = 0
+        self.isr_count = 0
+        self.tx_frames = 0
+        self.isr_times = []
+        self.irq_lock = threading.RLock()
+        self._handler = None
+        self._hop_handler = None
+        self._hop_queue = None
+        self._irq_queue = None
+        self._dio0 = False
+        self._dio2 = False
+        self._frame = None
+        self._rx_addr = 0
+        self._session = 0
+        self._reset_registers()
+
+    def __repr__(self):
+        return "<SX127x %s>" % self.name
+
+    # transport interface, see ulora_hal.py
+
+    def irq(self, handler, hard=False):
+        self._handler = handler
+        self._start_irq()
+
+    def hop_irq(self, handler, hard=False):
+        # DIO2, FhssChangeChannel: its own thread, not held off by a running DIO0 handler, the way a hard
+        # interrupt preempts a soft one; each transport call is still atomic
+        self._hop_handler = handler
+        if self._hop_queue is None:
+            self._hop_queue = queue.Queue()
+            threading.Thread(target=self._hop_loop, name="%s-hop" % self.name, daemon=True).start()
+
+    def _start_irq(self):
+        if self._irq_queue is None:
+            self._irq_queue = queue.Queue()
+            threading.Thread(target=self._irq_loop, name="%s-irq" % self.name, daemon=True).start()
+
+    def disable_irq(self):
+        # the handler runs holding irq_lock, so taking it holds the handler off
+        self.irq_lock.acquire()
+
+    def enable_irq(self, state):
+        self.irq_lock.release()
+
+    def reset(self):
+        with self.channel.lock:
+            self._reset_registers()
+
+    def write(self, register, data):
+        with self.channel.lock:
+            self._count(len(data))
+            address = register & 0x7f
+            for value in data:
+                self._write_register(address, value)
+                if address:
+                    address = (address + 1) & 0x7f
+            self._update_dio()
+
+    def readinto(self, register, buf):
+        with self.channel.lock:
+            self._count(len(buf))
+            address = register & 0x7f
+            for i in range(len(buf)):
+                buf[i] = self._read_register(address)
+                if address:
+                    address = (address + 1) & 0x7f
+
+    def read(self, register, length=1):
+        buf = bytearray(length)
+        self.readinto(register, buf)
+        return bytes(buf)
+
+    def write_reg(self, register, value):
+        self.write(register, (value,))
+
+    def read_reg(self, register):
+        with self.channel.lock:
+            self._count(1)
+            return self._read_register(register & 0x7f)
+
+    def deinit(self):
+        with self.channel.lock:
+            self._abort()
+            if self in self.channel.radios:
+                self.channel.radios.remove(self)
+        if self._irq_queue is not None:
+            self._irq_queue.put(None)
+            self._irq_queue = None
+        if self._hop_queue is not None:
+            self._hop_queue.put(None)
+            self._hop_queue = None
+
+    # chip state
+
+    @property
+    def mode(self):
+        return self.regs[0x01] & 0x07
+
+    @property
+    def frequency(self):
+        return ((self.regs[0x06] << 16) | (self.regs[0x07] << 8) | self.regs[0x08]) * FSTEP
+
+    def air_key(self):
+        # radios only hear each other when all of these match
+        r = self.regs
+        return (bytes(r[0x06:0x09]), r[0x1e] >> 4, r[0x1d] >> 4, r[0x1d] & 0x01, r[0x39], r[0x33] & 0x40)
+
+    def listening(self, air):
+        return self.regs[0x01] & LONG_RANGE_MODE and \
+            self.mode in (MODE_RXCONTINUOUS, MODE_RXSINGLE) and self.air_key() == air
+
+    def locked(self, frame):
+        # still receiving `frame`, on whatever channel it hopped to
+        return self.regs[0x01] & LONG_RANGE_MODE and \
+            self.mode in (MODE_RXCONTINUOUS, MODE_RXSINGLE) and self.air_key()[1:] == frame.air[1:]
+
+    def _count(self, length):
+        self.spi_transactions += 1
+        self.spi_bytes += length + 1
+
+    def _reset_registers(self):
+        self._abort()
+        self.regs[:] = bytes(0x80)
+        for address, value in RESET_VALUES.items():
+            self.regs[address] = value
+        self.fifo[:] = bytes(256)
+        self._dio0 = False
+        self._dio2 = False
+
+    def _abort(self):
+        self._session += 1
+        if self._frame is not None:
+            self._frame.aborted = True
+            self._frame = None
+
+    def _read_register(self, address):
+        if address == 0x00:
+            ptr = self.regs[0x0d]
+            self.regs[0x0d] = (ptr + 1) & 0xff
+            return self.fifo[ptr]
+        if address == 0x18:
+            return 0x04 if self.mode in (MODE_RXCONTINUOUS, MODE_RXSINGLE) else 0x00
+        return self.regs[address]
+
+    def _write_register(self, address, value):
+        if address == 0x00:
+            ptr = self.regs[0x0d]
+            self.fifo[ptr] = value
+            self.regs[0x0d] = (ptr + 1) & 0xff
+        elif address == 0x01:
+            self._set_op_mode(value)
+        elif address == 0x12:
+            self.regs[0x12] &= ~value & 0xff
+        elif address not in READ_ONLY:
+            self.regs[address] = value
+
+    def _set_op_mode(self, value):
+        old = self.regs[0x01]
+        # LongRangeMode can only change going into or out of sleep
+        if old & 0x07 != MODE_SLEEP and value & 0x07 != MODE_SLEEP:
+            value = (value & 0x7f) | (old & LONG_RANGE_MODE)
+        self.regs[0x01] = value
+        mode = value & 0x07
+        if mode == old & 0x07:
+            return
+
+        self._abort()
+        if mode == MODE_SLEEP:
+            self.fifo[:] = bytes(256)
+        if not value & LONG_RANGE_MODE:
+            return
+
+        if mode == MODE_TX:
+            length = self.regs[0x22]
+            base = self.regs[0x0e]
+            payload = bytes(self.fifo[(base + i) & 0xff] for i in range(length))
+            self._frame = self.channel.transmit(self, payload)
+        elif mode in (MODE_RXCONTINUOUS, MODE_RXSINGLE):
+            self._rx_addr = self.regs[0x0f]
+            self.channel.join(self)
+            if mode == MODE_RXSINGLE:
+                symbols = ((self.regs[0x1e] & 0x03) << 8) | self.regs[0x1f]
+                delay = symbols * symbol_time(self.regs) * self.channel.time_scale
+                self.channel.schedule(delay, self._rx_timeout, self._session)
+        elif mode == MODE_CAD:
+            busy = self.channel.busy(self)
+            delay = 2 * symbol_time(self.regs) * self.channel.time_scale
+            self.channel.schedule(delay, self._cad_done, self._session, busy)
+
+    def _standby(self):
+        self._session += 1
+        self.regs[0x01] = (self.regs[0x01] & 0xf8) | MODE_STDBY
+
+    def _raise(self, flags):
+        self.regs[0x12] |= flags
+        self._update_dio()
+
+    def _update_dio(self):
+        mapped = DIO0_MAPPING[self.regs[0x40] >> 6]
+        level = bool(self.regs[0x12] & mapped & ~self.regs[0x11])
+        if level and not self._dio0 and self._irq_queue is not None:
+            self._irq_queue.put(self._handler)
+        self._dio0 = level
+        mapped = DIO2_MAPPING[(self.regs[0x40] >> 2) & 0x03]
+        level = bool(self.regs[0x12] & mapped & ~self.regs[0x11])
+        if level and not self._dio2 and self._hop_queue is not None and self._hop_handler is not None:
+            self._hop_queue.put(self._hop_handler)
+        self._dio2 = level
+
+    # channel callbacks, called with channel.lock held
+
+    def tx_done(self, frame):
+        if frame is not self._frame:
+            return
+        self._frame = None
+        self._standby()
+        self._raise(TX_DONE)
+
+    def hop(self, count):
+        self.regs[0x1c] = (self.regs[0x1c] & 0xc0) | (count & 0x3f)
+        self._raise(FHSS_CHANGE_CHANNEL)
+
+    def rx_done(self, frame, link, rng, corrupt=False):
+        payload = frame.payload
+        if self.regs[0x1d] & 0x01:
+            # implicit header: the receiver takes the length from its own RegPayloadLength
+            length = self.regs[0x22]
+            payload = (payload + bytes(length))[:length]
+        flags = RX_DONE | VALID_HEADER
+        if frame.collided or corrupt:
+            payload = bytes(b ^ rng.getrandbits(8) for b in payload)
+            if self.regs[0x1e] & 0x04:
+                flags |= PAYLOAD_CRC_ERROR
+
+        addr = self._rx_addr
+        for i, value in enumerate(payload):
+            self.fifo[(addr + i) & 0xff] = value
+        self._rx_addr = (addr + len(payload)) & 0xff
+        self.regs[0x10] = addr
+        self.regs[0x13] = len(payload)
+
+        snr = max(-32.0, min(31.75, link.snr))
+        offset = 157 if self.frequency >= 779e6 else 164
+        rssi = link.rssi + offset - (snr if snr < 0 else 0)
+        self.regs[0x19] = int(round(snr * 4)) & 0xff
+        self.regs[0x1a] = max(0, min(255, int(round(rssi))))
+
+        headers = ((self.regs[0x14] << 8) | self.regs[0x15]) + 1
+        self.regs[0x14] = (headers >> 8) & 0xff
+        self.regs[0x15] = headers & 0xff
+        if not flags & PAYLOAD_CRC_ERROR:
+            packets = ((self.regs[0x16] << 8) | self.regs[0x17]) + 1
+            self.regs[0x16] = (packets >> 8) & 0xff
+            self.regs[0x17] = packets & 0xff
+
+        if self.mode == MODE_RXSINGLE:
+            self._standby()
+        self._raise(flags)
+
+    def _rx_timeout(self, session):
+        if session == self._session and self.mode == MODE_RXSINGLE:
+            self._standby()
+            self._raise(RX_TIMEOUT)
+
+    def _cad_done(self, session, busy):
+        if session == self._session and self.mode == MODE_CAD:
+            busy = busy or self.channel.busy(self)
+            self._standby()
+            self._raise(CAD_DONE | (CAD_DETECTED if busy else 0))
+
+    def _irq_loop(self):
+        irq_queue = self._irq_queue
+        while True:
+            handler = irq_queue.get()
+            if handler is None:
+                return
+            with self.irq_lock:
+                start = time.perf_counter()
+                try:
+                    handler(self)
+                except Exception:
+                    traceback.print_exc()
+                self.isr_times.append(time.perf_counter() - start)
+                self.isr_count += 1
+
+
+    def _hop_loop(self):
+        hop_queue = self._hop_queue
+        while True:
+            handler = hop_queue.get()
+            if handler is None:
+                return
+            try:
+                handler(self)
+            except Exception:
+                traceback.print_exc()
+
+
+class Scheduler(object):
+    # micropython.schedule for the host: callbacks run one at a time, in order,
+    # on a worker thread standing in for the main VM loop
+    def __init__(self, depth=8):
+        self._queue = queue.Queue(depth)
+        threading.Thread(target=self._run, name="ulora-sched", daemon=True).start()
+
+    def schedule(self, func, arg):
+        try:
+            self._queue.put_nowait((func, arg))
+        except queue.Full:
+            raise RuntimeError("schedule queue full")
+
+    def _run(self):
+        while True:
+            func, arg = self._queue.get()
+            try:
+                func(arg)
+            except Exception:
+                traceback.print_exc()
+
+
+def demo(count=3, time_scale=0.05):
+    # client.py / server.py in one process
+    import ulora
+
+    channel = VirtualChannel(time_scale=time_scale)
+    server = ulora.LoRa(None, None, 2, None, freq=902.3, acks=True, receive_all=True,
+                        modem_config=ulora.ModemConfig.Lorawan, transport=channel.radio("server"))
+    client = ulora.LoRa(None, None, 1, None, freq=902.3, acks=True,
+                        modem_config=ulora.ModemConfig.Lorawan, transport=channel.radio("client"))
+
+    def on_recv(payload):
+        print("From:", payload.header_from)
+        print("Received:", payload.message)
+        print("RSSI: {}; SNR: {}".format(payload.rssi, payload.snr))
+
+    server.on_recv = on_recv
+    server.set_mode_rx()
+
+    for i in range(count):
+        print("sent" if client.send_to_wait("Blah, blah, blah %d" % i, 2) else "no ack")
+    channel.close()
+
+
+if __name__ == "__main__":
+    demo()
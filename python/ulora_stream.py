@@ -0,0 +1,204 @@
+"""
+Reliable, ordered delivery to one peer with a sliding window and selective acks.
+
+    stream = Stream(lora, SERVER_ADDRESS, window=8)
+    for reading in readings:
+        stream.send(reading)        # only waits when a window's worth is already waiting
+    stream.flush()                  # True once the peer has everything
+
+    # on the peer
+    stream = Stream(lora, CLIENT_ADDRESS, window=8)
+    stream.on_recv = lambda data: print(data)
+    lora.set_mode_rx()
+
+Frames keep the RadioHead header.  header_id is a sequence number and the
+kind bits of header_flags mark stream frames (ulora.KIND_STREAM).  The sender
+sends up to `window` frames back to back.  The last one of each burst is a
+KIND_STREAM_POLL, and the receiver answers it with one SACK: FLAGS_ACK set,
+header_id the next sequence number it expects (everything before it arrived),
+and a bitmap of the frames after that it already holds.  Only the frames
+still missing go out again.  A poll that gets no answer is repeated with the
+oldest unacked frame alone, up to `retries` times in a row.
+
+Both ends must use the same window.  Sequence numbers start at 0, so a
+stream is between two Stream objects created together (there is no
+handshake).  The receiving end works on an AsyncLoRa too, the sending end
+needs a plain LoRa.
+"""
+from ulora import FLAGS_ACK, FLAGS_KIND_MASK, KIND_STREAM, KIND_STREAM_POLL, ticks_ms, ticks_diff
+
+MAX_WINDOW = 64  # keeps "before" and "after" apart in the 8 bit sequence space
+
+
+class _Router(object):
+    # LoRa.handlers entry for the stream kinds, hands frames to the Stream of their sender
+    def __init__(self):
+        self.peers = {}
+
+    def __call__(self, payload):
+        stream = self.peers.get(payload.header_from)
+        if stream is not None:
+            stream._on_frame(payload)
+
+
+class Stream(object):
+    def __init__(self, lora, peer, window=8, retries=5):
+        """
+        Stream(lora, peer, window=8, retries=5)
+        lora: the LoRa instance to send and receive through
+        peer: address of the other end
+        window: frames in flight before waiting for a SACK, 1-64, the same on both ends
+        retries: unanswered polls in a row before flush() gives up
+        """
+        if not 1 <= window <= MAX_WINDOW:
+            raise ValueError("window out of range")
+        self.lora = lora
+        self.peer = peer
+        self.window = window
+        self.retries = retries
+        # None derives it from the time on air of a SACK, a number overrides it (seconds)
+        self.sack_timeout = None
+
+        # sender: data not yet numbered, numbered frames awaiting a SACK as [seq, data, sends]
+        self._pending = []
+        self._inflight = []
+        self._next_seq = 0
+        self._sack = None
+        self._timeouts = 0
+
+        # receiver: next sequence number to deliver and frames that arrived ahead of it
+        self._expected = 0
+        self._buffer = {}
+
+        self.frames_sent = 0
+        self.retransmits = 0
+        self.bytes_acked = 0
+        self.delivered = 0
+
+        router = lora.handlers.get(KIND_STREAM)
+        if router is None:
+            router = _Router()
+            lora.handlers[KIND_STREAM] = router
+            lora.handlers[KIND_STREAM_POLL] = router
+        router.peers[peer] = self
+
+    def on_recv(self, data):
+        # in order data from the peer, this should be overridden by the user
+        pass
+
+    def close(self):
+        self.lora.handlers[KIND_STREAM].peers.pop(self.peer, None)
+
+    @property
+    def pending(self):
+        # frames not yet acknowledged by the peer
+        return len(self._pending) + len(self._inflight)
+
+    def send(self, data):
+        # queue data, running the protocol only once a window's worth is waiting; False if the peer stopped answering
+        if type(data) == str:
+            data = data.encode()
+        if len(data) > self.lora.max_payload:
+            raise ValueError("payload too long")
+        self._pending.append(bytes(data))
+        while len(self._pending) >= self.window:
+            if not self._step():
+                return False
+        return True
+
+    def flush(self):
+        # send everything queued, True once the peer acknowledged all of it
+        while self._pending or self._inflight:
+            if not self._step():
+                return False
+        return True
+
+    def _step(self):
+        if self._timeouts > self.retries:
+            self._timeouts = 0
+            return False
+        self._round()
+        return True
+
+    def _sack_time(self):
+        if self.sack_timeout is not None:
+            return self.sack_timeout
+        return self.lora.time_on_air((self.window + 7) >> 3) * 1.1 + self.lora.ack_turnaround
+
+    def _round(self):
+        # one burst and the wait for its SACK
+        if self._timeouts:
+            # the last poll went unanswered, probe with the oldest frame alone
+            frames = self._inflight[:1]
+        else:
+            while self._pending and len(self._inflight) < self.window:
+                self._inflight.append([self._next_seq, self._pending.pop(0), 0])
+                self._next_seq = (self._next_seq + 1) & 0xff
+            frames = self._inflight
+
+        lora = self.lora
+        self._sack = None
+        last = len(frames) - 1
+        for i in range(len(frames)):
+            frame = frames[i]
+            lora.send(frame[1], self.peer, frame[0], KIND_STREAM_POLL if i == last else KIND_STREAM)
+            if frame[2]:
+                self.retransmits += 1
+            frame[2] += 1
+            self.frames_sent += 1
+        lora.wait_packet_sent()
+        lora.set_mode_rx()
+
+        start = ticks_ms()
+        timeout = int(self._sack_time() * 1000) + 1
+        while self._sack is None and ticks_diff(ticks_ms(), start) < timeout:
+            pass
+        sack = self._sack
+        if sack is None:
+            self._timeouts += 1
+            return
+        self._timeouts = 0
+        self._apply(sack.header_id, sack.message)
+
+    def _apply(self, ack, bitmap):
+        # drop the frames a SACK covers: everything before `ack` and the ones flagged in the bitmap
+        bits = len(bitmap) << 3
+        keep = []
+        for frame in self._inflight:
+            d = (frame[0] - ack) & 0xff
+            if d >= 0x80 or (0 < d <= bits and bitmap[(d - 1) >> 3] & (1 << ((d - 1) & 7))):
+                self.bytes_acked += len(frame[1])
+            else:
+                keep.append(frame)
+        self._inflight = keep
+
+    def _on_frame(self, payload):
+        # receive handler context
+        if payload.header_flags & FLAGS_ACK:
+            self._sack = payload
+            return
+
+        seq = payload.header_id
+        d = (seq - self._expected) & 0xff
+        if d == 0:
+            self._deliver(payload.message)
+            while self._expected in self._buffer:
+                self._deliver(self._buffer.pop(self._expected))
+        elif d < self.window:
+            self._buffer[seq] = payload.message
+        # else a repeat of something delivered already, the SACK below tells the sender
+
+        if (payload.header_flags & FLAGS_KIND_MASK) == KIND_STREAM_POLL:
+            self._send_sack()
+
+    def _deliver(self, data):
+        self._expected = (self._expected + 1) & 0xff
+        self.delivered += 1
+        self.on_recv(data)
+
+    def _send_sack(self):
+        bitmap = bytearray((self.window + 7) >> 3)
+        for i in range(self.window):
+            if ((self._expected + 1 + i) & 0xff) in self._buffer:
+                bitmap[i >> 3] |= 1 << (i & 7)
+        self.lora.send_control(bytes(bitmap), self.peer, self._expected, FLAGS_ACK | KIND_STREAM)